@@ -46,10 +46,18 @@ setup(
     ],
     extras_require={
         "test": [
+            "PyYAML",
             "testfixtures",
         ],
+        "yaml": [
+            "PyYAML",
+        ],
     },
     entry_points={
-        "console_scripts": ["check-chameleon = check_chameleon.check_chameleon:main"]
+        "console_scripts": [
+            "check-chameleon = check_chameleon.check_chameleon:main",
+            "check-chameleon-client = check_chameleon.daemon:client_main",
+            "check-chameleon-lsp = check_chameleon.lsp:main",
+        ]
     },
 )
@@ -0,0 +1,180 @@
+"""Throughput benchmarks for check-chameleon on a generated corpus.
+
+Run `python -m check_chameleon.benchmark --help` for the options. The report
+is JSON with sorted keys, so reports of different versions can be compared.
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import check_chameleon.cache
+import check_chameleon.check_chameleon
+from check_chameleon.benchmark.corpus import CorpusSettings, generate_corpus
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+# Bump when the structure of the report changes.
+SCHEMA = 2
+
+ATTRIBUTE_NAMES = ("href", "alt", "for", "aria-label", "role")
+
+# Runs `main()` on the files listed on stdin and prints its peak memory use.
+MEASURE_MAIN = """\
+import contextlib, io, json, sys
+from check_chameleon.benchmark import peak_rss_kb
+from check_chameleon.check_chameleon import main
+filenames = sys.stdin.read().splitlines()
+with contextlib.redirect_stdout(io.StringIO()):
+    main(["--no-cache", "--jobs=1", *filenames])
+print(json.dumps(peak_rss_kb()))
+"""
+
+
+def peak_rss_kb() -> int | None:
+    if resource is None:  # pragma: no cover
+        return None
+    # Kilobytes on Linux, but bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # pragma: no cover
+        peak //= 1024
+    return peak
+
+
+def _timing(seconds: float, files: int, nodes: int) -> dict:
+    return {
+        "seconds": round(seconds, 6),
+        "files_per_second": round(files / seconds, 1) if seconds else None,
+        "us_per_node": round(seconds * 1e6 / nodes, 3) if nodes else None,
+    }
+
+
+def main_peak_rss_kb(filenames: list[str]) -> int | None:
+    """Return the peak memory use of a process running `main()` on `filenames`.
+
+    A process of its own, as the benchmark holds the parsed corpus.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE_MAIN],
+        input="\n".join(filenames),
+        capture_output=True,
+        text=True,
+        check=True,
+        # Import the same check-chameleon, even if it is not installed.
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    ).stdout
+    return json.loads(output)
+
+
+def _best(repeat: int, func: typing.Callable[[], None]) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmark(filenames: list[str], repeat: int = 3) -> dict:
+    """Time checking `filenames` and return the report."""
+    Context = check_chameleon.check_chameleon.Context
+    contexts = [Context(filename) for filename in filenames]
+    for context in contexts:
+        context.parse()
+    nodes = sum(1 for context in contexts for _ in context.node.iter())
+    elements = [node for context in contexts for node in context.node.iter()]
+    files = len(filenames)
+
+    def run_contexts():
+        for filename in filenames:
+            Context(filename).run()
+
+    checks = {}
+    for check in check_chameleon.check_chameleon.load_checks():
+        tags = list(check_chameleon.check_chameleon.dispatch_table([check]))
+
+        def run_check(check=check, tags=tags):
+            for context in contexts:
+                for node in context.node.iter(*tags):
+                    check(context, node)
+                context.diagnostics.clear()
+
+        checks[check.__name__] = _timing(_best(repeat, run_check), files, nodes)
+
+    def run_attribute():
+        attribute = check_chameleon.check_chameleon.attribute
+        cache = {}
+        for node in elements:
+            for name in ATTRIBUTE_NAMES:
+                attribute(node, name, cache)
+
+    attribute_seconds = _best(repeat, run_attribute)
+    lookups = len(elements) * len(ATTRIBUTE_NAMES)
+
+    def run_main():
+        with contextlib.redirect_stdout(io.StringIO()):
+            check_chameleon.check_chameleon.main(["--no-cache", "--jobs=1", *filenames])
+
+    return {
+        "schema": SCHEMA,
+        "version": check_chameleon.cache.tool_version(),
+        "python": platform.python_version(),
+        "corpus": {"files": files, "nodes": nodes},
+        "context_run": _timing(_best(repeat, run_contexts), files, nodes),
+        "checks": checks,
+        "attribute": {
+            "lookups": lookups,
+            "us_per_lookup": round(attribute_seconds * 1e6 / lookups, 3)
+            if lookups
+            else None,
+        },
+        "main": {
+            **_timing(_best(repeat, run_main), files, nodes),
+            "peak_rss_kb": main_peak_rss_kb(filenames),
+        },
+    }
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    defaults = CorpusSettings()
+    parser = argparse.ArgumentParser(prog="python -m check_chameleon.benchmark")
+    for field in dataclasses.fields(CorpusSettings):
+        parser.add_argument(
+            "--{}".format(field.name.replace("_", "-")),
+            type=field.type,
+            default=getattr(defaults, field.name),
+        )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output", help="File to write the report to, instead of stdout."
+    )
+    args = parser.parse_args(argv)
+
+    settings = CorpusSettings(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(CorpusSettings)
+        }
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        report = run_benchmark(generate_corpus(directory, settings), args.repeat)
+    report["corpus"].update(dataclasses.asdict(settings))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            stream.write(output + "\n")
+    else:
+        print(output)
+    return 0
@@ -0,0 +1,4 @@
+from check_chameleon.benchmark import main
+
+if __name__ == "__main__":  # pragma: no cover
+    exit(main())
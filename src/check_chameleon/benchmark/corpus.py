@@ -0,0 +1,119 @@
+import dataclasses
+import os.path
+import random
+
+XHTML_HEADER = """\
+<html
+  xmlns="http://www.w3.org/1999/xhtml"
+  xmlns:tal="http://xml.zope.org/namespaces/tal">
+  <body>
+"""
+
+XHTML_FOOTER = """\
+  </body>
+</html>
+"""
+
+DOCTYPE = "<!DOCTYPE html [<!ENTITY nbsp 'no-break space'>]>\n"
+
+
+@dataclasses.dataclass
+class CorpusSettings:
+    """Shape of a generated template corpus.
+
+    Densities are the chance of each generated block to be a link, an image
+    or a labelled form field, the remaining blocks are paragraphs of text.
+    `tal_attributes` is the chance of an attribute to be set through
+    `tal:attributes` and `doctype` the chance of a template to start with a
+    DOCTYPE.
+    """
+
+    files: int = 100
+    size: int = 8192
+    link_density: float = 0.3
+    image_density: float = 0.1
+    label_density: float = 0.1
+    tal_attributes: float = 0.3
+    doctype: float = 0.5
+    seed: int = 0
+
+
+def _attributes(rng: random.Random, settings: CorpusSettings, **attributes) -> str:
+    plain = []
+    dynamic = []
+    for name, value in attributes.items():
+        name = name.replace("_", "-")
+        if rng.random() < settings.tal_attributes:
+            dynamic.append(f"{name} '{value}'")
+        else:
+            plain.append(f'{name}="{value}"')
+    if dynamic:
+        plain.append('tal:attributes="{}"'.format("; ".join(dynamic)))
+    return "".join(f" {attribute}" for attribute in plain)
+
+
+def _block(rng: random.Random, settings: CorpusSettings, number: int) -> str:
+    choice = rng.random()
+    if choice < settings.link_density:
+        if rng.random() < 0.1:
+            return f"    <a>Placeholder {number}</a>\n"
+        attributes = _attributes(rng, settings, href=f"page{number}.html")
+        if rng.random() < 0.2:
+            return f'    <a{attributes}><img src="icon.png" alt=""/></a>\n'
+        return f"    <a{attributes}>Link {number}</a>\n"
+    choice -= settings.link_density
+    if choice < settings.image_density:
+        if rng.random() < 0.1:
+            return f'    <img src="image{number}.png"/>\n'
+        attributes = _attributes(
+            rng, settings, src=f"image{number}.png", alt=f"Image {number}"
+        )
+        return f"    <img{attributes}/>\n"
+    choice -= settings.image_density
+    if choice < settings.label_density:
+        field = f"field{number}"
+        if rng.random() < 0.5:
+            return (
+                f"    <label>Field {number}"
+                f' <input type="text" name="{field}"/></label>\n'
+            )
+        attributes = _attributes(rng, settings, for_=field)
+        return (
+            f"    <label{attributes}>Field {number}</label>\n"
+            f'    <input id="{field}" type="text" name="{field}"/>\n'
+        )
+    return (
+        f"    <p>Paragraph {number} with <strong>some</strong> text"
+        f" and an entity&nbsp;here.</p>\n"
+    )
+
+
+def generate_template(rng: random.Random, settings: CorpusSettings) -> str:
+    parts = []
+    if rng.random() < settings.doctype:
+        parts.append(DOCTYPE)
+    parts.append(XHTML_HEADER)
+    length = sum(map(len, parts)) + len(XHTML_FOOTER)
+    number = 0
+    while length < settings.size:
+        block = _block(rng, settings, number)
+        parts.append(block)
+        length += len(block)
+        number += 1
+    parts.append(XHTML_FOOTER)
+    return "".join(parts)
+
+
+def generate_corpus(directory: str, settings: CorpusSettings) -> list[str]:
+    """Write a corpus of templates into `directory` and return their paths.
+
+    The same settings always give the same corpus.
+    """
+    rng = random.Random(settings.seed)
+    filenames = []
+    for number in range(settings.files):
+        filename = os.path.join(directory, f"template{number:05d}.cpt")
+        with open(filename, "w", encoding="utf-8") as stream:
+            stream.write(generate_template(rng, settings))
+        filenames.append(filename)
+    return filenames
@@ -0,0 +1,231 @@
+import collections
+import contextlib
+import hashlib
+import importlib.metadata
+import json
+import os
+import tempfile
+import time
+import typing
+
+from check_chameleon import diagnostics
+
+# Bump when the layout or the content of the cache entries changes.
+SCHEMA = 2
+
+# Upper bound on the number of result entries kept in the cache directory.
+MAX_ENTRIES = 20000
+
+# Files modified less than this many seconds ago are not trusted to the stat
+# index: a second write within the file system timestamp granularity would
+# leave size and mtime unchanged.
+RACY_SECONDS = 2
+
+
+# Entries kept in memory by long running processes, see `keep_in_memory()`.
+_memory: collections.OrderedDict | None = None
+_memory_size = MAX_ENTRIES
+
+
+def keep_in_memory(max_entries: int = MAX_ENTRIES) -> None:
+    """Also keep the most recently used cache entries in memory.
+
+    Meant for long running processes, which then mostly skip the cache
+    directory.
+    """
+    global _memory, _memory_size
+    _memory = collections.OrderedDict()
+    _memory_size = max_entries
+
+
+def _recall(key: str):
+    if _memory is None or key not in _memory:
+        return None
+    _memory.move_to_end(key)
+    return _memory[key]
+
+
+def _remember(key: str, value) -> None:
+    if _memory is None:
+        return
+    _memory[key] = value
+    _memory.move_to_end(key)
+    while len(_memory) > _memory_size:
+        _memory.popitem(last=False)
+
+
+def default_directory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "check-chameleon")
+
+
+def tool_version() -> str:
+    try:
+        return importlib.metadata.version("pre-commit-check-chameleon")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _digest(*parts: str | bytes) -> str:
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        hasher.update(part)
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _write_atomic(path: str, data: str) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as stream:
+            stream.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class Cache:
+    """Content addressed store of the diagnostics reported for a file.
+
+    A file is first looked up by its path, size and modification time, which
+    points to the hash of its content. Only when that misses the file is
+    read and hashed. Results are stored under the content hash together with
+    `salt`, which identifies the tool version and the enabled checks, and
+    whether the file is excluded from the accessibility checks, and the
+    macros it uses if those are taken into account.
+
+    Diagnostics are stored without the file name, so they are replayed for
+    whatever name the file is given.
+
+    Cache failures never fail a run: unreadable or unwritable entries are
+    treated as misses.
+    """
+
+    def __init__(self, directory: str, salt: str, max_entries: int = MAX_ENTRIES):
+        self.directory = directory
+        self.salt = _digest(str(SCHEMA), tool_version(), salt)
+        self.max_entries = max_entries
+        self.written = 0
+        self._keys = {}
+
+    def _stat_path(self, filename: str, stat: os.stat_result) -> str:
+        key = _digest(
+            os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns)
+        )
+        return os.path.join(self.directory, "stat", key[:2], key)
+
+    def _result_path(self, key: str) -> str:
+        return os.path.join(self.directory, "results", key[:2], key)
+
+    def _content_hash(self, filename: str) -> str | None:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        stat_path = self._stat_path(filename, stat)
+        content_hash = _recall(stat_path)
+        if content_hash is not None:
+            return content_hash
+        try:
+            with open(stat_path, encoding="utf-8") as stream:
+                return stream.read()
+        except OSError:
+            pass
+        try:
+            with open(filename, "rb") as stream:
+                content_hash = _digest(stream.read())
+        except OSError:
+            return None
+        if stat.st_mtime < time.time() - RACY_SECONDS:
+            _remember(stat_path, content_hash)
+            try:
+                _write_atomic(stat_path, content_hash)
+            except OSError:
+                pass
+        return content_hash
+
+    def get(
+        self, filename: str, excluded: bool, dependencies: typing.Sequence[str] = ()
+    ) -> list[diagnostics.Diagnostic] | None:
+        """Return the diagnostics of `filename`, None if it is not cached.
+
+        `dependencies` identify the other files the results depend on.
+        """
+        content_hash = self._content_hash(filename)
+        if content_hash is None:
+            return None
+        key = _digest(self.salt, content_hash, str(excluded), *dependencies)
+        self._keys[filename] = key
+        path = self._result_path(key)
+        rows = _recall(path)
+        if rows is None:
+            try:
+                with open(path, encoding="utf-8") as stream:
+                    rows = json.load(stream)
+                # Keep recently used entries from being pruned.
+                os.utime(path)
+            except (OSError, ValueError):
+                return None
+            _remember(path, rows)
+        return [diagnostics.Diagnostic(filename, *row) for row in rows]
+
+    def put(self, filename: str, reported: list[diagnostics.Diagnostic]) -> None:
+        key = self._keys.pop(filename, None)
+        if key is None:
+            return
+        rows = [list(diagnostic.fields()[1:]) for diagnostic in reported]
+        _remember(self._result_path(key), rows)
+        try:
+            _write_atomic(self._result_path(key), json.dumps(rows))
+        except OSError:
+            return
+        self.written += 1
+
+    def prune(self) -> None:
+        """Remove the least recently used entries above `max_entries`.
+
+        Walking the cache directory takes a while, so it is only done once a
+        tenth of `max_entries` entries were written since, counted over the
+        runs in the `writes` file. Other files in the directory, like the
+        macro index, are left alone.
+        """
+        if not self.written:
+            return
+        counter = os.path.join(self.directory, "writes")
+        try:
+            with open(counter, encoding="utf-8") as stream:
+                written = int(stream.read())
+        except (OSError, ValueError):
+            written = 0
+        written += self.written
+        self.written = 0
+        if written < self.max_entries // 10:
+            with contextlib.suppress(OSError):
+                _write_atomic(counter, str(written))
+            return
+        with contextlib.suppress(OSError):
+            _write_atomic(counter, "0")
+        entries = []
+        for part in ("stat", "results"):
+            for root, _, names in os.walk(os.path.join(self.directory, part)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    # Concurrent runs may prune at the same time.
+                    with contextlib.suppress(FileNotFoundError):
+                        entries.append((os.stat(path).st_mtime, path))
+        # Results and stat entries come in pairs, so allow twice the number.
+        # Prune somewhat below the limit, so the next runs need not prune.
+        limit = 2 * self.max_entries
+        if len(entries) <= limit:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - limit * 9 // 10]:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
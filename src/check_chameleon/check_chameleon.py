@@ -1,36 +1,229 @@
 import argparse
-import io
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import importlib.metadata
+import itertools
+import mmap
+import os
 import re
+import subprocess
+import sys
+import threading
+import time
+import tomllib
 import typing
 
 import lxml.etree
 
+from check_chameleon import cache, daemon, diff, discover
+from check_chameleon.diagnostics import FORMATTERS, SYNTAX_ERROR, Diagnostic
+
 NSMAP = {
     "xhtml": "http://www.w3.org/1999/xhtml",
     "tal": "http://xml.zope.org/namespaces/tal",
+    "metal": "http://xml.zope.org/namespaces/metal",
 }
 
-DOCTYPE_WRAPPER = """<!DOCTYPE html [<!ENTITY nbsp 'no-break space'>
+# Fed to the parser in front of templates without a DOCTYPE, so the entities
+# they commonly use are declared.
+DOCTYPE_PROLOG = b"""<!DOCTYPE html [<!ENTITY nbsp 'no-break space'>
 <!ENTITY times 'multiplication sign'>]>
-{0}"""
+"""
+
+# A byte order mark and XML declaration have to stay in front of the prolog.
+XML_DECLARATION = re.compile(rb"(?:\xef\xbb\xbf)?(?:<\?xml[^>]*\?>)?")
+
+# Files of at least this size are memory mapped and fed to the parser in
+# chunks instead of being read into memory as a whole.
+MMAP_THRESHOLD = 1 << 20
+FEED_CHUNK_SIZE = 1 << 16
+
+# Files of at least this size are checked while they are parsed, without
+# keeping the whole tree in memory.
+STREAM_THRESHOLD = 4 << 20
+
+# Below this number of files the start-up cost of a process pool outweighs
+# what it saves, unless the number of jobs is given explicitly.
+PARALLEL_MIN_FILES = 8
+
+# Content read ahead of the parser is capped at this many bytes, read by this
+# many threads.
+PREFETCH_BYTES = 64 << 20
+PREFETCH_THREADS = 4
+
+# Files are taken from the input in windows of this many, so checking starts
+# before the whole input is known.
+WINDOW_SIZE = 512
+
+# Files are sent to the worker processes in tasks of at most this many.
+MAX_CHUNK_SIZE = 32
+
+# Memory assumed to be taken by each process checking files, besides what it
+# reads ahead: the interpreter, lxml and the tree of the file being checked.
+PROCESS_MEMORY = 64 << 20
+
+CHECKS_ENTRY_POINT_GROUP = "check_chameleon.checks"
+
+BUILTIN_CHECKS = {
+    "CC001": "check_chameleon.checks:missing_href",
+    "CC002": "check_chameleon.checks:missing_alt",
+    "CC003": "check_chameleon.checks:missing_link_content",
+    "CC004": "check_chameleon.checks:missing_button_content",
+    "CC005": "check_chameleon.checks:missing_for",
+    "CC006": "check_chameleon.checks:dangling_for",
+    "CC007": "check_chameleon.checks:dangling_aria_reference",
+    "CC008": "check_chameleon.checks:duplicate_id",
+}
+
+# Checks only run when selected by their full code, as they report false
+# positives for templates only rendered as part of others.
+OPT_IN_CHECKS = frozenset({"CC006", "CC007", "CC008"})
 
 TAL_ATTRIBUTES = "{{{0}}}attributes".format(NSMAP["tal"])
+USE_MACRO = "{{{0}}}use-macro".format(NSMAP["metal"])
+# Elements with these attributes get content, including ids, from other
+# templates.
+METAL_CONTENT = frozenset(
+    "{{{0}}}{1}".format(NSMAP["metal"], name)
+    for name in ("use-macro", "define-slot", "fill-slot")
+)
+TAL_PREFIX = "{{{0}}}".format(NSMAP["tal"])
+# Attributes inserting content, which is markup with the `structure` keyword.
+# On `tal:` elements the attributes have no prefix.
+TAL_INSERTS = (f"{TAL_PREFIX}content", f"{TAL_PREFIX}replace")
+TAL_ELEMENT_INSERTS = TAL_INSERTS + ("content", "replace")
+STRUCTURE = re.compile(r"\s*structure\s")
+# A segment of a `tal:attributes` value, in which `;;` is an escaped `;`.
+TAL_ATTRIBUTES_SEGMENT = re.compile(r"(?:[^;]|;;)+")
 TAL_CONTENT_XPATH = (
     "./@tal:content|.//*/@tal:content|.//*/@tal:replace|.//tal:block/@replace"
 )
 
 
-def attribute(node, name):
+@functools.cache
+def xpath(expression: str) -> lxml.etree.XPath:
+    """Return `expression` compiled with the `NSMAP` prefixes bound.
+
+    Compiled expressions are shared, checks should use them instead of
+    `node.xpath()`, which compiles its expression on every call.
+    """
+    return lxml.etree.XPath(expression, namespaces=NSMAP)
+
+
+HAS_TEXT = xpath("boolean(.//text())")
+HAS_IMAGE = xpath("boolean(.//xhtml:img|.//img)")
+HAS_TAL_CONTENT = xpath(f"boolean({TAL_CONTENT_XPATH})")
+# Elements containing a slot are checked in the context of the templates
+# filling it, see `check_chameleon.macros`.
+HAS_DEFINE_SLOT = xpath("boolean(descendant-or-self::*[@metal:define-slot])")
+# Elements which may not be rendered, like the branches of a condition.
+# On `tal:` elements the attributes have no prefix.
+IS_CONDITIONAL = xpath(
+    "boolean(ancestor-or-self::*[@tal:condition or @tal:case]"
+    "|ancestor-or-self::tal:*[@condition or @case])"
+)
+HAS_FORM_CONTROL = xpath(
+    "boolean(.//xhtml:input|.//input|.//xhtml:select|.//select"
+    "|.//xhtml:textarea|.//textarea)"
+)
+
+
+_local = threading.local()
+
+
+def xml_parser() -> lxml.etree.XMLParser:
+    """Return the XML parser of the current thread.
+
+    lxml parsers can be reused for many documents, but not shared between
+    threads.
+    """
+    try:
+        return _local.parser
+    except AttributeError:
+        _local.parser = lxml.etree.XMLParser()
+        return _local.parser
+
+
+class _DiscardTarget:
+    """Parser target dropping the document: lxml builds no tree for it."""
+
+    def close(self):
+        return None
+
+
+def validating_parser() -> lxml.etree.XMLParser:
+    """Return the parser of the current thread that only checks the syntax.
+
+    It reports the same errors as `xml_parser()`, without building a tree.
+    """
+    try:
+        return _local.validating_parser
+    except AttributeError:
+        _local.validating_parser = lxml.etree.XMLParser(target=_DiscardTarget())
+        return _local.validating_parser
+
+
+def read_content(filename: str) -> bytes | mmap.mmap:
+    with open(filename, "rb") as stream:
+        if os.fstat(stream.fileno()).st_size >= MMAP_THRESHOLD:
+            return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        return stream.read()
+
+
+def is_excluded(filename: str, a11y_lint_exclude: str | None) -> bool:
+    """Tell whether `filename` is excluded from the accessibility checks."""
+    return a11y_lint_exclude is not None and filename.startswith(a11y_lint_exclude)
+
+
+def inserts_markup(node) -> bool:
+    """Tell whether `node` inserts markup, which may have any ids."""
+    names = TAL_ELEMENT_INSERTS if node.tag.startswith(TAL_PREFIX) else TAL_INSERTS
+    for name in names:
+        value = node.get(name)
+        if value is not None and STRUCTURE.match(value):
+            return True
+    return False
+
+
+def parse_tal_attributes(value: str) -> dict[str, str]:
+    """Parse a `tal:attributes` value into a mapping of name to expression.
+
+    `;;` stands for a literal semicolon. Empty segments and segments without
+    an expression are ignored.
+    """
+    parsed = {}
+    for segment in TAL_ATTRIBUTES_SEGMENT.findall(value):
+        parts = segment.replace(";;", ";").split(None, 1)
+        if len(parts) == 2:
+            parsed.setdefault(parts[0], parts[1].strip())
+    return parsed
+
+
+def attribute(node, name, tal_attributes_cache: dict | None = None):
+    """Return the value or expression of the attribute `name` of `node`.
+
+    Besides the attribute itself, this looks at `tal:attributes` and at the
+    `x-ng-attr-` and `x-ng-` attributes. Parsed `tal:attributes` values are
+    kept in `tal_attributes_cache` if given.
+    """
     found = node.attrib.get(name)
     if found is not None:
         return found
     tal_attributes = node.attrib.get(TAL_ATTRIBUTES)
     if tal_attributes is not None and name in tal_attributes:
-        for attr in tal_attributes.split(";"):
-            attr = attr.strip()
-            key, value = (el.strip() for el in attr.split(None, 1))
-            if name == key:
-                return value
+        if tal_attributes_cache is None:
+            parsed = parse_tal_attributes(tal_attributes)
+        else:
+            parsed = tal_attributes_cache.get(tal_attributes)
+            if parsed is None:
+                parsed = tal_attributes_cache[tal_attributes] = parse_tal_attributes(
+                    tal_attributes
+                )
+        found = parsed.get(name)
+        if found is not None:
+            return found
     x_ng_attr_attribute = node.attrib.get(f"x-ng-attr-{name}")
     if x_ng_attr_attribute is not None:
         return x_ng_attr_attribute
@@ -40,39 +233,357 @@ def attribute(node, name):
     return None
 
 
+def check(code: str, *tags: str, ids: bool = False):
+    """Declare a check with a stable `code` for the elements with `tags`.
+
+    Tags match both in the XHTML and in the empty namespace. The check is
+    called with the context and each matching element. Checks may only look
+    at the element and its descendants: large documents are checked while
+    they are parsed, when the rest of the tree is not available. The tag `*`
+    matches all elements; those checks are called when the start tag is
+    parsed, so they may only look at the attributes of the element.
+
+    Checks needing the ids of the whole document pass `ids=True`: the
+    document then gets an index of its ids, see `Context.ids`, and the check
+    can defer its verdict to the end of the document with `Context.defer()`.
+
+    Checks are made available through the `check_chameleon.checks` entry
+    point group, with the code as name.
+    """
+
+    def declare(func):
+        func.code = code
+        func.tags = tags
+        func.ids = ids
+        return func
+
+    return declare
+
+
+def available_checks() -> dict[str, typing.Any]:
+    """Return the entry point of each available check by code."""
+    available = {
+        code: importlib.metadata.EntryPoint(code, value, CHECKS_ENTRY_POINT_GROUP)
+        for code, value in BUILTIN_CHECKS.items()
+    }
+    for entry_point in importlib.metadata.entry_points(group=CHECKS_ENTRY_POINT_GROUP):
+        available.setdefault(entry_point.name, entry_point)
+    return available
+
+
+def check_distributions(checks: typing.Iterable[typing.Callable]) -> list[str]:
+    """Return the distribution and version providing each of `checks`.
+
+    Only checks of other packages, installed through the entry point group,
+    are listed, so their results are not cached across upgrades.
+    """
+    available = available_checks()
+    provided = []
+    for check in checks:
+        entry_point = available.get(check.code)
+        if entry_point is not None and entry_point.dist is not None:
+            dist = entry_point.dist
+            provided.append(f"{check.code} {dist.name} {dist.version}")
+    return provided
+
+
+def is_selected(
+    code: str,
+    select: typing.Sequence[str] | None = None,
+    ignore: typing.Sequence[str] = (),
+) -> bool:
+    """Tell whether `code` matches a prefix in `select` and none in `ignore`.
+
+    Without `select` all codes are selected. The `OPT_IN_CHECKS` are only
+    selected when `select` has their full code.
+    """
+    if code in OPT_IN_CHECKS:
+        if select is None or code not in select:
+            return False
+    elif select is not None and not code.startswith(tuple(select)):
+        return False
+    return not code.startswith(tuple(ignore))
+
+
+def extend_selection(
+    select: tuple[str, ...] | None, extend_select: typing.Sequence[str]
+) -> tuple[str, ...] | None:
+    """Return `select` with the codes of `extend_select` added.
+
+    Without `select` these are added to the default selection.
+    """
+    if not extend_select:
+        return select
+    # The empty prefix selects what is selected by default.
+    return (*(("",) if select is None else select), *extend_select)
+
+
+@functools.cache
+def load_checks(
+    select: tuple[str, ...] | None = None,
+    ignore: tuple[str, ...] = (),
+    rules: tuple[typing.Callable, ...] = (),
+) -> tuple[typing.Callable, ...]:
+    """Import the selected checks, sorted by code.
+
+    `rules` are the checks of declarative rules, see `load_rules()`.
+    """
+    checks = [
+        entry_point.load()
+        for code, entry_point in available_checks().items()
+        if is_selected(code, select, ignore)
+    ]
+    checks.extend(check for check in rules if is_selected(check.code, select, ignore))
+    return tuple(sorted(checks, key=lambda check: check.code))
+
+
+def load_rules(filenames: typing.Sequence[str]) -> tuple[typing.Callable, ...]:
+    """Return the checks of the rules in the files `filenames`.
+
+    See `check_chameleon.rules`.
+    """
+    if not filenames:
+        return ()
+    # Imported here, as it needs this module.
+    from check_chameleon import rules
+
+    return rules.load(filenames)
+
+
+def dispatch_table(
+    checks: typing.Iterable[typing.Callable],
+) -> dict[str, list[typing.Callable]]:
+    """Map the tags, with and without XHTML namespace, to their checks."""
+    table = {}
+    for func in checks:
+        for tag in func.tags:
+            keys = (tag,) if tag == "*" else (tag, f"{{{NSMAP['xhtml']}}}{tag}")
+            for key in keys:
+                table.setdefault(key, []).append(func)
+    return table
+
+
 class Context:
-    errors: list[str]
-    checks = None
+    diagnostics: list[Diagnostic]
 
-    def __init__(self, filename: str, a11y_lint_exclude=None):
-        with open(filename) as stream:
-            content = stream.read()
-        self.errors = []
-        self.node = None
-        if "<!DOCTYPE" not in content:
-            content = DOCTYPE_WRAPPER.format(content)
-            self.lineno_offset = len(DOCTYPE_WRAPPER.splitlines()) - 1
+    def __init__(
+        self,
+        filename: str,
+        a11y_lint_exclude=None,
+        stream_threshold: int | None = STREAM_THRESHOLD,
+        profile: bool = False,
+        checks: typing.Iterable[typing.Callable] | None = None,
+        content: bytes | mmap.mmap | None = None,
+        macros=None,
+        node=None,
+    ):
+        # Seconds spent per phase and per check, when profiling.
+        self.timings = None
+        if node is not None:
+            # Parsed by the caller, there is nothing to read.
+            content = b""
+        if content is not None:
+            # Read by the caller, for example ahead of time by `prefetch()`.
+            if profile:
+                self.timings = {"read": 0.0}
+        elif profile:
+            start = time.perf_counter()
+            content = read_content(filename)
+            self.timings = {"read": time.perf_counter() - start}
+        else:
+            content = read_content(filename)
+        self.diagnostics = []
+        # Code of the check running, reported with its diagnostics.
+        self.code = None
+        self.node = node
+        # Parsed `tal:attributes` values, shared by all checks.
+        self.tal_attributes = {}
+        if node is None and content.find(b"<!DOCTYPE") == -1:
+            self.prolog = DOCTYPE_PROLOG
+            self.lineno_offset = DOCTYPE_PROLOG.count(b"\n")
         else:
+            self.prolog = None
             self.lineno_offset = 0
         self.filename = filename
         self.content = content
         self.a11y_lint_exclude = a11y_lint_exclude
+        # Excluded files only get their syntax checked.
+        self.excluded = is_excluded(filename, a11y_lint_exclude)
+        self.stream_threshold = stream_threshold
+        if checks is None:
+            checks = load_checks()
+        self.checks = dispatch_table(checks)
+        # Lines of the elements by id, when a check needs them. Ids set by an
+        # expression are not known, and neither are the ids of the content
+        # coming from macros, in which case `ids_complete` is false.
+        self.ids = None
+        if any(func.ids for funcs in self.checks.values() for func in funcs):
+            self.ids = {}
+        self.ids_complete = True
+        # Verdicts of the checks waiting for the end of the document, with
+        # the position in document order of the element being checked.
+        self.deferred = []
+        self.position = 0
+        # The `check_chameleon.macros.MacroIndex` of the project, to check
+        # the document in the context of its macros.
+        self.macros = macros
 
-    @classmethod
-    def add_check(cls, func):
-        if cls.checks is None:
-            cls.checks = []
-        cls.checks.append(func)
-        return func
+    def attribute(self, node, name):
+        return attribute(node, name, self.tal_attributes)
 
     def report(self, node, msg):
-        self.errors.append(
-            f"{self.filename}:{node.sourceline - self.lineno_offset} {msg}"
+        self.diagnostics.append(
+            Diagnostic(
+                self.filename,
+                node.sourceline - self.lineno_offset,
+                None,
+                self.code,
+                msg,
+            )
         )
 
+    def defer(self, node, verdict: typing.Callable[["Context"], str | None]):
+        """Call `verdict` with the context at the end of the document.
+
+        When it returns a message, it is reported on `node` for the running
+        check. Only the line of `node` is kept, so streaming stays cheap.
+        """
+        self.deferred.append((self.position, self.code, node.sourceline, verdict))
+
+    def has_id(self, value: str) -> bool:
+        """Tell whether an element of the document may have the id `value`."""
+        return value in self.ids or not self.ids_complete
+
+    def index_id(self, node):
+        """Add `node` to the id index."""
+        value = node.get("id")
+        if value is None:
+            if self.attribute(node, "id") is not None:
+                self.ids_complete = False
+        elif "${" in value:
+            self.ids_complete = False
+        else:
+            self.ids.setdefault(value, []).append(node.sourceline)
+        if self.ids_complete and (
+            not METAL_CONTENT.isdisjoint(node.keys()) or inserts_markup(node)
+        ):
+            self.ids_complete = False
+
+    def start(self, node, every: list[typing.Callable]):
+        """Index `node` and run the checks of all elements on it."""
+        if self.ids is not None:
+            self.index_id(node)
+        for check in every:
+            self.code = check.code
+            check(self, node)
+
+    def finish(self):
+        """Report the verdicts deferred to the end of the document.
+
+        They are reported in document order, while streaming checks may run
+        at the end of their element instead of its start.
+        """
+        self.deferred.sort(key=lambda deferred: deferred[0])
+        for _, code, sourceline, verdict in self.deferred:
+            msg = verdict(self)
+            if msg is not None:
+                self.diagnostics.append(
+                    Diagnostic(
+                        self.filename, sourceline - self.lineno_offset, None, code, msg
+                    )
+                )
+        self.deferred.clear()
+
+    @property
+    def errors(self) -> list[str]:
+        """The diagnostics formatted as text."""
+        return [str(diagnostic) for diagnostic in self.diagnostics]
+
+    def chunks(self) -> typing.Iterator[bytes]:
+        """Yield the document to feed to the parser, including the prolog.
+
+        The parser picks up the encoding from the XML declaration, so that is
+        fed before the prolog.
+        """
+        content = self.content
+        start = 0
+        if self.prolog is not None:
+            start = XML_DECLARATION.match(content).end()
+            if start:
+                yield content[:start]
+            yield self.prolog
+        if isinstance(content, bytes) and start == 0:
+            yield content
+            return
+        for offset in range(start, len(content), FEED_CHUNK_SIZE):
+            yield content[offset : offset + FEED_CHUNK_SIZE]
+
+    @property
+    def streaming(self) -> bool:
+        return (
+            self.stream_threshold is not None
+            and len(self.content) >= self.stream_threshold
+        )
+
+    def timed(self, check: typing.Callable) -> typing.Callable:
+        """Wrap `check` to add the time it takes to the timings."""
+        timings = self.timings
+        name = check.__name__
+        timings.setdefault(name, 0.0)
+        clock = time.perf_counter
+
+        def timed_check(context, node):
+            start = clock()
+            try:
+                check(context, node)
+            finally:
+                timings[name] += clock() - start
+
+        timed_check.code = check.code
+        return timed_check
+
+    def dispatch(self) -> dict[typing.Any, list[typing.Callable]]:
+        """Return the checks to run per tag, timed when profiling."""
+        if self.timings is None:
+            return self.checks
+        timed = {}
+        return {
+            tag: [timed.setdefault(check, self.timed(check)) for check in checks]
+            for tag, checks in self.checks.items()
+        }
+
     def run(self):
         try:
-            self.node = lxml.etree.parse(io.StringIO(self.content)).getroot()
+            if self.node is not None:
+                # Parsed by the caller, so the syntax is valid.
+                if not self.excluded:
+                    self.walk()
+            elif self.excluded:
+                if self.timings is None:
+                    self.validate()
+                else:
+                    start = time.perf_counter()
+                    self.validate()
+                    self.timings["parse"] = time.perf_counter() - start
+            elif self.streaming:
+                start = time.perf_counter()
+                self.stream()
+                if self.timings is not None:
+                    # The checks ran while parsing.
+                    checks = sum(
+                        seconds
+                        for phase, seconds in self.timings.items()
+                        if phase != "read"
+                    )
+                    self.timings["parse"] = time.perf_counter() - start - checks
+            else:
+                if self.timings is None:
+                    self.parse()
+                else:
+                    start = time.perf_counter()
+                    self.parse()
+                    self.timings["parse"] = time.perf_counter() - start
+                self.walk()
         except lxml.etree.XMLSyntaxError as e:
             # Line number offset correction.
             msg = e.msg
@@ -81,142 +592,860 @@ class Context:
                     f"line {line_number}",
                     f"line {int(line_number) - self.lineno_offset}",
                 )
-            self.errors.append(f"{self.filename}: {msg}")
-        else:
-            for check in self.checks:
-                if self.a11y_lint_exclude is not None:
-                    if self.filename.startswith(self.a11y_lint_exclude):
-                        continue
-                check(self)
+            # Like in tree mode, an invalid document only reports the syntax
+            # error.
+            self.diagnostics = [
+                Diagnostic(
+                    self.filename,
+                    e.lineno - self.lineno_offset,
+                    e.position[1],
+                    SYNTAX_ERROR,
+                    msg,
+                )
+            ]
         return self.errors
 
+    def release(self):
+        """Drop the tree and content of the document once it is checked.
 
-@Context.add_check
-def missing_href(context):
-    for link in context.node.xpath("//xhtml:a|//a", namespaces=NSMAP):
-        href = attribute(link, "href")
-        if href is None:
-            context.report(
-                link,
-                "The <a> element is missing the href attribute."
-                " Without the href attribute an anchor represents"
-                " a placeholder for where a link might otherwise have"
-                " been placed and is invisible for screen readers."
-                " If the <a> is used to create interactive clickable"
-                " elements, consider using the <button type=“button”>"
-                " element instead for this.",
-            )
-        elif href.strip() == "#":
-            if attribute(link, "role") == "button":
-                continue
-            if attribute(link, "preventDefault"):
-                continue
-            context.report(
-                link,
-                'The <a> element href attribute should not be a single "#",'
-                " it can cause the page to scroll back to the top and it adds"
-                " an entry to the browser history, so it takes an additiona "
-                " click of the back button to go to the previous page."
-                " Consider using a <button type=“button”> element to create"
-                " interactive clickable elements.",
+        Memory mapped content is unmapped right away, instead of whenever the
+        context is collected.
+        """
+        self.node = None
+        self.tal_attributes = {}
+        content, self.content = self.content, None
+        if isinstance(content, mmap.mmap):
+            content.close()
+
+    def parse(self):
+        parser = xml_parser()
+        for chunk in self.chunks():
+            parser.feed(chunk)
+        self.node = parser.close()
+
+    def validate(self):
+        """Check the syntax of the document, without building a tree."""
+        parser = validating_parser()
+        for chunk in self.chunks():
+            parser.feed(chunk)
+        parser.close()
+
+    def walk(self):
+        # Walk the tree once, dispatching each element to the checks
+        # interested in its tag.
+        checks = self.dispatch()
+        every = checks.get("*", ())
+        if every or self.ids is not None or self.macros is not None:
+            for self.position, node in enumerate(self.node.iter(lxml.etree.Element)):
+                self.start(node, every)
+                if self.macros is not None:
+                    self.check_with_macros(node, checks)
+                    continue
+                for check in checks.get(node.tag, ()):
+                    self.code = check.code
+                    check(self, node)
+        else:
+            for self.position, node in enumerate(self.node.iter()):
+                for check in checks.get(node.tag, ()):
+                    self.code = check.code
+                    check(self, node)
+        self.finish()
+
+    def check_with_macros(self, node, checks):
+        """Check `node` like `walk()` does, taking macros into account.
+
+        Elements containing a slot are left to the templates filling it. The
+        macro used by `node` is checked as assembled with its slots filled.
+        """
+        node_checks = checks.get(node.tag)
+        if node_checks and not HAS_DEFINE_SLOT(node):
+            for check in node_checks:
+                self.code = check.code
+                check(self, node)
+        if node.get(USE_MACRO) is not None:
+            self.check_macro_use(node, checks)
+
+    def check_macro_use(self, use, checks):
+        assembled = self.macros.assemble(use, self.filename)
+        if assembled is None:
+            return
+        path, name, around, lineno_offset = assembled
+        diagnostics = self.diagnostics
+        self.diagnostics = []
+        try:
+            for node in around:
+                for check in checks.get(node.tag, ()):
+                    self.code = check.code
+                    check(self, node)
+        finally:
+            found, self.diagnostics = self.diagnostics, diagnostics
+        line = use.sourceline - self.lineno_offset
+        for diagnostic in found:
+            # Reported on the use of the macro, as that decides the content.
+            macro_line = diagnostic.line + self.lineno_offset - lineno_offset
+            self.diagnostics.append(
+                Diagnostic(
+                    self.filename,
+                    line,
+                    None,
+                    diagnostic.code,
+                    f"In macro {name or '(template)'} of {os.path.relpath(path)}"
+                    f" line {macro_line}: {diagnostic.message}",
+                )
             )
 
+    def events(self, parser) -> typing.Iterator[tuple[str, typing.Any]]:
+        for chunk in self.chunks():
+            parser.feed(chunk)
+            yield from parser.read_events()
+        self.node = parser.close()
+        yield from parser.read_events()
+
+    def stream(self):
+        """Check the document while parsing it.
 
-@Context.add_check
-def missing_alt(context):
-    for image in context.node.xpath("//xhtml:img|//img", namespaces=NSMAP):
-        alt = attribute(image, "alt")
-        if alt is None:
-            context.report(
-                image,
-                "The <img> element requires an alt attribute. The alt"
-                " attribute provides descriptive information for an image if a"
-                " user for some reason cannot view it (because of slow"
-                " connection, an error, or if the user uses a screen reader)."
-                " If the image is considered decorative, the alt attribute"
-                " should be left empty, but not removed, so screen readers"
-                " will ignore the image.",
+        Checks run when the end of their element is parsed, so its subtree
+        is complete. Once no element with checks is open anymore, processed
+        elements are removed from the tree, keeping memory use bounded.
+        Errors are reported in the same order as the tree walk does.
+        """
+        checks = self.dispatch()
+        every = checks.get("*", ())
+        starting = bool(every) or self.ids is not None
+        macros = self.macros
+        parser = lxml.etree.XMLPullParser(events=("start", "end"))
+        reported = []
+        starts = {}
+        index = 0
+        for event, node in self.events(parser):
+            node_checks = checks.get(node.tag) or (
+                macros is not None and node.get(USE_MACRO) is not None
             )
+            if event == "start":
+                index += 1
+                self.position = index
+                if starting:
+                    self.start(node, every)
+                    reported.extend(
+                        (index, diagnostic) for diagnostic in self.diagnostics
+                    )
+                    self.diagnostics.clear()
+                if node_checks:
+                    starts[node] = index
+                continue
+            if node_checks:
+                self.position = starts.pop(node)
+                if macros is not None:
+                    self.check_with_macros(node, checks)
+                else:
+                    for check in node_checks:
+                        self.code = check.code
+                        check(self, node)
+                reported.extend(
+                    (self.position, diagnostic) for diagnostic in self.diagnostics
+                )
+                self.diagnostics.clear()
+            if not starts:
+                node.clear(keep_tail=True)
+                parent = node.getparent()
+                while parent is not None and node.getprevious() is not None:
+                    del parent[0]
+        reported.sort(key=lambda item: item[0])
+        self.diagnostics = [diagnostic for _, diagnostic in reported]
+        self.finish()
 
 
-@Context.add_check
-def missing_link_content(context):
-    for link in context.node.xpath("//xhtml:a|//a", namespaces=NSMAP):
-        if link.xpath(".//text()"):
-            continue
-        if link.xpath(".//xhtml:img|.//img", namespaces=NSMAP):
-            continue
-        if link.xpath(TAL_CONTENT_XPATH, namespaces=NSMAP):
-            continue
-        if attribute(link, "aria-label"):
-            continue
-        context.report(
-            link,
-            "The <a> element requires descriptive content that help users"
-            " better understand what they can expect if they click the link."
-            " An <a> element without descriptive text will only announce the"
-            " href path to screen reader users. Keep in mind that users of"
-            " screen readers have trouble distinguishing icons and need"
-            " descriptive text to understand the context of the <button>."
-            " Consider adding descriptive content in the form of text, an"
-            " aria-label attribute or an image.",
-        )
+class Result(typing.NamedTuple):
+    diagnostics: list[Diagnostic]
+    # Seconds per phase and check when profiling, None for cached results.
+    timings: dict[str, float] | None = None
+
+
+def check_file(
+    filename: str,
+    a11y_lint_exclude=None,
+    stream_threshold=STREAM_THRESHOLD,
+    profile=False,
+    select: tuple[str, ...] | None = None,
+    ignore: tuple[str, ...] = (),
+    content: bytes | mmap.mmap | None = None,
+    macros=None,
+    rules: tuple[str, ...] = (),
+    checks: tuple[typing.Callable, ...] | None = None,
+) -> Result:
+    """Check the template `filename`.
+
+    `checks` are the checks to run, loaded once by the caller checking many
+    files, otherwise they are selected by `select`, `ignore` and `rules`.
+    """
+    if checks is None:
+        checks = load_checks(select, ignore, load_rules(rules))
+    context = Context(
+        filename,
+        a11y_lint_exclude=a11y_lint_exclude,
+        stream_threshold=stream_threshold,
+        profile=profile,
+        checks=checks,
+        content=content,
+        macros=macros,
+    )
+    try:
+        context.run()
+    finally:
+        context.release()
+    return Result(context.diagnostics, context.timings)
+
+
+def check_bytes(
+    data: bytes | str,
+    name: str = "<bytes>",
+    a11y_lint_exclude=None,
+    select: typing.Iterable[str] | None = None,
+    ignore: typing.Iterable[str] = (),
+    macros=None,
+    rules: tuple[str, ...] = (),
+) -> list[Diagnostic]:
+    """Check the template `data` and return the diagnostics.
+
+    Like `check_file()` for a template in memory, reported as `name`. Text is
+    encoded as UTF-8.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return check_file(
+        name,
+        a11y_lint_exclude=a11y_lint_exclude,
+        content=data,
+        macros=macros,
+        # The checks are cached per selection, which needs to be hashable.
+        checks=load_checks(
+            None if select is None else tuple(select),
+            tuple(ignore),
+            load_rules(rules),
+        ),
+    ).diagnostics
+
+
+def check_tree(
+    element,
+    name: str = "<tree>",
+    a11y_lint_exclude=None,
+    select: typing.Iterable[str] | None = None,
+    ignore: typing.Iterable[str] = (),
+    macros=None,
+    rules: tuple[str, ...] = (),
+) -> list[Diagnostic]:
+    """Check a template already parsed by lxml and return the diagnostics.
+
+    `element` is the root element or the element tree, reported as `name`
+    with the line numbers of the source it was parsed from. The tree is not
+    modified.
+    """
+    if isinstance(element, lxml.etree._ElementTree):
+        element = element.getroot()
+    context = Context(
+        name,
+        a11y_lint_exclude=a11y_lint_exclude,
+        checks=load_checks(
+            None if select is None else tuple(select),
+            tuple(ignore),
+            load_rules(rules),
+        ),
+        macros=macros,
+        node=element,
+    )
+    context.run()
+    return context.diagnostics
+
+
+def _file_size(filename: str) -> int:
+    try:
+        return os.stat(filename).st_size
+    except OSError:
+        # Reading the file reports the error.
+        return 0
+
+
+def _read_ahead(filename: str) -> bytes | mmap.mmap:
+    content = read_content(filename)
+    if isinstance(content, mmap.mmap) and hasattr(mmap, "MADV_WILLNEED"):
+        # Have the kernel page the file in before the parser gets to it.
+        content.madvise(mmap.MADV_WILLNEED)
+    return content
+
+
+def prefetch(
+    filenames: typing.Iterable[str], max_bytes: int = PREFETCH_BYTES
+) -> typing.Iterator[tuple[str, concurrent.futures.Future]]:
+    """Yield each of `filenames` with the future of its content.
+
+    Files are read in threads ahead of the consumer, up to `max_bytes` of
+    content not yet handed out, but always at least the next file. Closing
+    the iterator early cancels the reads not started yet.
+    """
+    remaining = iter(filenames)
+    upcoming = next(remaining, None)
+    queued = collections.deque()
+    buffered = 0
+    executor = concurrent.futures.ThreadPoolExecutor(PREFETCH_THREADS)
+    try:
+        while True:
+            while upcoming is not None and (not queued or buffered < max_bytes):
+                size = _file_size(upcoming)
+                queued.append((upcoming, executor.submit(_read_ahead, upcoming), size))
+                buffered += size
+                upcoming = next(remaining, None)
+            if not queued:
+                return
+            filename, content, size = queued.popleft()
+            buffered -= size
+            yield filename, content
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _check_serially(
+    filenames: typing.Iterable[str], prefetch_bytes: int = PREFETCH_BYTES, **options
+) -> typing.Iterator[Result]:
+    if prefetch_bytes <= 0:
+        for filename in filenames:
+            yield check_file(filename, **options)
+        return
+    for filename, future in prefetch(filenames, prefetch_bytes):
+        start = time.perf_counter()
+        content = future.result()
+        waited = time.perf_counter() - start
+        result = check_file(filename, content=content, **options)
+        # Do not keep the content alive while waiting for the next file.
+        del content, future
+        if result.timings is not None:
+            # Only the time the reader had to be waited for counts.
+            result.timings["read"] = waited
+        yield result
+
 
+# The options of the pool worker running in this process, see `_init_worker()`.
+_worker_options = {}
 
-@Context.add_check
-def missing_button_content(context):
-    for button in context.node.xpath("//xhtml:button|//button", namespaces=NSMAP):
-        if button.xpath(".//text()"):
-            continue
-        if button.xpath(TAL_CONTENT_XPATH, namespaces=NSMAP):
-            continue
-        if attribute(button, "aria-label"):
-            continue
-        context.report(
-            button,
-            "The <button> element requires descriptive text that helps users"
-            " understand what they can expect when they click it. Keep in mind"
-            " that users of screen readers have trouble distinguishing icons"
-            " and need descriptive text to understand the context of the"
-            " <button>. Consider adding descriptive text in the form of text"
-            " or an aria-label attribute.",
+
+def _init_worker(options: dict[str, typing.Any]) -> None:
+    # The options, which include the macro index, are sent to each worker
+    # once instead of with every task. The checks are loaded once per worker
+    # as well, as compiled rules cannot be sent.
+    _worker_options.update(options)
+    _worker_options["checks"] = load_checks(
+        options.get("select"),
+        options.get("ignore", ()),
+        load_rules(options.get("rules", ())),
+    )
+
+
+def _check_chunk(filenames: list[str], **options) -> list[Result]:
+    return list(_check_serially(filenames, **_worker_options, **options))
+
+
+def _windows(filenames: typing.Iterable[str], size: int) -> typing.Iterator[list[str]]:
+    iterator = iter(filenames)
+    while window := list(itertools.islice(iterator, size)):
+        yield window
+
+
+def _submit(
+    executor: concurrent.futures.Executor,
+    filenames: list[str],
+    jobs: int,
+    max_chunk_size: int = MAX_CHUNK_SIZE,
+) -> list[tuple[concurrent.futures.Future, int]]:
+    """Spread `filenames` over the pool, largest first.
+
+    Return the task and the position in its results of each file.
+    """
+    order = sorted(
+        range(len(filenames)), key=lambda i: os.path.getsize(filenames[i]), reverse=True
+    )
+    # Send several files per task to keep the IPC overhead low, while
+    # leaving enough tasks to balance the load between the workers.
+    chunksize = max(1, min(max_chunk_size, len(filenames) // (jobs * 4)))
+    located = [None] * len(filenames)
+    for start in range(0, len(order), chunksize):
+        chunk = order[start : start + chunksize]
+        task = executor.submit(_check_chunk, [filenames[index] for index in chunk])
+        for position, index in enumerate(chunk):
+            located[index] = (task, position)
+    return located
+
+
+def plan_memory(
+    max_memory: int, jobs: int, prefetch_bytes: int = PREFETCH_BYTES
+) -> tuple[int, int]:
+    """Return the number of jobs and read-ahead bytes fitting in `max_memory`.
+
+    Each process is assumed to take `PROCESS_MEMORY` plus what it reads
+    ahead. Parallelism is reduced first, down to a single process, then
+    read-ahead.
+    """
+    jobs = max(1, min(jobs, max_memory // PROCESS_MEMORY))
+    prefetch_bytes = max(0, min(prefetch_bytes, max_memory // jobs - PROCESS_MEMORY))
+    return jobs, prefetch_bytes
+
+
+def check_files(
+    filenames: typing.Iterable[str],
+    jobs: int = 0,
+    result_cache: cache.Cache | None = None,
+    batch_size: int = WINDOW_SIZE,
+    max_files_per_worker: int = 0,
+    max_memory: int | None = None,
+    **options,
+) -> typing.Iterator[tuple[str, Result]]:
+    """Check `filenames`, yielding `(filename, result)` in input order.
+
+    Files found in `result_cache` are not checked again. The others are
+    spread over a process pool when there is more than one job, largest files
+    first so a big file does not end up running alone at the end. `jobs=0`
+    picks the number of CPUs, but stays serial for a handful of files.
+
+    `filenames` are taken in windows of `batch_size`, the next window is
+    sent to the pool while the results of the current one are yielded. So a
+    lazily produced input, like a directory walk, overlaps with checking, and
+    at most two windows are held in memory however long the input is.
+    Worker processes are replaced after checking `max_files_per_worker`
+    files, if given. `max_memory` in bytes caps the number of jobs and the
+    read-ahead, see `plan_memory()`.
+
+    Closing the iterator early cancels the work not started yet.
+    """
+    auto = jobs <= 0
+    if auto:
+        jobs = os.cpu_count() or 1
+    if max_memory is not None:
+        jobs, options["prefetch_bytes"] = plan_memory(
+            max_memory, jobs, options.get("prefetch_bytes", PREFETCH_BYTES)
         )
+    max_chunk_size = MAX_CHUNK_SIZE
+    recycling = {}
+    if max_files_per_worker > 0:
+        max_chunk_size = min(MAX_CHUNK_SIZE, max_files_per_worker)
+        recycling["max_tasks_per_child"] = max_files_per_worker // max_chunk_size
+    a11y_lint_exclude = options.get("a11y_lint_exclude")
+    macros = options.get("macros")
+    executor = None
 
+    def start(window: list[str]):
+        nonlocal executor
+        cached = {}
+        if result_cache is not None:
+            for index, filename in enumerate(window):
+                diagnostics = result_cache.get(
+                    filename,
+                    is_excluded(filename, a11y_lint_exclude),
+                    () if macros is None else macros.dependency_key(filename),
+                )
+                if diagnostics is not None:
+                    cached[index] = Result(diagnostics)
+        uncached = [
+            filename for index, filename in enumerate(window) if index not in cached
+        ]
+        if jobs > 1 and len(uncached) >= (PARALLEL_MIN_FILES if auto else 2):
+            if executor is None:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=jobs,
+                    initializer=_init_worker,
+                    initargs=(
+                        {
+                            name: value
+                            for name, value in options.items()
+                            if name != "checks"
+                        },
+                    ),
+                    **recycling,
+                )
+            located = _submit(executor, uncached, jobs, max_chunk_size)
+            checked = (task.result()[position] for task, position in located)
+        else:
+            checked = _check_serially(uncached, **options)
+        return window, cached, checked
+
+    def finish(window: list[str], cached: dict[int, Result], checked):
+        for index, filename in enumerate(window):
+            result = cached.get(index)
+            if result is None:
+                result = next(checked)
+                if result_cache is not None:
+                    result_cache.put(filename, result.diagnostics)
+            yield filename, result
+
+    previous = None
+    completed = False
+    try:
+        for window in _windows(filenames, batch_size):
+            current = start(window)
+            if previous is not None:
+                yield from finish(*previous)
+            previous = current
+        if previous is not None:
+            yield from finish(*previous)
+        completed = True
+    finally:
+        if executor is not None:
+            # Drop the tasks not started yet when the caller stops early.
+            # Waiting for the workers lets them exit before the interpreter
+            # tears down the pipes to them.
+            executor.shutdown(wait=True, cancel_futures=not completed)
 
-@Context.add_check
-def missing_for(context):
-    for label in context.node.xpath("//xhtml:label|//label", namespaces=NSMAP):
-        if label.xpath(".//xhtml:input|.//input", namespaces=NSMAP):
-            continue
-        if label.xpath(".//xhtml:select|.//select", namespaces=NSMAP):
-            continue
-        if label.xpath(".//xhtml:textarea|.//textarea", namespaces=NSMAP):
-            continue
-        label_for = attribute(label, "for")
-        if label_for is None:
-            context.report(
-                label,
-                "The <label> element needs to be explicitly associated with a"
-                " form control through the use of nesting or the for"
-                " attribute, whose value needs to correspond to the value of"
-                " the id attribute of the associated form control element"
-                " (<input>, <textarea> and <select>).",
-            )
+
+def print_profile(timings: dict[str, dict[str, float] | None], slowest: int) -> None:
+    """Print the total time per phase and check, and the slowest files."""
+    file = sys.stderr
+    totals = {}
+    for file_timings in timings.values():
+        for phase, seconds in (file_timings or {}).items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+    cached = sum(1 for file_timings in timings.values() if file_timings is None)
+    print(f"Profile of {len(timings)} files ({cached} cached):", file=file)
+    for phase, seconds in sorted(totals.items(), key=lambda item: -item[1]):
+        print(f"  {seconds:10.6f}s  {phase}", file=file)
+    checked = [
+        (sum(file_timings.values()), filename)
+        for filename, file_timings in timings.items()
+        if file_timings is not None
+    ]
+    if checked and slowest:
+        print("Slowest files:", file=file)
+        for seconds, filename in sorted(checked, reverse=True)[:slowest]:
+            print(f"  {seconds:10.6f}s  {filename}", file=file)
+
+
+def read_config(filename: str = "pyproject.toml") -> dict[str, typing.Any]:
+    """Return the `[tool.check-chameleon]` table of `filename`, if any."""
+    try:
+        with open(filename, "rb") as stream:
+            config = tomllib.load(stream)
+    except FileNotFoundError:
+        return {}
+    return config.get("tool", {}).get("check-chameleon", {})
+
+
+def _comma_separated(value: str) -> tuple[str, ...]:
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def _count(value: str, minimum: int) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}") from None
+    if number < minimum:
+        raise argparse.ArgumentTypeError(f"must be at least {minimum}: {value!r}")
+    return number
+
+
+def _positive(value: str) -> int:
+    return _count(value, 1)
+
+
+def _non_negative(value: str) -> int:
+    return _count(value, 0)
 
 
 def main(argv: typing.Sequence[str] | None = None) -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--a11y-lint-exclude")
-    parser.add_argument("filenames", nargs="*")
+    parser.add_argument(
+        "--select",
+        type=_comma_separated,
+        metavar="CODES",
+        help="Comma separated codes or code prefixes of the checks to run,"
+        " all by default. Syntax is always checked.",
+    )
+    parser.add_argument(
+        "--ignore",
+        type=_comma_separated,
+        metavar="CODES",
+        help="Comma separated codes or code prefixes of the checks to skip.",
+    )
+    parser.add_argument(
+        "--extend-select",
+        type=_comma_separated,
+        metavar="CODES",
+        help="Comma separated codes or code prefixes of checks to run in"
+        " addition to the selected ones, like the opt-in CC006,CC007,CC008.",
+    )
+    parser.add_argument(
+        "--rules",
+        action="append",
+        metavar="FILE",
+        help="YAML or TOML file of declarative rules to check as well, can be"
+        " given more than once.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Number of processes to check files with, 0 (the default)"
+        " picks the number of CPUs.",
+    )
+    parser.add_argument(
+        "--stream-threshold",
+        type=int,
+        default=STREAM_THRESHOLD,
+        help="Check files of at least this many bytes while parsing them,"
+        " without keeping the whole document in memory.",
+    )
+    parser.add_argument(
+        "--prefetch-bytes",
+        type=_non_negative,
+        default=PREFETCH_BYTES,
+        help="Read files ahead of checking them, up to this many bytes."
+        " 0 reads each file when it is checked.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=_positive,
+        default=WINDOW_SIZE,
+        help="Take the files in batches of this many, at most two batches are"
+        " in memory at a time.",
+    )
+    parser.add_argument(
+        "--max-files-per-worker",
+        type=_non_negative,
+        default=0,
+        metavar="N",
+        help="Replace the worker processes after they checked N files."
+        " 0 keeps them for the whole run.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=_positive,
+        metavar="MIB",
+        help="Limit the number of jobs and the read-ahead to fit in this many MiB.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=cache.default_directory(),
+        help="Directory to cache the results of unchanged files in.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache_dir",
+        action="store_const",
+        const=None,
+        help="Do not use the result cache.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=int,
+        nargs="?",
+        const=10,
+        metavar="N",
+        help="Print the time spent reading, parsing and per check to stderr,"
+        " with the N (default 10) slowest files.",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="Only check files with staged changes and only report errors on"
+        " changed lines.",
+    )
+    parser.add_argument(
+        "--diff-range",
+        metavar="RANGE",
+        help="Like --diff, but for the changes in a git revision range, for"
+        " example origin/main...HEAD.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Serve check-chameleon-client in this repository until idle.",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=daemon.IDLE_TIMEOUT,
+        help="Seconds without requests after which the daemon stops.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and check the templates again when they change,"
+        " printing the errors that are new or resolved.",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop after the first file with errors.",
+    )
+    parser.add_argument(
+        "--max-errors",
+        type=_positive,
+        metavar="N",
+        help="Stop after reporting N errors.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATTERS),
+        default="text",
+        help="Output format, written per file as soon as it is checked.",
+    )
+    parser.add_argument(
+        "--include",
+        type=_comma_separated,
+        metavar="GLOBS",
+        help="Comma separated globs of the files to check in directories,"
+        " default *.cpt.",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=_comma_separated,
+        metavar="GLOBS",
+        help="Comma separated globs of the files and directories to skip.",
+    )
+    parser.add_argument(
+        "--macros",
+        action="store_true",
+        default=None,
+        help="Check templates in the context of the METAL macros they use,"
+        " and also check the templates using macros of the given files.",
+    )
+    parser.add_argument(
+        "filenames",
+        nargs="*",
+        help="Files to check, or directories to search for templates.",
+    )
     args = parser.parse_args(argv)
 
-    errors = []
-    for filename in args.filenames:
-        errors += Context(filename, a11y_lint_exclude=args.a11y_lint_exclude).run()
-    if len(errors):
-        print("\n".join(errors))
-        return 1
-    return 0
+    if args.daemon:
+        return daemon.serve(os.getcwd(), args.idle_timeout)
+    if args.watch and (args.diff or args.diff_range):
+        parser.error("--watch cannot be combined with --diff or --diff-range")
+
+    config = read_config()
+    include = args.include
+    if include is None:
+        include = tuple(config.get("include", discover.DEFAULT_INCLUDE))
+    exclude = args.exclude
+    if exclude is None:
+        exclude = tuple(config.get("exclude", ()))
+    filenames = discover.find_templates(args.filenames, include, exclude)
+    use_macros = args.macros if args.macros is not None else config.get("macros")
+    macro_index = None
+    if use_macros:
+        # Imported here, as it needs this module.
+        from check_chameleon import macros
+
+        root = daemon.repository_root(os.getcwd())
+        macro_index = macros.MacroIndex.load(
+            None if args.cache_dir is None else macros.index_path(args.cache_dir, root)
+        )
+        macro_index.update(discover.find_templates([root], include, exclude))
+        macro_index.save()
+        filenames = list(filenames)
+        filenames += [
+            os.path.relpath(path) for path in macro_index.dependents(filenames)
+        ]
+    changed = None
+    if args.diff or args.diff_range:
+        try:
+            changed = diff.changed_lines(args.diff_range)
+        except (OSError, subprocess.CalledProcessError) as e:
+            parser.error(f"cannot read the git diff: {getattr(e, 'stderr', e)}")
+        filenames = (
+            filename for filename in filenames if os.path.abspath(filename) in changed
+        )
+
+    select = args.select
+    if select is None and "select" in config:
+        select = tuple(config["select"])
+    extend_select = args.extend_select
+    if extend_select is None:
+        extend_select = tuple(config.get("extend-select", ()))
+    select = extend_selection(select, extend_select)
+    ignore = args.ignore
+    if ignore is None:
+        ignore = tuple(config.get("ignore", ()))
+    rules = tuple(args.rules or config.get("rules", ()))
+    try:
+        checks = load_checks(select, ignore, load_rules(rules))
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot load rules: {e}")
+
+    result_cache = None
+    if args.cache_dir is not None:
+        result_cache = cache.Cache(
+            args.cache_dir,
+            salt="\n".join(
+                [
+                    f"{func.code} {func.__module__}.{func.__qualname__}"
+                    for func in checks
+                ]
+                + [repr(func.rule) for func in checks if hasattr(func, "rule")]
+                + check_distributions(checks)
+                + (["macros"] if use_macros else [])
+            ),
+        )
+    options = dict(
+        a11y_lint_exclude=args.a11y_lint_exclude,
+        stream_threshold=args.stream_threshold,
+        select=select,
+        ignore=ignore,
+        macros=macro_index,
+        rules=rules,
+        checks=checks,
+    )
+    if args.watch:
+        # Imported here, as it needs this module.
+        from check_chameleon import watch
+
+        return watch.run(
+            args.filenames,
+            include,
+            exclude,
+            jobs=args.jobs,
+            result_cache=result_cache,
+            **options,
+        )
+    formatter = FORMATTERS[args.format](sys.stdout, checks)
+    reported = 0
+    timings = {}
+    results = check_files(
+        filenames,
+        jobs=args.jobs,
+        result_cache=result_cache,
+        batch_size=args.batch_size,
+        max_files_per_worker=args.max_files_per_worker,
+        max_memory=None if args.max_memory is None else args.max_memory << 20,
+        profile=args.profile is not None,
+        prefetch_bytes=args.prefetch_bytes,
+        **options,
+    )
+    # Closing the results cancels the files not checked yet.
+    with contextlib.closing(results):
+        for filename, result in results:
+            diagnostics = result.diagnostics
+            if changed is not None:
+                lines = changed[os.path.abspath(filename)]
+                diagnostics = [
+                    diagnostic
+                    for diagnostic in diagnostics
+                    if diagnostic.code == SYNTAX_ERROR or diagnostic.line in lines
+                ]
+            if args.max_errors is not None:
+                diagnostics = diagnostics[: args.max_errors - reported]
+            formatter.write(diagnostics)
+            reported += len(diagnostics)
+            if args.profile is not None:
+                timings[filename] = result.timings
+            if args.max_errors is not None and reported >= args.max_errors:
+                break
+            if args.fail_fast and diagnostics:
+                break
+    formatter.close()
+    if result_cache is not None:
+        result_cache.prune()
+    if args.profile is not None:
+        print_profile(timings, args.profile)
+    return 1 if reported else 0
 
 
 if __name__ == "__main__":  # pragma: no cover
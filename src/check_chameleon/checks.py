@@ -0,0 +1,184 @@
+"""The built-in checks, see `check_chameleon.check_chameleon.check()`."""
+
+from check_chameleon.check_chameleon import (
+    HAS_FORM_CONTROL,
+    HAS_IMAGE,
+    HAS_TAL_CONTENT,
+    HAS_TEXT,
+    IS_CONDITIONAL,
+    check,
+)
+
+# Attributes holding a space separated list of ids.
+ARIA_REFERENCES = ("aria-labelledby", "aria-describedby")
+
+
+@check("CC001", "a")
+def missing_href(context, link):
+    """Links need a href that does not just point at the top of the page."""
+    href = context.attribute(link, "href")
+    if href is None:
+        context.report(
+            link,
+            "The <a> element is missing the href attribute."
+            " Without the href attribute an anchor represents"
+            " a placeholder for where a link might otherwise have"
+            " been placed and is invisible for screen readers."
+            " If the <a> is used to create interactive clickable"
+            " elements, consider using the <button type=“button”>"
+            " element instead for this.",
+        )
+    elif href.strip() == "#":
+        if context.attribute(link, "role") == "button":
+            return
+        if context.attribute(link, "preventDefault"):
+            return
+        context.report(
+            link,
+            'The <a> element href attribute should not be a single "#",'
+            " it can cause the page to scroll back to the top and it adds"
+            " an entry to the browser history, so it takes an additiona "
+            " click of the back button to go to the previous page."
+            " Consider using a <button type=“button”> element to create"
+            " interactive clickable elements.",
+        )
+
+
+@check("CC002", "img")
+def missing_alt(context, image):
+    """Images need an alt attribute, empty for decorative images."""
+    alt = context.attribute(image, "alt")
+    if alt is None:
+        context.report(
+            image,
+            "The <img> element requires an alt attribute. The alt"
+            " attribute provides descriptive information for an image if a"
+            " user for some reason cannot view it (because of slow"
+            " connection, an error, or if the user uses a screen reader)."
+            " If the image is considered decorative, the alt attribute"
+            " should be left empty, but not removed, so screen readers"
+            " will ignore the image.",
+        )
+
+
+@check("CC003", "a")
+def missing_link_content(context, link):
+    """Links need content describing where they lead."""
+    if HAS_TEXT(link):
+        return
+    if HAS_IMAGE(link):
+        return
+    if HAS_TAL_CONTENT(link):
+        return
+    if context.attribute(link, "aria-label"):
+        return
+    context.report(
+        link,
+        "The <a> element requires descriptive content that help users"
+        " better understand what they can expect if they click the link."
+        " An <a> element without descriptive text will only announce the"
+        " href path to screen reader users. Keep in mind that users of"
+        " screen readers have trouble distinguishing icons and need"
+        " descriptive text to understand the context of the <button>."
+        " Consider adding descriptive content in the form of text, an"
+        " aria-label attribute or an image.",
+    )
+
+
+@check("CC004", "button")
+def missing_button_content(context, button):
+    """Buttons need text describing what they do."""
+    if HAS_TEXT(button):
+        return
+    if HAS_TAL_CONTENT(button):
+        return
+    if context.attribute(button, "aria-label"):
+        return
+    context.report(
+        button,
+        "The <button> element requires descriptive text that helps users"
+        " understand what they can expect when they click it. Keep in mind"
+        " that users of screen readers have trouble distinguishing icons"
+        " and need descriptive text to understand the context of the"
+        " <button>. Consider adding descriptive text in the form of text"
+        " or an aria-label attribute.",
+    )
+
+
+@check("CC005", "label")
+def missing_for(context, label):
+    """Labels need to be associated with a form control."""
+    if HAS_FORM_CONTROL(label):
+        return
+    label_for = context.attribute(label, "for")
+    if label_for is None:
+        context.report(
+            label,
+            "The <label> element needs to be explicitly associated with a"
+            " form control through the use of nesting or the for"
+            " attribute, whose value needs to correspond to the value of"
+            " the id attribute of the associated form control element"
+            " (<input>, <textarea> and <select>).",
+        )
+
+
+@check("CC006", "label", ids=True)
+def dangling_for(context, label):
+    """The for attribute of labels needs to match the id of an element."""
+    label_for = label.get("for")
+    if label_for is None or "${" in label_for:
+        return
+
+    def verdict(context):
+        if context.has_id(label_for):
+            return None
+        return (
+            f'The <label> element refers to id "{label_for}" in its for'
+            " attribute, but no element in the template has that id. The"
+            " label is not associated with its form control, so screen"
+            " readers do not announce it and clicking it does not focus the"
+            " control."
+        )
+
+    context.defer(label, verdict)
+
+
+@check("CC007", "*", ids=True)
+def dangling_aria_reference(context, node):
+    """aria-labelledby and aria-describedby need to match ids of elements."""
+    for name in ARIA_REFERENCES:
+        value = node.get(name)
+        if value is None or "${" in value:
+            continue
+
+        def verdict(context, name=name, ids=value.split()):
+            missing = [f'"{id_}"' for id_ in ids if not context.has_id(id_)]
+            if not missing:
+                return None
+            return (
+                f"The {name} attribute refers to {', '.join(missing)}, but no"
+                " element in"
+                " the template has that id. Screen readers ignore references"
+                " to missing elements, so the element loses its accessible"
+                " name or description."
+            )
+
+        context.defer(node, verdict)
+
+
+@check("CC008", "*", ids=True)
+def duplicate_id(context, node):
+    """Ids need to be unique within a template."""
+    value = node.get("id")
+    if value is None:
+        return
+    lines = context.ids.get(value, ())
+    if len(lines) < 2 or IS_CONDITIONAL(node):
+        return
+    context.report(
+        node,
+        f'The id "{value}" is already used on line'
+        f" {lines[0] - context.lineno_offset}. Ids need to be unique:"
+        " labels and ARIA references to a duplicate id point at the first"
+        " element having it, which confuses screen readers.",
+    )
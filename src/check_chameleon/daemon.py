@@ -0,0 +1,315 @@
+"""Server keeping check-chameleon warm between runs, and its thin client.
+
+`check-chameleon --daemon` serves the directory it is started in on a Unix
+socket, until it has been idle for a while. `check-chameleon-client` takes
+the arguments of `check-chameleon`, except those that keep it running like
+`--watch`, forwards them to the server and
+reproduces its output and exit code. Without a running server the client
+starts one in the background and checks the files itself in the meantime.
+
+The client only imports the standard library, the server keeps the parsers,
+compiled XPath expressions and result cache of check-chameleon in memory.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import os.path
+import socket
+import socketserver
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import traceback
+import typing
+
+from check_chameleon.cache import tool_version
+
+IDLE_TIMEOUT = 600
+
+# Variables of the environment of the client that apply to its request: git
+# sets GIT_INDEX_FILE and others during a commit, XDG_CACHE_HOME locates the
+# result cache.
+FORWARDED_ENVIRONMENT = ("GIT_", "XDG_")
+
+# Options of check-chameleon that keep running instead of answering, which
+# would block the server.
+LONG_RUNNING_OPTIONS = ("--watch", "--daemon")
+
+# Only Linux tells the credentials of the process at the other end of a
+# socket, elsewhere the owner of the socket file is checked.
+SO_PEERCRED = getattr(socket, "SO_PEERCRED", None)
+PEERCRED = struct.Struct("3i")
+
+
+def repository_root(cwd: str) -> str:
+    """Return the root of the git repository containing `cwd`, or `cwd`."""
+    directory = cwd
+    while not os.path.exists(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return cwd
+        directory = parent
+    return directory
+
+
+def private_directory() -> str:
+    """Return the directory of the sockets of the user, only accessible by them.
+
+    It is created in `XDG_RUNTIME_DIR`, or else in the shared temporary
+    directory. Raises PermissionError if it exists but another user could
+    have put a socket in it.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    path = os.path.join(base, f"check-chameleon-{os.getuid()}")
+    with contextlib.suppress(FileExistsError):
+        os.mkdir(path, 0o700)
+    found = os.lstat(path)
+    if (
+        not stat.S_ISDIR(found.st_mode)
+        or found.st_uid != os.getuid()
+        or found.st_mode & 0o077
+    ):
+        raise PermissionError(f"{path} is not a private directory")
+    return path
+
+
+def socket_path(cwd: str) -> str:
+    """Return the socket of the server for the repository of `cwd`.
+
+    The path also depends on the interpreter and the version, so a client
+    never talks to a server of another installation.
+    """
+    key = "\0".join([repository_root(cwd), sys.executable, tool_version()])
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(private_directory(), f"{digest}.sock")
+
+
+def _peer_uid(connection: socket.socket, path: str) -> int:
+    """Return the user running the server at the other end of `connection`."""
+    if SO_PEERCRED is None:
+        return os.stat(path).st_uid
+    credentials = connection.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, PEERCRED.size)
+    return PEERCRED.unpack(credentials)[1]
+
+
+def forwarded_environment(environ: typing.Mapping[str, str]) -> dict[str, str]:
+    return {
+        name: value
+        for name, value in environ.items()
+        if name.startswith(FORWARDED_ENVIRONMENT)
+    }
+
+
+@contextlib.contextmanager
+def _environment(env: dict[str, str] | None):
+    """Apply the forwarded environment `env` of a client, if given."""
+    if env is None:
+        yield
+        return
+    saved = dict(os.environ)
+    for name in forwarded_environment(os.environ):
+        del os.environ[name]
+    os.environ.update(forwarded_environment(env))
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def _receive(connection: socket.socket) -> dict | None:
+    chunks = []
+    while chunk := connection.recv(65536):
+        chunks.append(chunk)
+    if not chunks:
+        # Connections probing for a running server send nothing.
+        return None
+    return json.loads(b"".join(chunks))
+
+
+def _send(connection: socket.socket, message: dict) -> None:
+    connection.sendall(json.dumps(message).encode("utf-8"))
+    connection.shutdown(socket.SHUT_WR)
+
+
+def long_running_option(argv: typing.Sequence[str]) -> str | None:
+    """Return the option of `argv` that keeps check-chameleon running, if any.
+
+    Abbreviations are recognised like argparse does.
+    """
+    for arg in argv:
+        if arg == "--":
+            break
+        name = arg.partition("=")[0]
+        if len(name) > 2:
+            for option in LONG_RUNNING_OPTIONS:
+                if option.startswith(name):
+                    return option
+    return None
+
+
+def run_in_process(
+    argv: list[str], cwd: str, env: dict[str, str] | None = None
+) -> dict:
+    """Run `check-chameleon` with `argv` in `cwd`, capturing its output.
+
+    `env` are the variables forwarded from the environment of the client.
+    """
+    option = long_running_option(argv)
+    if option is not None:
+        return {
+            "stdout": "",
+            "stderr": f"check-chameleon-client: {option} is not supported,"
+            f" run check-chameleon {option} instead\n",
+            "code": 2,
+        }
+    from check_chameleon.check_chameleon import main
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    previous = os.getcwd()
+    os.chdir(cwd)
+    try:
+        with (
+            _environment(env),
+            contextlib.redirect_stdout(stdout),
+            contextlib.redirect_stderr(stderr),
+        ):
+            try:
+                code = main(argv)
+            except SystemExit as e:
+                # Raised by argparse for --help and invalid arguments.
+                code = e.code if isinstance(e.code, int) else 1
+    finally:
+        os.chdir(previous)
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "code": code}
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        request = _receive(self.request)
+        if request is None:
+            return
+        try:
+            response = run_in_process(
+                request["argv"], request["cwd"], request.get("env")
+            )
+        except Exception:
+            response = {"stdout": "", "stderr": traceback.format_exc(), "code": 1}
+        _send(self.request, response)
+
+
+class Server(socketserver.UnixStreamServer):
+    """Serves one request at a time, as requests change the working directory."""
+
+    def __init__(self, path: str, idle_timeout: float = IDLE_TIMEOUT):
+        # Created accessible by the user only, not changed after the fact.
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+        self.timeout = idle_timeout
+        self.idle = False
+
+    def handle_timeout(self):
+        self.idle = True
+
+    def serve_until_idle(self):
+        try:
+            while not self.idle:
+                self.handle_request()
+        finally:
+            self.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.server_address)
+
+
+def _is_serving(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def serve(cwd: str, idle_timeout: float = IDLE_TIMEOUT) -> int:
+    """Serve the repository of `cwd` until idle for `idle_timeout` seconds."""
+    from check_chameleon import cache
+
+    try:
+        path = socket_path(cwd)
+    except OSError as e:
+        print(f"Cannot serve: {e}", file=sys.stderr)
+        return 1
+    if _is_serving(path):
+        # Another server was started concurrently.
+        return 0
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    cache.keep_in_memory()
+    Server(path, idle_timeout).serve_until_idle()
+    return 0
+
+
+def request(
+    path: str, argv: list[str], cwd: str, env: dict[str, str] | None = None
+) -> dict | None:
+    """Send `argv` to the server at `path`, None if there is no server.
+
+    Servers of other users are not trusted and count as no server.
+    """
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(path)
+            if _peer_uid(connection, path) != os.getuid():
+                return None
+        except OSError:
+            return None
+        _send(connection, {"argv": argv, "cwd": cwd, "env": env or {}})
+        return _receive(connection)
+
+
+def start_server(cwd: str) -> None:
+    subprocess.Popen(
+        [sys.executable, "-m", "check_chameleon.daemon"],
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def client_main(argv: typing.Sequence[str] | None = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    cwd = os.getcwd()
+    try:
+        path = socket_path(cwd)
+    except OSError:
+        # Without a safe place for the socket, check without a server.
+        path = None
+    response = None
+    if long_running_option(argv) is not None:
+        # Not sent to the server, which would no longer answer.
+        path = None
+    if path is not None:
+        response = request(path, list(argv), cwd, forwarded_environment(os.environ))
+    if response is None:
+        if path is not None:
+            start_server(cwd)
+        response = run_in_process(list(argv), cwd)
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["code"]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    exit(serve(os.getcwd()))
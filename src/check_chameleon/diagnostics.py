@@ -0,0 +1,224 @@
+"""Diagnostics reported for templates and the formats they are written in."""
+
+import json
+import os
+import typing
+import urllib.parse
+
+from check_chameleon import cache
+
+# Code of syntax errors, which are reported whatever checks are selected.
+SYNTAX_ERROR = "CC000"
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+INFORMATION_URI = "https://github.com/minddistrict/pre-commit-check-chameleon"
+
+
+# Upper bound on the number of distinct messages in the catalog, in case a
+# check formats a new message for every element.
+MAX_MESSAGES = 10000
+
+# The messages of all diagnostics, so each text is kept in memory once.
+_messages: dict[str, str] = {}
+
+
+def catalog_message(text: str) -> str:
+    """Return the copy of `text` in the message catalog."""
+    found = _messages.get(text)
+    if found is not None:
+        return found
+    if len(_messages) < MAX_MESSAGES:
+        _messages[text] = text
+    return text
+
+
+class Diagnostic:
+    """An error found in a template.
+
+    Diagnostics are kept small, as there can be many of them: the message is
+    the copy in the message catalog, also for diagnostics read from the cache
+    or received from another process. The message is only combined with the
+    location when it is written out.
+    """
+
+    __slots__ = ("filename", "line", "column", "code", "message")
+
+    def __init__(
+        self, filename: str, line: int, column: int | None, code: str, message: str
+    ):
+        self.filename = filename
+        self.line = line
+        # lxml only knows the column of syntax errors.
+        self.column = column
+        self.code = code
+        self.message = catalog_message(message)
+
+    def __reduce__(self):
+        return (Diagnostic, self.fields())
+
+    def fields(self) -> tuple[str, int, int | None, str, str]:
+        return (self.filename, self.line, self.column, self.code, self.message)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Diagnostic):
+            return NotImplemented
+        return self.fields() == other.fields()
+
+    def __hash__(self) -> int:
+        return hash(self.fields())
+
+    def __repr__(self) -> str:
+        return f"<Diagnostic {self.code} {self.filename}:{self.line}>"
+
+    def __str__(self) -> str:
+        if self.code == SYNTAX_ERROR:
+            # The message of lxml already mentions the line and column.
+            return f"{self.filename}: {self.message}"
+        return f"{self.filename}:{self.line} {self.message}"
+
+    def as_dict(self) -> dict[str, typing.Any]:
+        return {
+            "file": self.filename,
+            "line": self.line,
+            "column": self.column,
+            "code": self.code,
+            "message": self.message,
+        }
+
+
+class TextFormatter:
+    """One line per diagnostic, as check-chameleon always printed them."""
+
+    def __init__(self, stream: typing.TextIO, checks: typing.Sequence = ()):
+        self.stream = stream
+
+    def write(self, diagnostics: typing.Sequence[Diagnostic]) -> None:
+        for diagnostic in diagnostics:
+            self.stream.write(f"{diagnostic}\n")
+        self.stream.flush()
+
+    def close(self) -> None:
+        pass
+
+
+def summary(message: str) -> str:
+    """Return the first sentence of `message`."""
+    return message.split(". ", 1)[0].removesuffix(".") + "."
+
+
+class ShortFormatter(TextFormatter):
+    """One line per diagnostic with the code and the first sentence.
+
+    The full messages are written once at the end, per code.
+    """
+
+    def __init__(self, stream: typing.TextIO, checks: typing.Sequence = ()):
+        super().__init__(stream, checks)
+        # The messages written per code, in order of appearance.
+        self.seen = {}
+
+    def write(self, diagnostics: typing.Sequence[Diagnostic]) -> None:
+        for diagnostic in diagnostics:
+            if diagnostic.code == SYNTAX_ERROR:
+                self.stream.write(f"{diagnostic}\n")
+                continue
+            self.seen.setdefault(diagnostic.code, {})[diagnostic.message] = None
+            self.stream.write(
+                f"{diagnostic.filename}:{diagnostic.line} {diagnostic.code}"
+                f" {summary(diagnostic.message)}\n"
+            )
+        self.stream.flush()
+
+    def close(self) -> None:
+        if not self.seen:
+            return
+        self.stream.write("\n")
+        for code, messages in sorted(self.seen.items()):
+            for message in messages:
+                self.stream.write(f"{code} {message}\n")
+        self.stream.flush()
+
+
+class NdjsonFormatter(TextFormatter):
+    """One JSON object per diagnostic and line."""
+
+    def write(self, diagnostics: typing.Sequence[Diagnostic]) -> None:
+        for diagnostic in diagnostics:
+            self.stream.write(json.dumps(diagnostic.as_dict()) + "\n")
+        self.stream.flush()
+
+
+def _rule(code: str, name: str, doc: str | None) -> dict[str, typing.Any]:
+    rule = {"id": code, "name": name}
+    if doc:
+        rule["shortDescription"] = {"text": doc.strip().splitlines()[0]}
+    return rule
+
+
+class SarifFormatter:
+    """A SARIF 2.1.0 log with a single run.
+
+    The log is written as the diagnostics come in, it is a valid document
+    once closed.
+    """
+
+    def __init__(self, stream: typing.TextIO, checks: typing.Sequence = ()):
+        self.stream = stream
+        self.separator = ""
+        rules = [_rule(SYNTAX_ERROR, "syntax_error", "The template is not valid XML.")]
+        rules.extend(
+            _rule(check.code, check.__name__, check.__doc__) for check in checks
+        )
+        log = {
+            "$schema": SARIF_SCHEMA,
+            "version": "2.1.0",
+            "runs": [
+                {
+                    "tool": {
+                        "driver": {
+                            "name": "check-chameleon",
+                            "version": cache.tool_version(),
+                            "informationUri": INFORMATION_URI,
+                            "rules": rules,
+                        }
+                    },
+                    "results": [],
+                }
+            ],
+        }
+        # Split the log at the results, to write them in between.
+        head, self.tail = json.dumps(log).rsplit("[]", 1)
+        self.stream.write(head + "[")
+
+    def write(self, diagnostics: typing.Sequence[Diagnostic]) -> None:
+        for diagnostic in diagnostics:
+            region = {"startLine": diagnostic.line}
+            if diagnostic.column is not None:
+                region["startColumn"] = diagnostic.column
+            location = {
+                "artifactLocation": {
+                    "uri": urllib.parse.quote(diagnostic.filename.replace(os.sep, "/"))
+                },
+                "region": region,
+            }
+            result = {
+                "ruleId": diagnostic.code,
+                "level": "error",
+                "message": {"text": diagnostic.message},
+                "locations": [{"physicalLocation": location}],
+            }
+            self.stream.write(self.separator + json.dumps(result))
+            self.separator = ", "
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.stream.write("]" + self.tail + "\n")
+        self.stream.flush()
+
+
+FORMATTERS = {
+    "text": TextFormatter,
+    "ndjson": NdjsonFormatter,
+    "short": ShortFormatter,
+    "sarif": SarifFormatter,
+}
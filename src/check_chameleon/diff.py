@@ -0,0 +1,112 @@
+import bisect
+import os.path
+import re
+import subprocess
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+class LineRanges:
+    """The changed lines of a file, as an index of sorted disjoint ranges.
+
+    Looking up a line is a binary search, so it stays cheap for files with
+    many hunks.
+    """
+
+    def __init__(self, ranges: list[tuple[int, int]]):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, line: int) -> bool:
+        index = bisect.bisect_right(self.starts, line) - 1
+        return index >= 0 and line <= self.ends[index]
+
+    def __repr__(self) -> str:
+        ranges = ", ".join(f"{s}-{e}" for s, e in zip(self.starts, self.ends))
+        return f"<LineRanges {ranges}>"
+
+
+def _unquote(path: str) -> str:
+    # Git quotes paths with unusual characters C style.
+    if path.startswith('"') and path.endswith('"'):
+        path = (
+            path[1:-1]
+            .encode("latin-1", "backslashreplace")
+            .decode("unicode_escape")
+            .encode("latin-1")
+            .decode("utf-8")
+        )
+    return path
+
+
+def parse_diff(text: str, root: str) -> dict[str, LineRanges]:
+    """Parse a zero context unified diff into changed lines per file.
+
+    Files are keyed by absolute path, with the paths in the diff relative to
+    `root`. Deleted files are left out. A hunk that only removes lines counts
+    as a change of the line next to the removal, so the file is still checked.
+    """
+    ranges = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("+++ "):
+            path = line[4:].rstrip("\t")
+            current = None
+            if path != "/dev/null":
+                current = ranges.setdefault(
+                    os.path.normpath(os.path.join(root, _unquote(path)[2:])), []
+                )
+            continue
+        match = HUNK_HEADER.match(line)
+        if match is None or current is None:
+            continue
+        start = int(match.group(1))
+        count = 1 if match.group(2) is None else int(match.group(2))
+        if count:
+            current.append((start, start + count - 1))
+        else:
+            # The lines were removed after line `start`, 0 at the start.
+            current.append((max(start, 1), max(start, 1)))
+    return {path: LineRanges(lines) for path, lines in ranges.items() if lines}
+
+
+def changed_lines(revision_range: str | None = None) -> dict[str, LineRanges]:
+    """Return the changed lines per file of the current git repository.
+
+    Without `revision_range` the staged changes are used, otherwise the
+    changes of the range, for example `origin/main...HEAD`.
+    """
+    root = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+        errors="surrogateescape",
+    ).stdout.strip()
+    command = [
+        "git",
+        "diff",
+        "--no-color",
+        "--no-ext-diff",
+        "--src-prefix=a/",
+        "--dst-prefix=b/",
+        "--unified=0",
+    ]
+    command.append("--cached" if revision_range is None else revision_range)
+    # The diff contains the changed lines in the encoding of each template,
+    # which need not be UTF-8; only the hunk headers and paths are used.
+    output = subprocess.run(
+        command,
+        check=True,
+        capture_output=True,
+        encoding="utf-8",
+        errors="surrogateescape",
+        cwd=root,
+    ).stdout
+    return parse_diff(output, root)
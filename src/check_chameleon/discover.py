@@ -0,0 +1,205 @@
+"""Find the templates to check in the directories given on the command line."""
+
+import fnmatch
+import os
+import os.path
+import re
+import typing
+
+DEFAULT_INCLUDE = ("*.cpt",)
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore pattern into a regular expression.
+
+    The expression matches paths relative to the directory of the
+    .gitignore file, with `/` as separator.
+    """
+    # Patterns with a slash before their end only match relative to the
+    # directory of the .gitignore file, the others match at any depth.
+    anchored = "/" in pattern
+    pattern = pattern.removeprefix("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        at_segment_start = i == 0 or pattern[i - 1] == "/"
+        if at_segment_start and pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif at_segment_start and pattern[i:] == "**":
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            members = pattern[i + 1 : end].replace("\\", "\\\\")
+            if members.startswith("!"):
+                members = "^" + members[1:]
+            parts.append(f"[{members}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts)
+
+
+class GitIgnore:
+    """The patterns of the .gitignore file in `directory`."""
+
+    def __init__(self, directory: str, lines: typing.Iterable[str]):
+        self.directory = directory
+        # (expression, negated, only matches directories) per pattern.
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\n")
+            if not line.endswith("\\ "):
+                line = line.rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            line = line.removeprefix("!")
+            directory_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line:
+                self.rules.append(
+                    (re.compile(_translate(line)), negated, directory_only)
+                )
+
+    @classmethod
+    def read(cls, directory: str) -> "GitIgnore | None":
+        try:
+            with open(
+                os.path.join(directory, ".gitignore"), encoding="utf-8"
+            ) as stream:
+                ignore = cls(directory, stream)
+        except (OSError, UnicodeDecodeError):
+            return None
+        return ignore if ignore.rules else None
+
+
+def is_ignored(
+    ignores: typing.Sequence[GitIgnore], path: str, is_directory: bool
+) -> bool:
+    """Tell whether the absolute `path` is ignored by the .gitignore files.
+
+    `ignores` go from the outermost to the innermost directory, the last
+    matching pattern decides, as in git.
+    """
+    ignored = False
+    for ignore in ignores:
+        relative = path[len(ignore.directory) + 1 :].replace(os.sep, "/")
+        for expression, negated, directory_only in ignore.rules:
+            if directory_only and not is_directory:
+                continue
+            if expression.fullmatch(relative):
+                ignored = not negated
+    return ignored
+
+
+def _repository_ignores(directory: str) -> list[GitIgnore] | None:
+    """Return the .gitignore files applying to the absolute `directory`.
+
+    These are the ones of its ancestors up to the root of the repository,
+    outermost first. None if `directory` is not in a git repository.
+    """
+    ancestors = []
+    while True:
+        ancestors.append(directory)
+        if os.path.exists(os.path.join(directory, ".git")):
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    # The directory itself is read when it is walked.
+    return [
+        ignore
+        for ancestor in reversed(ancestors[1:])
+        if (ignore := GitIgnore.read(ancestor)) is not None
+    ]
+
+
+def _glob(patterns: typing.Iterable[str]) -> typing.Callable[[str, str], bool]:
+    """Return a test of a name and path matching one of `patterns`.
+
+    Patterns without a slash match the name, the others the whole path.
+    """
+    names = [fnmatch.translate(p) for p in patterns if "/" not in p]
+    paths = [fnmatch.translate(p) for p in patterns if "/" in p]
+    name_match = re.compile("|".join(names)).match if names else None
+    path_match = re.compile("|".join(paths)).match if paths else None
+
+    def matches(name: str, path: str) -> bool:
+        if name_match is not None and name_match(name):
+            return True
+        return path_match is not None and bool(path_match(path.replace(os.sep, "/")))
+
+    return matches
+
+
+def find_templates(
+    paths: typing.Iterable[str],
+    include: typing.Iterable[str] = DEFAULT_INCLUDE,
+    exclude: typing.Iterable[str] = (),
+) -> typing.Iterator[str]:
+    """Yield the files in `paths`, walking the directories among them.
+
+    Files found in directories need to match an `include` glob. Files and
+    directories matching an `exclude` glob are skipped, and so are the ones
+    ignored by git. Paths are yielded once, in the form given, as they are
+    found, so checking can start while the walk goes on.
+    """
+    included = _glob(include)
+    excluded = _glob(exclude)
+    seen = set()
+    walked = set()
+
+    def walk(
+        directory: str, absolute: str, ignores: list[GitIgnore] | None
+    ) -> typing.Iterator[str]:
+        if absolute in walked:
+            return
+        walked.add(absolute)
+        if ignores is not None:
+            ignore = GitIgnore.read(absolute)
+            if ignore is not None:
+                ignores = [*ignores, ignore]
+        try:
+            with os.scandir(directory) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            entry_absolute = os.path.join(absolute, entry.name)
+            is_directory = entry.is_dir(follow_symlinks=False)
+            if is_directory and entry.name == ".git":
+                continue
+            if excluded(entry.name, entry.path):
+                continue
+            if ignores and is_ignored(ignores, entry_absolute, is_directory):
+                continue
+            if is_directory:
+                yield from walk(entry.path, entry_absolute, ignores)
+            elif (
+                included(entry.name, entry.path)
+                and entry_absolute not in seen
+                and entry.is_file()
+            ):
+                seen.add(entry_absolute)
+                yield entry.path
+
+    for path in paths:
+        absolute = os.path.abspath(path)
+        if os.path.isdir(path):
+            yield from walk(path, absolute, _repository_ignores(absolute))
+        elif absolute not in seen and not excluded(os.path.basename(path), path):
+            seen.add(absolute)
+            yield path
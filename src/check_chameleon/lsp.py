@@ -0,0 +1,281 @@
+"""Language server publishing the diagnostics of check-chameleon.
+
+`check-chameleon-lsp` speaks the Language Server Protocol on stdin and
+stdout. Templates are checked as they are edited, from the buffer of the
+editor instead of the file on disk, a short while after the last change.
+Each open document keeps its parsed `tal:attributes` values, the hash of the
+text last checked and the diagnostics last published, so an edit only costs
+a check of the new text and nothing is published when the diagnostics stay
+the same.
+
+The checks to run are taken from the `pyproject.toml` of the workspace, like
+`check-chameleon` does.
+"""
+
+import hashlib
+import json
+import os.path
+import queue
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+import urllib.request
+
+from check_chameleon import check_chameleon as core
+
+# Seconds after the last change of a document before it is checked.
+DEBOUNCE = 0.2
+
+# Parsed `tal:attributes` values kept per document.
+MAX_TAL_ATTRIBUTES = 10000
+
+METHOD_NOT_FOUND = -32601
+SEVERITY_ERROR = 1
+MESSAGE_ERROR = 1
+SYNC_FULL = 1
+
+
+def read_message(stream: typing.BinaryIO) -> dict | None:
+    """Read a message from `stream`, None at its end."""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    if length is None:
+        return None
+    return json.loads(stream.read(length))
+
+
+def write_message(stream: typing.BinaryIO, message: dict) -> None:
+    body = json.dumps(message).encode("utf-8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+def uri_to_path(uri: str) -> str:
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme != "file":
+        return uri
+    return urllib.request.url2pathname(parsed.path)
+
+
+class Document:
+    """An open document and what is kept of its last check."""
+
+    def __init__(self, uri: str, text: str):
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.text = text
+        # Time at which the document is due to be checked, None if it is.
+        self.due = 0.0
+        self.checked_hash = None
+        self.tal_attributes = {}
+        self.published = None
+
+
+class Server:
+    def __init__(self, output: typing.BinaryIO, debounce: float = DEBOUNCE):
+        self.output = output
+        self.debounce = debounce
+        self.documents = {}
+        self.checks = core.load_checks()
+        self.a11y_lint_exclude = None
+        self.shut_down = False
+        self.exited = False
+
+    def send(self, message: dict) -> None:
+        write_message(self.output, {"jsonrpc": "2.0", **message})
+
+    def handle(self, message: dict) -> None:
+        method = message.get("method")
+        params = message.get("params") or {}
+        handler = getattr(self, "on_" + str(method).replace("/", "_"), None)
+        if handler is None:
+            if "id" in message and method is not None:
+                self.send(
+                    {
+                        "id": message["id"],
+                        "error": {
+                            "code": METHOD_NOT_FOUND,
+                            "message": f"Unknown method {method}",
+                        },
+                    }
+                )
+            return
+        result = handler(params)
+        if "id" in message:
+            self.send({"id": message["id"], "result": result})
+
+    def on_initialize(self, params: dict) -> dict:
+        root = params.get("rootUri")
+        directory = uri_to_path(root) if root else ""
+        config = core.read_config(os.path.join(directory, "pyproject.toml"))
+        select = config.get("select")
+        select = core.extend_selection(
+            None if select is None else tuple(select),
+            tuple(config.get("extend-select", ())),
+        )
+        ignore = tuple(config.get("ignore", ()))
+        rules = [os.path.join(directory, path) for path in config.get("rules", ())]
+        try:
+            self.checks = core.load_checks(select, ignore, core.load_rules(rules))
+        except (OSError, ValueError) as e:
+            self.checks = core.load_checks(select, ignore)
+            self.send(
+                {
+                    "method": "window/showMessage",
+                    "params": {
+                        "type": MESSAGE_ERROR,
+                        "message": f"check-chameleon cannot load rules: {e}",
+                    },
+                }
+            )
+        options = params.get("initializationOptions") or {}
+        exclude = options.get("a11y_lint_exclude")
+        # Documents have absolute paths, a relative prefix is one of the
+        # workspace, like the paths given to `check-chameleon`.
+        if exclude is not None and directory:
+            exclude = os.path.join(directory, exclude)
+        self.a11y_lint_exclude = exclude
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": SYNC_FULL}
+            },
+            "serverInfo": {"name": "check-chameleon"},
+        }
+
+    def on_shutdown(self, params: dict) -> None:
+        self.shut_down = True
+
+    def on_exit(self, params: dict) -> None:
+        self.exited = True
+
+    def on_textDocument_didOpen(self, params: dict) -> None:
+        item = params["textDocument"]
+        document = Document(item["uri"], item["text"])
+        self.documents[document.uri] = document
+        self.check(document)
+
+    def on_textDocument_didChange(self, params: dict) -> None:
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None or not params["contentChanges"]:
+            return
+        # Full synchronization: the last change has the whole text.
+        document.text = params["contentChanges"][-1]["text"]
+        document.due = time.monotonic() + self.debounce
+
+    def on_textDocument_didSave(self, params: dict) -> None:
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is not None and document.due is not None:
+            self.check(document)
+
+    def on_textDocument_didClose(self, params: dict) -> None:
+        document = self.documents.pop(params["textDocument"]["uri"], None)
+        if document is not None and document.published:
+            self.publish(document, [])
+
+    def check(self, document: Document) -> None:
+        """Check `document`, publishing its diagnostics if they changed."""
+        document.due = None
+        content = document.text.encode("utf-8")
+        content_hash = hashlib.sha256(content).digest()
+        if content_hash == document.checked_hash:
+            return
+        if len(document.tal_attributes) > MAX_TAL_ATTRIBUTES:
+            document.tal_attributes = {}
+        context = core.Context(
+            document.path,
+            a11y_lint_exclude=self.a11y_lint_exclude,
+            stream_threshold=None,
+            checks=self.checks,
+            content=content,
+        )
+        # Values of `tal:attributes` not touched by the edit are not parsed
+        # again.
+        context.tal_attributes = document.tal_attributes
+        context.run()
+        document.checked_hash = content_hash
+        if context.diagnostics != document.published:
+            self.publish(document, context.diagnostics)
+
+    def publish(self, document: Document, diagnostics: list) -> None:
+        lines = document.text.splitlines()
+        published = []
+        for diagnostic in diagnostics:
+            # Lines are counted from 0 in the protocol, and from 1 in the
+            # diagnostics, which are already corrected for the DOCTYPE
+            # check-chameleon adds in front of templates.
+            line = max(0, diagnostic.line - 1)
+            start = 0
+            if diagnostic.column is not None:
+                start = max(0, diagnostic.column - 1)
+            end = len(lines[line]) if line < len(lines) else start
+            published.append(
+                {
+                    "range": {
+                        "start": {"line": line, "character": start},
+                        "end": {"line": line, "character": max(start, end)},
+                    },
+                    "severity": SEVERITY_ERROR,
+                    "code": diagnostic.code,
+                    "source": "check-chameleon",
+                    "message": diagnostic.message,
+                }
+            )
+        document.published = diagnostics
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {"uri": document.uri, "diagnostics": published},
+            }
+        )
+
+    def check_due(self) -> float | None:
+        """Check the documents due, return the seconds until the next one."""
+        now = time.monotonic()
+        wait = None
+        for document in list(self.documents.values()):
+            if document.due is None:
+                continue
+            if document.due <= now:
+                self.check(document)
+            elif wait is None or document.due - now < wait:
+                wait = document.due - now
+        return wait
+
+    def serve(self, input: typing.BinaryIO) -> int:
+        """Handle the messages from `input` until the client exits."""
+        messages = queue.Queue()
+
+        def read():
+            while (message := read_message(input)) is not None:
+                messages.put(message)
+            messages.put(None)
+
+        threading.Thread(target=read, daemon=True).start()
+        while not self.exited:
+            try:
+                message = messages.get(timeout=self.check_due())
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            self.handle(message)
+        return 0 if self.shut_down else 1
+
+
+def main() -> int:
+    return Server(sys.stdout.buffer).serve(sys.stdin.buffer)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    exit(main())
@@ -0,0 +1,288 @@
+"""Index of the METAL macros of a project.
+
+Templates are checked in the context of the macros they use: the elements of
+a macro around its slots are checked as assembled with the content the
+template fills the slots with. The index records which macros each template
+defines and uses. It is kept in the cache directory between runs and only
+templates changed since are scanned again.
+
+`metal:use-macro` takes an expression, which cannot be evaluated without the
+application. The macro name is taken from the expression (`.../macros/page`,
+`macros.page` or `macros['page']`), and looked up in the file named by a
+`load:` expression, or else among all definitions of that name. When there is
+more than one, the file whose name appears in the expression is taken, for
+example `layout.cpt` for `context/@@layout/macros/page`. Uses that cannot be
+resolved are not checked in context.
+"""
+
+import copy
+import functools
+import hashlib
+import json
+import os
+import os.path
+import re
+import time
+import typing
+
+import lxml.etree
+
+from check_chameleon import cache
+from check_chameleon import check_chameleon as core
+
+METAL = core.NSMAP["metal"]
+DEFINE_MACRO = f"{{{METAL}}}define-macro"
+USE_MACRO = core.USE_MACRO
+DEFINE_SLOT = f"{{{METAL}}}define-slot"
+FILL_SLOT = f"{{{METAL}}}fill-slot"
+
+# Bump when the layout of the index changes.
+INDEX_SCHEMA = 1
+
+MACRO_NAME = re.compile(r"""macros(?:/|\.|\[\s*['"])([\w-]+)""")
+LOAD = re.compile(r"load:\s*([^\s;]+?)(?=/macros/|[\s;]|$)")
+
+DEFINES_MACRO = core.xpath("//*[@metal:define-macro]")
+DEFINES_SLOT = core.xpath(".//*[@metal:define-slot]")
+FILLS_SLOT = core.xpath(".//*[@metal:fill-slot]")
+USES_MACRO = core.xpath("//*[@metal:use-macro]")
+
+
+def _content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def scan(filename: str) -> dict[str, typing.Any]:
+    """Return the content hash of `filename` and the macros it defines and uses.
+
+    Macros are recorded with the line they are defined on, uses with their
+    expression.
+    """
+    with open(filename, "rb") as stream:
+        content = stream.read()
+    entry = {"hash": _content_hash(content), "defines": {}, "uses": []}
+    if METAL.encode("ascii") not in content:
+        return entry
+    context = core.Context(filename, stream_threshold=None, checks=(), content=content)
+    try:
+        context.parse()
+    except lxml.etree.XMLSyntaxError:
+        return entry
+    for node in DEFINES_MACRO(context.node):
+        entry["defines"].setdefault(
+            node.get(DEFINE_MACRO), node.sourceline - context.lineno_offset
+        )
+    entry["uses"] = sorted({node.get(USE_MACRO) for node in USES_MACRO(context.node)})
+    return entry
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_macros(
+    filename: str, stamp: tuple[int, int]
+) -> tuple[dict[str, typing.Any], int]:
+    """Return the macro elements of `filename` by name, and its line offset.
+
+    The whole document is the macro with the empty name, as used by `load:`.
+    `stamp` is the size and modification time of the file, so changed files
+    are parsed again.
+    """
+    context = core.Context(filename, stream_threshold=None, checks=())
+    try:
+        context.parse()
+    except lxml.etree.XMLSyntaxError:
+        return {}, 0
+    found = {"": context.node}
+    for node in DEFINES_MACRO(context.node):
+        found.setdefault(node.get(DEFINE_MACRO), node)
+    return found, context.lineno_offset
+
+
+def assemble(macro, use) -> tuple[typing.Any, list]:
+    """Return a copy of `macro` with the slots filled by `use`.
+
+    Also return the elements of the copy containing a slot, whether filled or
+    with its default content: how they are judged depends on the template
+    using the macro.
+    """
+    assembled = copy.deepcopy(macro)
+    fills = {}
+    for fill in FILLS_SLOT(use):
+        fills.setdefault(fill.get(FILL_SLOT), fill)
+    around = {}
+    for slot in DEFINES_SLOT(assembled):
+        parent = slot.getparent()
+        fill = fills.get(slot.get(DEFINE_SLOT))
+        if fill is not None:
+            filled = copy.deepcopy(fill)
+            filled.tail = slot.tail
+            parent.replace(slot, filled)
+        around[parent] = None
+        for ancestor in parent.iterancestors():
+            around[ancestor] = None
+    return assembled, [node for node in assembled.iter() if node in around]
+
+
+class MacroIndex:
+    """The macros defined and used by the templates of a project.
+
+    The index is stored as JSON at `path` if given.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        # Entry of `scan()` by absolute path, with the size and modification
+        # time of the file as "stat".
+        self.files = {}
+        self.changed = False
+        self._definitions = None
+        self._dependents = None
+
+    @classmethod
+    def load(cls, path: str | None) -> "MacroIndex":
+        index = cls(path)
+        if path is not None:
+            try:
+                with open(path, encoding="utf-8") as stream:
+                    stored = json.load(stream)
+            except (OSError, ValueError):
+                stored = None
+            if isinstance(stored, dict) and stored.get("schema") == INDEX_SCHEMA:
+                index.files = stored["files"]
+        return index
+
+    def save(self) -> None:
+        if self.path is None or not self.changed:
+            return
+        try:
+            cache._write_atomic(
+                self.path, json.dumps({"schema": INDEX_SCHEMA, "files": self.files})
+            )
+        except OSError:
+            return
+        self.changed = False
+
+    def update(self, filenames: typing.Iterable[str]) -> None:
+        """Scan the templates of the project changed since the last update.
+
+        Templates no longer in `filenames` are dropped from the index.
+        """
+        files = {}
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            entry = self.files.get(path)
+            if entry is None or entry["stat"] != stamp:
+                try:
+                    entry = scan(path)
+                except OSError:
+                    continue
+                # Like the result cache, do not trust the stat of files
+                # modified just now.
+                racy = stat.st_mtime > time.time() - cache.RACY_SECONDS
+                entry["stat"] = None if racy else stamp
+                self.changed = True
+            files[path] = entry
+        if files.keys() != self.files.keys():
+            self.changed = True
+        self.files = files
+        self._definitions = None
+        self._dependents = None
+
+    def definitions(self) -> dict[str, list[str]]:
+        """Return the files defining each macro name."""
+        if self._definitions is None:
+            self._definitions = {}
+            for path, entry in sorted(self.files.items()):
+                for name in entry["defines"]:
+                    self._definitions.setdefault(name, []).append(path)
+        return self._definitions
+
+    def resolve(self, expression: str, filename: str) -> tuple[str, str] | None:
+        """Return the file and name of the macro `expression` refers to."""
+        names = MACRO_NAME.findall(expression)
+        name = names[-1] if names else ""
+        load = LOAD.search(expression)
+        if load is not None:
+            path = os.path.normpath(
+                os.path.join(os.path.dirname(os.path.abspath(filename)), load.group(1))
+            )
+            entry = self.files.get(path)
+            if entry is None or (name and name not in entry["defines"]):
+                return None
+            return path, name
+        candidates = self.definitions().get(name, []) if name else []
+        if len(candidates) > 1:
+            words = set(re.findall(r"[\w-]+", expression))
+            candidates = [
+                path
+                for path in candidates
+                if os.path.splitext(os.path.basename(path))[0] in words
+            ]
+        if len(candidates) != 1:
+            return None
+        return candidates[0], name
+
+    def dependencies(self, filename: str) -> list[str]:
+        """Return the files defining the macros `filename` uses."""
+        path = os.path.abspath(filename)
+        entry = self.files.get(path)
+        if entry is None:
+            return []
+        found = set()
+        for expression in entry["uses"]:
+            resolved = self.resolve(expression, path)
+            if resolved is not None and resolved[0] != path:
+                found.add(resolved[0])
+        return sorted(found)
+
+    def dependency_key(self, filename: str) -> tuple[str, ...]:
+        """Identify the macros `filename` uses, for the result cache key."""
+        return tuple(
+            f"{path}\0{self.files[path]['hash']}"
+            for path in self.dependencies(filename)
+        )
+
+    def dependents(self, filenames: typing.Iterable[str]) -> list[str]:
+        """Return the other templates using a macro of one of `filenames`."""
+        if self._dependents is None:
+            self._dependents = {}
+            for path in self.files:
+                for dependency in self.dependencies(path):
+                    self._dependents.setdefault(dependency, set()).add(path)
+        given = {os.path.abspath(filename) for filename in filenames}
+        found = set()
+        for path in given:
+            found.update(self._dependents.get(path, ()))
+        return sorted(found - given)
+
+    def assemble(self, use, filename: str):
+        """Assemble the macro used by the element `use` of `filename`.
+
+        Return the file and name of the macro, the elements around its slots
+        and the line offset of its file, see `assemble()`. None if the macro
+        is not found.
+        """
+        resolved = self.resolve(use.get(USE_MACRO), filename)
+        if resolved is None:
+            return None
+        path, name = resolved
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        macros, lineno_offset = _parse_macros(path, (stat.st_size, stat.st_mtime_ns))
+        macro = macros.get(name)
+        if macro is None:
+            return None
+        _, around = assemble(macro, use)
+        return path, name, around, lineno_offset
+
+
+def index_path(directory: str, root: str) -> str:
+    """Return where the index of the project at `root` is kept."""
+    key = hashlib.sha256(os.path.abspath(root).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, "macros", f"{key}.json")
@@ -0,0 +1,224 @@
+"""Checks declared as rules instead of written as functions.
+
+A rule names the tags of the elements it applies to and the conditions under
+which such an element is reported with its message:
+
+`attributes`
+    Values of attributes, looked up like `attribute()` does, so
+    `tal:attributes` and `x-ng-` variants count. An attribute is expected to
+    be missing (None), missing or blank (False), present and not blank (True),
+    or to have one of the given values, ignoring surrounding white space.
+
+`without`
+    Content the element lacks: any of `text`, `image`, `tal-content` and
+    `form-control`.
+
+`where`
+    An XPath expression evaluated on the element, with the `xhtml`, `tal`
+    and `metal` prefixes. Like checks, it may only look at the element and
+    its descendants.
+
+An element is reported when all conditions hold. Rules for all elements, with
+the tag `*`, can only have attribute conditions.
+
+Rules are compiled into checks, which take part in the single walk over the
+document like the others. They are declared in Python with `Rule` and
+`compile_rule()`, and made available through the `check_chameleon.checks` entry
+point group, or listed in YAML or TOML files, see `load()`::
+
+    rules:
+      - code: XX001
+        tags: [a]
+        attributes: {target: _blank, aria-label: false}
+        message: Links opening a new window need to say so.
+"""
+
+import functools
+import os
+import tomllib
+import types
+import typing
+
+import lxml.etree
+
+from check_chameleon import check_chameleon as core
+
+CONTENT = {
+    "text": core.HAS_TEXT,
+    "image": core.HAS_IMAGE,
+    "tal-content": core.HAS_TAL_CONTENT,
+    "form-control": core.HAS_FORM_CONTROL,
+}
+
+
+class Rule(typing.NamedTuple):
+    code: str
+    tags: tuple[str, ...]
+    message: str
+    attributes: typing.Mapping[str, typing.Any] = types.MappingProxyType({})
+    without: tuple[str, ...] = ()
+    where: str | None = None
+    # Name and description of the check, as shown in SARIF reports.
+    name: str | None = None
+    description: str | None = None
+
+
+def _matcher(expected) -> typing.Callable[[str | None], bool]:
+    """Return whether an attribute value is as `expected` by a rule."""
+    if expected is None:
+        return lambda value: value is None
+    if expected is False:
+        return lambda value: value is None or not value.strip()
+    if expected is True:
+        return lambda value: value is not None and bool(value.strip())
+    if isinstance(expected, str):
+        expected = [expected]
+    if not isinstance(expected, list | tuple) or not all(
+        isinstance(item, str) for item in expected
+    ):
+        raise ValueError(f"invalid attribute value {expected!r}")
+    allowed = frozenset(item.strip() for item in expected)
+    return lambda value: value is not None and value.strip() in allowed
+
+
+def compile_rule(rule: Rule) -> typing.Callable:
+    """Return the check of `rule`, see `check_chameleon.check_chameleon.check()`."""
+    if not rule.code or not rule.tags or not rule.message:
+        raise ValueError("rules need a code, tags and a message")
+    if "*" in rule.tags and (rule.without or rule.where):
+        raise ValueError(
+            f"{rule.code}: rules for all elements can only check attributes"
+        )
+    try:
+        conditions = [
+            (name, _matcher(expected)) for name, expected in rule.attributes.items()
+        ]
+        contents = [CONTENT[kind] for kind in rule.without]
+        where = None if rule.where is None else core.xpath(rule.where)
+    except KeyError as e:
+        raise ValueError(f"{rule.code}: unknown content {e.args[0]!r}") from None
+    except (ValueError, lxml.etree.XPathSyntaxError) as e:
+        raise ValueError(f"{rule.code}: {e}") from None
+    message = rule.message
+
+    @core.check(rule.code, *rule.tags)
+    def rule_check(context, node):
+        for name, matches in conditions:
+            if not matches(context.attribute(node, name)):
+                return
+        for has_content in contents:
+            if has_content(node):
+                return
+        if where is not None and not where(node):
+            return
+        context.report(node, message)
+
+    rule_check.__name__ = rule_check.__qualname__ = rule.name or f"rule_{rule.code}"
+    rule_check.__doc__ = rule.description or message
+    rule_check.rule = rule
+    return rule_check
+
+
+def _rule(entry) -> Rule:
+    if not isinstance(entry, dict):
+        raise ValueError(f"rules are tables, not {entry!r}")
+    unknown = entry.keys() - Rule._fields
+    if unknown:
+        raise ValueError(f"unknown keys {', '.join(sorted(unknown))}")
+    tags = entry.get("tags", ())
+    if isinstance(tags, str):
+        tags = (tags,)
+    return Rule(
+        **{
+            **entry,
+            "code": str(entry.get("code", "")),
+            "tags": tuple(tags),
+            "message": entry.get("message", ""),
+            "attributes": dict(entry.get("attributes") or {}),
+            "without": tuple(entry.get("without") or ()),
+        }
+    )
+
+
+def read(filename: str) -> list[Rule]:
+    """Return the rules listed in the YAML or TOML file `filename`.
+
+    Reading YAML needs PyYAML, see the `yaml` extra.
+    """
+    with open(filename, "rb") as stream:
+        content = stream.read()
+    if filename.endswith(".toml"):
+        try:
+            data = tomllib.loads(content.decode("utf-8"))
+        except (UnicodeDecodeError, tomllib.TOMLDecodeError) as e:
+            raise ValueError(f"{filename}: {e}") from None
+    else:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(
+                f"{filename}: reading YAML needs PyYAML,"
+                " install pre-commit-check-chameleon[yaml]"
+            ) from None
+        try:
+            data = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(f"{filename}: {e}") from None
+    if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+        raise ValueError(f"{filename}: expected a list of rules under `rules`")
+    rules = []
+    for number, entry in enumerate(data["rules"], 1):
+        try:
+            rules.append(_rule(entry))
+        except ValueError as e:
+            raise ValueError(f"{filename}: rule {number}: {e}") from None
+    return rules
+
+
+@functools.lru_cache(maxsize=64)
+def _load(filename: str, stamp: tuple[int, int]) -> tuple[typing.Callable, ...]:
+    """Return the checks of the rules in `filename`.
+
+    `stamp` is the size and modification time of the file, so changed files,
+    for example while running as a daemon, are read again.
+    """
+    checks = []
+    for rule in read(filename):
+        try:
+            checks.append(compile_rule(rule))
+        except ValueError as e:
+            raise ValueError(f"{filename}: {e}") from None
+    return tuple(checks)
+
+
+def load(filenames: typing.Iterable[str]) -> tuple[typing.Callable, ...]:
+    """Return the checks of the rules in the files `filenames`.
+
+    As long as the files do not change, the same checks are returned. Codes
+    are unique, among the rules and with the other checks.
+    """
+    stamps = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamps.append((filename, (stat.st_size, stat.st_mtime_ns)))
+    return _load_all(tuple(stamps))
+
+
+@functools.lru_cache(maxsize=16)
+def _load_all(
+    stamps: tuple[tuple[str, tuple[int, int]], ...],
+) -> tuple[typing.Callable, ...]:
+    # Cached as looking up the available checks scans the installed
+    # distributions.
+    checks = []
+    codes = set()
+    available = core.available_checks()
+    for filename, stamp in stamps:
+        for check in _load(filename, stamp):
+            if check.code in available:
+                raise ValueError(f"{filename}: {check.code} is already a check")
+            if check.code in codes:
+                raise ValueError(f"{filename}: duplicate rule {check.code}")
+            codes.add(check.code)
+            checks.append(check)
+    return tuple(checks)
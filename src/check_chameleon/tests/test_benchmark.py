@@ -0,0 +1,95 @@
+import importlib
+import json
+import os.path
+import random
+import shutil
+import tempfile
+import unittest
+
+from testfixtures import OutputCapture
+
+import check_chameleon.benchmark
+import check_chameleon.check_chameleon
+from check_chameleon.benchmark.corpus import (
+    CorpusSettings,
+    generate_corpus,
+    generate_template,
+)
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_corpus_is_reproducible(self):
+        settings = CorpusSettings(files=3, size=2048)
+        first = [
+            open(filename).read()
+            for filename in generate_corpus(self.directory, settings)
+        ]
+        second = [generate_template(random.Random(0), settings) for _ in range(1)]
+        self.assertEqual(3, len(first))
+        self.assertEqual(first[0], second[0])
+        self.assertNotEqual(first[0], first[1])
+
+    def test_corpus_templates_are_well_formed(self):
+        settings = CorpusSettings(files=20, size=4096, tal_attributes=0.5)
+        errors = []
+        for filename in generate_corpus(self.directory, settings):
+            self.assertGreaterEqual(os.path.getsize(filename), 4096)
+            errors += check_chameleon.check_chameleon.Context(filename).run()
+        self.assertTrue(errors)
+        self.assertFalse([error for error in errors if ": " in error.split(" ")[0]])
+
+    def test_corpus_without_doctype_or_tal_attributes(self):
+        template = generate_template(
+            random.Random(0), CorpusSettings(doctype=0, tal_attributes=0)
+        )
+        self.assertNotIn("<!DOCTYPE", template)
+        self.assertNotIn("tal:attributes", template)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "report.json")
+            check_chameleon.benchmark.main(
+                ["--files=3", "--size=1024", "--repeat=1", f"--output={output}"]
+            )
+            with open(output) as stream:
+                report = json.load(stream)
+        self.assertEqual(check_chameleon.benchmark.SCHEMA, report["schema"])
+        self.assertEqual(3, report["corpus"]["files"])
+        self.assertEqual(1024, report["corpus"]["size"])
+        self.assertEqual(
+            {
+                "missing_alt",
+                "missing_button_content",
+                "missing_for",
+                "missing_href",
+                "missing_link_content",
+            },
+            set(report["checks"]),
+        )
+        for key in ("context_run", "main"):
+            self.assertGreater(report[key]["files_per_second"], 0)
+        self.assertGreater(report["attribute"]["lookups"], 0)
+        self.assertGreater(report["main"]["peak_rss_kb"], 0)
+        self.assertNotIn("peak_rss_kb", report)
+
+    def test_peak_rss_kb(self):
+        self.assertGreater(check_chameleon.benchmark.peak_rss_kb(), 0)
+
+    def test_report_to_stdout(self):
+        with OutputCapture() as output:
+            check_chameleon.benchmark.main(["--files=0", "--repeat=1"])
+        report = json.loads(output.captured)
+        self.assertIsNone(report["main"]["us_per_node"])
+        self.assertIsNone(report["attribute"]["us_per_lookup"])
+
+    def test_main_module(self):
+        module = importlib.import_module("check_chameleon.benchmark.__main__")
+        self.assertIs(check_chameleon.benchmark.main, module.main)
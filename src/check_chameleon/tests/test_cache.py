@@ -0,0 +1,221 @@
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.cache
+import check_chameleon.check_chameleon
+from check_chameleon.diagnostics import Diagnostic
+
+LINK_MISSING_HREF = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <a>Link</a>
+  </body>
+</html>
+"""
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def given_a_file_in_test_dir(
+        self, filename: str, content: str, age: int = 60
+    ) -> str:
+        filename = os.path.join(self.directory, filename)
+        with open(filename, "w+") as stream:
+            stream.write(content)
+        mtime = time.time() - age
+        os.utime(filename, (mtime, mtime))
+        return filename
+
+    def run_main(self, *args: str) -> tuple[int, str]:
+        with OutputCapture() as output:
+            result = check_chameleon.check_chameleon.main(
+                ["--cache-dir", self.cache_dir, *args]
+            )
+        return result, output.captured
+
+    def test_default_directory_follows_xdg_cache_home(self):
+        with unittest.mock.patch.dict(os.environ, {"XDG_CACHE_HOME": "/xdg"}):
+            self.assertEqual(
+                "/xdg/check-chameleon", check_chameleon.cache.default_directory()
+            )
+
+    def test_tool_version_of_uninstalled_package(self):
+        with unittest.mock.patch(
+            "importlib.metadata.version",
+            side_effect=check_chameleon.cache.importlib.metadata.PackageNotFoundError,
+        ):
+            self.assertEqual("unknown", check_chameleon.cache.tool_version())
+
+    def test_errors_are_replayed_without_checking(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", LINK_MISSING_HREF)
+        first = self.run_main(filename)
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon.Context,
+            "run",
+            side_effect=AssertionError("checked again"),
+        ):
+            second = self.run_main(filename)
+        self.assertEqual(1, first[0])
+        self.assertEqual(first, second)
+
+    def test_errors_are_replayed_for_another_name(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", LINK_MISSING_HREF)
+        copy = self.given_a_file_in_test_dir("copy.cpt", LINK_MISSING_HREF)
+        self.run_main(filename)
+        result, output = self.run_main(copy)
+        self.assertEqual(1, result)
+        self.assertTrue(output.startswith(f"{copy}:3 "))
+
+    def test_changed_content_is_checked_again(self):
+        filename = self.given_a_file_in_test_dir("file.cpt", LINK_MISSING_HREF)
+        self.assertEqual(1, self.run_main(filename)[0])
+        self.given_a_file_in_test_dir(
+            "file.cpt", LINK_MISSING_HREF.replace("<a>", '<a href="x">')
+        )
+        self.assertEqual((0, ""), self.run_main(filename))
+
+    def test_recently_modified_file_is_hashed_every_time(self):
+        filename = self.given_a_file_in_test_dir("file.cpt", LINK_MISSING_HREF, age=0)
+        self.run_main(filename)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "stat")))
+        self.assertEqual(1, self.run_main(filename)[0])
+
+    def test_exclusion_is_part_of_the_key(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", LINK_MISSING_HREF)
+        self.assertEqual(1, self.run_main(filename)[0])
+        self.assertEqual(
+            (0, ""), self.run_main("--a11y-lint-exclude", self.directory, filename)
+        )
+        self.assertEqual(1, self.run_main(filename)[0])
+
+    def test_no_cache(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", LINK_MISSING_HREF)
+        with OutputCapture():
+            check_chameleon.check_chameleon.main(["--no-cache", filename])
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_missing_file_is_not_cached(self):
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="")
+        self.assertIsNone(cache.get(os.path.join(self.directory, "nope"), False))
+        cache.put(os.path.join(self.directory, "nope"), [])
+        self.assertEqual(0, cache.written)
+
+    def test_unreadable_file_is_not_cached(self):
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="")
+        self.assertIsNone(cache.get(self.directory, False))
+
+    def test_unwritable_cache_directory_is_ignored(self):
+        filename = self.given_a_file_in_test_dir("file.cpt", LINK_MISSING_HREF)
+        with open(self.cache_dir, "w"):
+            pass
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="")
+        self.assertIsNone(cache.get(filename, False))
+        cache.put(filename, [])
+        self.assertEqual(0, cache.written)
+        cache.prune()
+
+    def test_failed_write_leaves_no_temporary_file(self):
+        target = os.path.join(self.cache_dir, "entry")
+        with unittest.mock.patch("os.replace", side_effect=OSError):
+            with self.assertRaises(OSError):
+                check_chameleon.cache._write_atomic(target, "data")
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_prune_removes_least_recently_used_entries(self):
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="", max_entries=5)
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", f"<p>{i}</p>")
+            for i in range(10)
+        ]
+        for filename in filenames:
+            cache.get(filename, False)
+            cache.put(filename, [])
+        old = time.time() - 100
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                os.utime(os.path.join(root, name), (old, old))
+        # Hitting an entry marks it as recently used.
+        self.assertEqual([], cache.get(filenames[3], False))
+        cache.prune()
+        remaining = self.entries()
+        self.assertEqual(9, len(remaining))
+        self.assertIn(cache._result_path(cache._keys[filenames[3]]), remaining)
+
+    def entries(self) -> list[str]:
+        return [
+            os.path.join(root, name)
+            for part in ("stat", "results")
+            for root, _, names in os.walk(os.path.join(self.cache_dir, part))
+            for name in names
+        ]
+
+    def test_prune_walks_the_directory_occasionally(self):
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="", max_entries=60)
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", f"<p>{i}</p>")
+            for i in range(40)
+        ]
+        index = os.path.join(self.cache_dir, "macros", "index.json")
+        check_chameleon.cache._write_atomic(index, "{}")
+        walks = []
+        walk = os.walk
+
+        def recording_walk(top, *args, **kw):
+            walks.append(os.path.relpath(top, self.cache_dir))
+            return walk(top, *args, **kw)
+
+        with unittest.mock.patch("os.walk", recording_walk):
+            for start in range(0, 40, 2):
+                for filename in filenames[start : start + 2]:
+                    cache.get(filename, False)
+                    cache.put(filename, [])
+                cache.prune()
+        # Every third run wrote the tenth of the entries allowed.
+        self.assertEqual(["stat", "results"] * 6, walks)
+        with open(os.path.join(self.cache_dir, "writes")) as stream:
+            self.assertEqual("4", stream.read())
+        self.assertTrue(os.path.exists(index))
+
+    def test_prune_keeps_cache_below_limit(self):
+        cache = check_chameleon.cache.Cache(self.cache_dir, salt="", max_entries=5)
+        filename = self.given_a_file_in_test_dir("file.cpt", "<p/>")
+        cache.get(filename, False)
+        cache.put(filename, [])
+        cache.prune()
+        self.assertEqual([], cache.get(filename, False))
+
+    def test_cached_and_checked_files_keep_input_order(self):
+        first = self.given_a_file_in_test_dir("first.cpt", LINK_MISSING_HREF)
+        second = self.given_a_file_in_test_dir("second.cpt", "gibberish")
+        third = self.given_a_file_in_test_dir("third.cpt", LINK_MISSING_HREF + " ")
+        self.run_main(first, third)
+        result, output = self.run_main(first, second, third)
+        self.assertEqual(1, result)
+        self.assertEqual(
+            [first, second, third],
+            [line.split(":", 1)[0] for line in output.splitlines()],
+        )
+
+    def test_entries_kept_in_memory(self):
+        filename = self.given_a_file_in_test_dir("file.cpt", LINK_MISSING_HREF)
+        with unittest.mock.patch.object(check_chameleon.cache, "_memory", None):
+            check_chameleon.cache.keep_in_memory()
+            cache = check_chameleon.cache.Cache(self.cache_dir, salt="")
+            self.assertIsNone(cache.get(filename, False))
+            diagnostic = Diagnostic(filename, 3, None, "CC001", "error")
+            cache.put(filename, [diagnostic])
+            shutil.rmtree(self.cache_dir)
+            self.assertEqual([diagnostic], cache.get(filename, False))
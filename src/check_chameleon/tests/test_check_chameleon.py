@@ -1,8 +1,15 @@
+import concurrent.futures
+import importlib.metadata
+import mmap
 import os
 import os.path
 import shutil
+import subprocess
+import sys
 import tempfile
+import types
 import unittest
+import unittest.mock
 
 import lxml.etree
 from testfixtures import OutputCapture
@@ -243,6 +250,30 @@ LABEL_WITH_XNG_ATTR_FOR = """\
 </html>
 """
 
+ID_REFERENCES = """\
+<html
+  xmlns="http://www.w3.org/1999/xhtml"
+  xmlns:tal="http://xml.zope.org/namespaces/tal">
+  <body>
+    <label for="later">Later</label>
+    <label for="missing">Missing</label>
+    <label for="${view.id}">Dynamic</label>
+    <input id="later" type="text" aria-describedby="help missing other"/>
+    <p id="help">Help</p>
+    <p id="help">Again</p>
+    <p id="choice" tal:condition="view.a">A</p>
+    <p id="choice" tal:condition="not:view.a">B</p>
+    <tal:block condition="view.b"><p id="block">C</p></tal:block>
+    <tal:block condition="not:view.b"><p id="block">D</p></tal:block>
+    <div aria-labelledby="help choice"><p>Text</p></div>
+    <label for="outer">
+      <label for="inner">Inner</label>
+      <span aria-labelledby="nested">Outer</span>
+    </label>
+  </body>
+</html>
+"""
+
 LABEL_WRAPS_INPUT = """\
 <html
   xmlns="http://www.w3.org/1999/xhtml"
@@ -304,6 +335,31 @@ HTML_WITH_DOCTYPE = """\
 </html>
 """
 
+NO_NAMESPACE_MISSING_ALT_AND_HREF = """\
+<html>
+  <body>
+    <img src="image.png"/>
+    <a>Link</a>
+  </body>
+</html>
+"""
+
+NESTED_ERRORS = """\
+<!-- Comment before the root element. -->
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <a><img src="image.png"/></a>
+    <div><p>Text</p><label>Label</label></div>
+    <a href="#"><span><img/></span></a>
+    <button></button>
+  </body>
+</html>
+"""
+
+
+def id_checks():
+    return check_chameleon.check_chameleon.load_checks(("CC006", "CC007", "CC008"))
+
 
 class TestAttributeHelper(unittest.TestCase):
     def test_attribute_found(self):
@@ -498,17 +554,207 @@ class TestAttributeHelper(unittest.TestCase):
         )[0]
         self.assertIsNone(check_chameleon.check_chameleon.attribute(node, "class"))
 
+    def test_parse_tal_attributes_escaped_semicolon(self):
+        self.assertEqual(
+            {"style": "'color: red; margin: 0'", "title": "'Title'"},
+            check_chameleon.check_chameleon.parse_tal_attributes(
+                "style 'color: red;; margin: 0'; title 'Title'"
+            ),
+        )
+
+    def test_parse_tal_attributes_empty_and_incomplete_segments(self):
+        self.assertEqual(
+            {"class": "'foo'"},
+            check_chameleon.check_chameleon.parse_tal_attributes(
+                "; class 'foo'; ;disabled;"
+            ),
+        )
+
+    def test_attribute_tal_attributes_first_definition_wins(self):
+        self.assertEqual(
+            {"class": "'foo'"},
+            check_chameleon.check_chameleon.parse_tal_attributes(
+                "class 'foo'; class 'bar'"
+            ),
+        )
+
+    def test_attribute_tal_attributes_cache(self):
+        node = lxml.etree.fromstring(
+            '<div xmlns:tal="http://xml.zope.org/namespaces/tal"'
+            "  tal:attributes=\"id 'some-id'; class 'foo'\""
+            '  x-ng-title="{{title}}"/>'
+        )
+        cache = {}
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon,
+            "parse_tal_attributes",
+            wraps=check_chameleon.check_chameleon.parse_tal_attributes,
+        ) as parse:
+            for name, expected in [
+                ("class", "'foo'"),
+                ("id", "'some-id'"),
+                ("title", "{{title}}"),
+            ]:
+                self.assertEqual(
+                    expected,
+                    check_chameleon.check_chameleon.attribute(node, name, cache),
+                )
+        self.assertEqual(1, parse.call_count)
+
+
+@check_chameleon.check_chameleon.check("XX001", "p")
+def paragraph_check(context, node):
+    context.report(node, "Paragraph found.")
+
+
+class TestCheckSelection(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        self.filename = os.path.join(self.directory, "invalid.cpt")
+        with open(self.filename, "w") as stream:
+            stream.write(NESTED_ERRORS)
+
+    def reported(self, *args: str) -> list[str]:
+        """Return the start of the reported messages."""
+        with OutputCapture() as output:
+            check_chameleon.check_chameleon.main(["--no-cache", *args, self.filename])
+        return [line.split(" ", 1)[1][:8] for line in output.captured.splitlines()]
+
+    def test_is_selected(self):
+        is_selected = check_chameleon.check_chameleon.is_selected
+        self.assertTrue(is_selected("CC001"))
+        self.assertTrue(is_selected("CC001", select=["CC0"]))
+        self.assertFalse(is_selected("CC001", select=["CC002"]))
+        self.assertFalse(is_selected("CC001", select=[]))
+        self.assertFalse(is_selected("CC001", ignore=["CC"]))
+        self.assertFalse(is_selected("CC001", select=["CC"], ignore=["CC001"]))
+        # Opt-in checks need their full code.
+        self.assertFalse(is_selected("CC006"))
+        self.assertFalse(is_selected("CC006", select=["CC"]))
+        self.assertTrue(is_selected("CC006", select=["CC", "CC006"]))
+        extend_selection = check_chameleon.check_chameleon.extend_selection
+        self.assertIsNone(extend_selection(None, ()))
+        self.assertEqual(("", "CC006"), extend_selection(None, ("CC006",)))
+        self.assertEqual(("CC001", "CC006"), extend_selection(("CC001",), ["CC006"]))
+        self.assertTrue(is_selected("CC001", select=("", "CC006")))
+        self.assertFalse(is_selected("CC007", select=("", "CC006")))
+
+    def test_all_checks_by_default(self):
+        self.assertEqual(6, len(self.reported()))
+
+    def test_select(self):
+        self.assertEqual(["The <img"] * 2, self.reported("--select=CC002"))
+
+    def test_ignore(self):
+        self.assertEqual(3, len(self.reported("--ignore", "CC002, CC004")))
+
+    def test_select_nothing_checks_syntax_only(self):
+        self.assertEqual([], self.reported("--select="))
+
+    def test_config_in_pyproject_toml(self):
+        with open("pyproject.toml", "w") as stream:
+            stream.write('[tool.check-chameleon]\nselect = ["CC002"]\n')
+        self.assertEqual(2, len(self.reported()))
+        # Options take precedence.
+        self.assertEqual(6, len(self.reported("--select=CC")))
+
+    def test_pyproject_toml_without_config(self):
+        with open("pyproject.toml", "w") as stream:
+            stream.write("[project]\nname = 'templates'\n")
+        self.assertEqual(6, len(self.reported()))
+
+    def test_checks_from_entry_points(self):
+        entry_point = importlib.metadata.EntryPoint(
+            "XX001",
+            f"{__name__}:paragraph_check",
+            check_chameleon.check_chameleon.CHECKS_ENTRY_POINT_GROUP,
+        )
+        check_chameleon.check_chameleon.load_checks.cache_clear()
+        self.addCleanup(check_chameleon.check_chameleon.load_checks.cache_clear)
+        with unittest.mock.patch(
+            "importlib.metadata.entry_points", return_value=[entry_point]
+        ):
+            self.assertIn("XX001", check_chameleon.check_chameleon.available_checks())
+            self.assertEqual(["Paragrap"], self.reported("--select=XX"))
+
+    def test_cache_is_per_version_of_the_checks(self):
+        def entry_point(version: str) -> types.SimpleNamespace:
+            return types.SimpleNamespace(
+                name="XX001",
+                dist=types.SimpleNamespace(name="checks", version=version),
+                load=lambda: paragraph_check,
+            )
+
+        check_chameleon.check_chameleon.load_checks.cache_clear()
+        self.addCleanup(check_chameleon.check_chameleon.load_checks.cache_clear)
+        salts = []
+        for version in ("1.0", "1.0", "1.1"):
+            with (
+                unittest.mock.patch(
+                    "importlib.metadata.entry_points",
+                    return_value=[entry_point(version)],
+                ),
+                unittest.mock.patch(
+                    "check_chameleon.cache.Cache",
+                    side_effect=lambda directory, salt: salts.append(salt),
+                ),
+                OutputCapture(),
+            ):
+                check_chameleon.check_chameleon.main(
+                    ["--cache-dir=cache", "--select=XX", self.filename]
+                )
+        self.assertIn("XX001 checks 1.0", salts[0])
+        self.assertEqual(salts[0], salts[1])
+        self.assertNotEqual(salts[0], salts[2])
+
+    def test_unselected_checks_are_not_imported(self):
+        script = (
+            "import sys\n"
+            "from check_chameleon.check_chameleon import main\n"
+            f"main(['--no-cache', '--select=', {self.filename!r}])\n"
+            "print('check_chameleon.checks' in sys.modules)\n"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        ).stdout
+        self.assertEqual("False", output.strip())
+
+
+class TestXPathRegistry(unittest.TestCase):
+    def test_expressions_are_compiled_once(self):
+        expression = "boolean(.//xhtml:span)"
+        compiled = check_chameleon.check_chameleon.xpath(expression)
+        self.assertIs(compiled, check_chameleon.check_chameleon.xpath(expression))
+        node = lxml.etree.fromstring(
+            '<p xmlns="http://www.w3.org/1999/xhtml"><span/></p>'
+        )
+        self.assertTrue(compiled(node))
+
 
 class TestA11yLint(unittest.TestCase):
     def setUp(self) -> None:
         self.directory = tempfile.mkdtemp()
+        patcher = unittest.mock.patch.dict(
+            os.environ, {"XDG_CACHE_HOME": os.path.join(self.directory, "cache")}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def tearDown(self) -> None:
         shutil.rmtree(self.directory)
 
-    def given_a_file_in_test_dir(self, filename: str, content: str) -> str:
+    def given_a_file_in_test_dir(self, filename: str, content: str | bytes) -> str:
         filename = os.path.join(self.directory, filename)
-        with open(filename, "w+") as stream:
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        with open(filename, "wb") as stream:
             stream.write(content)
         return filename
 
@@ -648,6 +894,94 @@ class TestA11yLint(unittest.TestCase):
         with OutputCapture():
             self.assertEqual(check_chameleon.check_chameleon.main([filename]), 0)
 
+    def test_id_references(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", ID_REFERENCES)
+        for stream_threshold in (None, 0):
+            with self.subTest(stream_threshold=stream_threshold):
+                context = check_chameleon.check_chameleon.Context(
+                    filename, stream_threshold=stream_threshold, checks=id_checks()
+                )
+                context.run()
+                self.assertEqual(
+                    [
+                        (10, "CC008"),
+                        (6, "CC006"),
+                        (8, "CC007"),
+                        (16, "CC006"),
+                        (17, "CC006"),
+                        (18, "CC007"),
+                    ],
+                    [(d.line, d.code) for d in context.diagnostics],
+                )
+                prefixes = [
+                    'The id "help" is already used on line 9.',
+                    'The <label> element refers to id "missing" in its for',
+                    'The aria-describedby attribute refers to "missing", "other",',
+                ]
+                for diagnostic, prefix in zip(context.diagnostics, prefixes):
+                    self.assertTrue(diagnostic.message.startswith(prefix), prefix)
+
+    def test_ids_set_elsewhere_are_unknown(self):
+        for replacement in (
+            '<p tal:attributes="id view.id">',
+            '<p id="${view.id}">',
+            '<p metal:use-macro="view/macros/page">',
+            '<p tal:content="structure view/widget">',
+            '<tal:x replace="structure view/widget"/><p>',
+        ):
+            with self.subTest(replacement=replacement):
+                filename = self.given_a_file_in_test_dir(
+                    "partial.cpt",
+                    ID_REFERENCES.replace(
+                        'xmlns:tal="http://xml.zope.org/namespaces/tal"',
+                        'xmlns:tal="http://xml.zope.org/namespaces/tal"'
+                        ' xmlns:metal="http://xml.zope.org/namespaces/metal"',
+                    ).replace('<p id="help">Again', f"{replacement}Again"),
+                )
+                context = check_chameleon.check_chameleon.Context(
+                    filename, checks=id_checks()
+                )
+                context.run()
+                self.assertEqual([], context.diagnostics)
+
+    def test_id_checks_are_opt_in(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", ID_REFERENCES)
+        with OutputCapture() as output:
+            self.assertEqual(check_chameleon.check_chameleon.main([filename]), 0)
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(["--select=CC0", filename]), 0
+            )
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    ["--extend-select=CC006", filename]
+                ),
+                1,
+            )
+        self.assertEqual(
+            ["The <label>"] * 3,
+            [line.split(" ", 1)[1][:11] for line in output.captured.splitlines()],
+        )
+
+    def test_id_index_is_only_built_when_needed(self):
+        filename = self.given_a_file_in_test_dir("valid.cpt", ID_REFERENCES)
+        seen = []
+        every = check_chameleon.check_chameleon.check("XX001", "*")(
+            lambda context, node: seen.append(node.tag)
+        )
+        for stream_threshold in (None, 0):
+            with self.subTest(stream_threshold=stream_threshold):
+                del seen[:]
+                context = check_chameleon.check_chameleon.Context(
+                    filename, stream_threshold=stream_threshold, checks=[every]
+                )
+                self.assertEqual([], context.run())
+                self.assertIsNone(context.ids)
+                self.assertEqual(19, len(seen))
+                context = check_chameleon.check_chameleon.Context(
+                    filename, stream_threshold=stream_threshold, checks=()
+                )
+                self.assertEqual([], context.run())
+
     def test_label_wraps_input(self):
         filename = self.given_a_file_in_test_dir("valid.cpt", LABEL_WRAPS_INPUT)
         with OutputCapture():
@@ -701,3 +1035,560 @@ class TestA11yLint(unittest.TestCase):
                 ),
                 1,
             )
+
+    def test_checks_match_elements_without_namespace(self):
+        filename = self.given_a_file_in_test_dir(
+            "invalid.cpt", NO_NAMESPACE_MISSING_ALT_AND_HREF
+        )
+        errors = check_chameleon.check_chameleon.Context(filename).run()
+        self.assertEqual(
+            [f"{filename}:3", f"{filename}:4"],
+            [error.split(" ", 1)[0] for error in errors],
+        )
+
+    def test_parallel_output_matches_serial(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", content)
+            for i, content in enumerate(
+                [LINK_MISSING_HREF, LINK_HREF, "gibberish", IMG_MISSING_ALT] * 3
+            )
+        ]
+        with OutputCapture() as serial:
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    ["--no-cache", "--jobs=1", *filenames]
+                ),
+                1,
+            )
+        with OutputCapture() as parallel:
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    ["--no-cache", "--jobs=3", *filenames]
+                ),
+                1,
+            )
+        with OutputCapture() as auto:
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(["--no-cache", *filenames]), 1
+            )
+        self.assertEqual(serial.captured, parallel.captured)
+        self.assertEqual(serial.captured, auto.captured)
+        self.assertEqual(9, len(serial.captured.splitlines()))
+
+    def test_check_chunk_runs_files_in_order(self):
+        first = self.given_a_file_in_test_dir("first.cpt", LINK_MISSING_HREF)
+        second = self.given_a_file_in_test_dir("second.cpt", LINK_HREF)
+        self.assertEqual(
+            [1, 0],
+            [
+                len(result.diagnostics)
+                for result in check_chameleon.check_chameleon._check_chunk(
+                    [first, second]
+                )
+            ],
+        )
+
+    def test_syntax_error_line_numbers_exclude_prolog(self):
+        filename = self.given_a_file_in_test_dir(
+            "invalid.cpt", "<html>\n  <p>\n</html>\n"
+        )
+        errors = check_chameleon.check_chameleon.Context(filename).run()
+        self.assertEqual(1, len(errors))
+        self.assertIn("line 3", errors[0])
+
+    def test_encoding_from_xml_declaration(self):
+        filename = self.given_a_file_in_test_dir(
+            "valid.cpt",
+            '<?xml version="1.0" encoding="iso-8859-1"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+            '  <img src="caf\xe9.png"/>\n'
+            "</html>\n".encode("iso-8859-1"),
+        )
+        context = check_chameleon.check_chameleon.Context(filename)
+        errors = context.run()
+        self.assertEqual("café.png", context.node[0].get("src"))
+        self.assertEqual([f"{filename}:3"], [e.split(" ", 1)[0] for e in errors])
+
+    def test_byte_order_mark_without_xml_declaration(self):
+        filename = self.given_a_file_in_test_dir(
+            "valid.cpt", b"\xef\xbb\xbf" + LINK_HREF.encode("utf-8")
+        )
+        self.assertEqual([], check_chameleon.check_chameleon.Context(filename).run())
+
+    def test_large_file_is_memory_mapped(self):
+        filename = self.given_a_file_in_test_dir(
+            "invalid.cpt", IMG_MISSING_ALT.replace("<body>", "<body>" + "&nbsp;" * 50)
+        )
+        with unittest.mock.patch.multiple(
+            check_chameleon.check_chameleon, MMAP_THRESHOLD=64, FEED_CHUNK_SIZE=32
+        ):
+            context = check_chameleon.check_chameleon.Context(filename)
+            errors = context.run()
+        self.assertIsInstance(
+            context.content, check_chameleon.check_chameleon.mmap.mmap
+        )
+        self.assertEqual([f"{filename}:5"], [e.split(" ", 1)[0] for e in errors])
+
+    def assert_streaming_matches_tree(self, content: str) -> list[str]:
+        filename = self.given_a_file_in_test_dir("file.cpt", content)
+        tree = check_chameleon.check_chameleon.Context(filename).run()
+        stream = check_chameleon.check_chameleon.Context(
+            filename, stream_threshold=0
+        ).run()
+        self.assertEqual(tree, stream)
+        return stream
+
+    def test_streaming_matches_tree_mode(self):
+        templates = [
+            value
+            for name, value in globals().items()
+            if name.isupper() and isinstance(value, str)
+        ]
+        self.assertGreater(len(templates), 25)
+        for content in templates + ["gibberish", "<html>\n<a>\n</html>"]:
+            with self.subTest(content=content):
+                self.assert_streaming_matches_tree(content)
+
+    def test_streaming_reports_nested_errors_in_document_order(self):
+        errors = self.assert_streaming_matches_tree(NESTED_ERRORS)
+        self.assertEqual(
+            [4, 4, 5, 6, 6, 7],
+            [int(error.split(" ", 1)[0].rsplit(":", 1)[1]) for error in errors],
+        )
+
+    def test_streaming_releases_processed_elements(self):
+        filename = self.given_a_file_in_test_dir(
+            "valid.cpt",
+            '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+            + '<p><a href="link.html">Link</a></p>' * 100
+            + "</body></html>",
+        )
+        context = check_chameleon.check_chameleon.Context(filename, stream_threshold=0)
+        self.assertEqual([], context.run())
+        self.assertLess(len(list(context.node.iter())), 5)
+
+    def test_streaming_excluded_file(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", LINK_MISSING_HREF)
+        with OutputCapture():
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    [
+                        "--stream-threshold=0",
+                        "--a11y-lint-exclude",
+                        self.directory,
+                        filename,
+                    ]
+                ),
+                0,
+            )
+
+    def test_fail_fast(self):
+        first = self.given_a_file_in_test_dir("first.cpt", LINK_HREF)
+        second = self.given_a_file_in_test_dir("second.cpt", NESTED_ERRORS)
+        third = self.given_a_file_in_test_dir("third.cpt", IMG_MISSING_ALT)
+        with OutputCapture() as output:
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    ["--fail-fast", first, second, third]
+                ),
+                1,
+            )
+        errors = output.captured.splitlines()
+        self.assertEqual(6, len(errors))
+        self.assertTrue(all(error.startswith(second) for error in errors))
+
+    def test_max_errors(self):
+        first = self.given_a_file_in_test_dir("first.cpt", NESTED_ERRORS)
+        second = self.given_a_file_in_test_dir("second.cpt", IMG_MISSING_ALT)
+        for max_errors, expected in ((2, 2), (6, 6), (10, 7)):
+            with self.subTest(max_errors=max_errors):
+                with OutputCapture() as output:
+                    self.assertEqual(
+                        check_chameleon.check_chameleon.main(
+                            [f"--max-errors={max_errors}", first, second]
+                        ),
+                        1,
+                    )
+                self.assertEqual(expected, len(output.captured.splitlines()))
+        with OutputCapture(separate=True) as output:
+            with self.assertRaises(SystemExit):
+                check_chameleon.check_chameleon.main(["--max-errors=0", first])
+        self.assertIn("argument --max-errors:", output.stderr.getvalue())
+
+    def test_fail_fast_cancels_parallel_work(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", content)
+            for i, content in enumerate([IMG_MISSING_ALT] + [LINK_HREF] * 63)
+        ]
+        shutdowns = []
+        shutdown = concurrent.futures.ProcessPoolExecutor.shutdown
+
+        def record_shutdown(executor, **kw):
+            shutdowns.append(kw)
+            shutdown(executor, **kw)
+
+        with (
+            unittest.mock.patch.object(
+                concurrent.futures.ProcessPoolExecutor, "shutdown", record_shutdown
+            ),
+            OutputCapture() as output,
+        ):
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(
+                    ["--no-cache", "--jobs=2", "--fail-fast", *filenames]
+                ),
+                1,
+            )
+        self.assertEqual(1, len(output.captured.splitlines()))
+        self.assertEqual([{"wait": True, "cancel_futures": True}], shutdowns)
+        shutdowns.clear()
+        with (
+            unittest.mock.patch.object(
+                concurrent.futures.ProcessPoolExecutor, "shutdown", record_shutdown
+            ),
+            OutputCapture() as output,
+        ):
+            check_chameleon.check_chameleon.main(["--no-cache", "--jobs=2", *filenames])
+        # A completed run has nothing to cancel.
+        self.assertEqual([{"wait": True, "cancel_futures": False}], shutdowns)
+
+    def test_input_is_checked_in_windows(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", content)
+            for i, content in enumerate([IMG_MISSING_ALT, LINK_HREF, "gibberish"] * 4)
+        ]
+        taken = []
+
+        def lazily():
+            for filename in filenames:
+                taken.append(filename)
+                yield filename
+
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                taken.clear()
+                results = check_chameleon.check_chameleon.check_files(
+                    lazily(), jobs=jobs, batch_size=4
+                )
+                self.assertEqual(filenames[0], next(results)[0])
+                # The next window is taken before the first is done.
+                self.assertEqual(filenames[:8], taken)
+                self.assertEqual(filenames[1:], [filename for filename, _ in results])
+
+    def test_plan_memory(self):
+        plan_memory = check_chameleon.check_chameleon.plan_memory
+        mib = 1 << 20
+        self.assertEqual((4, 64 * mib), plan_memory(1024 * mib, 4, 64 * mib))
+        self.assertEqual((4, 32 * mib), plan_memory(384 * mib, 4, 64 * mib))
+        self.assertEqual((2, 0), plan_memory(128 * mib, 4, 64 * mib))
+        self.assertEqual((1, 0), plan_memory(16 * mib, 4, 64 * mib))
+
+    def test_checked_document_is_released(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", IMG_MISSING_ALT)
+        with open(filename, "rb") as stream:
+            content = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        released = []
+        release = check_chameleon.check_chameleon.Context.release
+
+        def recording_release(context):
+            release(context)
+            released.append((context.node, context.content))
+
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon.Context, "release", recording_release
+        ):
+            result = check_chameleon.check_chameleon.check_file(
+                filename, content=content
+            )
+        self.assertEqual(1, len(result.diagnostics))
+        self.assertEqual([(None, None)], released)
+        self.assertTrue(content.closed)
+
+    def test_batch_options(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", IMG_MISSING_ALT)
+            for i in range(3)
+        ]
+        pools = []
+        executor = concurrent.futures.ProcessPoolExecutor
+
+        def recording_executor(**kw):
+            pools.append(kw)
+            return executor(**kw)
+
+        with (
+            unittest.mock.patch(
+                "concurrent.futures.ProcessPoolExecutor", recording_executor
+            ),
+            OutputCapture() as output,
+        ):
+            self.assertEqual(
+                1,
+                check_chameleon.check_chameleon.main(
+                    [
+                        "--no-cache",
+                        "--jobs=4",
+                        "--batch-size=2",
+                        "--max-files-per-worker=1",
+                        "--max-memory=128",
+                        *filenames,
+                    ]
+                ),
+            )
+        self.assertEqual(
+            filenames, [line.split(":")[0] for line in output.captured.splitlines()]
+        )
+        (pool,) = pools
+        self.assertEqual(2, pool["max_workers"])
+        self.assertEqual(1, pool["max_tasks_per_child"])
+        self.assertEqual(0, pool["initargs"][0]["prefetch_bytes"])
+
+    def test_invalid_counts(self):
+        for option, value in (
+            ("--batch-size", "0"),
+            ("--batch-size", "-1"),
+            ("--max-memory", "0"),
+            ("--max-files-per-worker", "-1"),
+            ("--prefetch-bytes", "-1"),
+            ("--prefetch-bytes", "many"),
+        ):
+            with self.subTest(option=option, value=value):
+                with OutputCapture(separate=True) as output:
+                    with self.assertRaises(SystemExit):
+                        check_chameleon.check_chameleon.main(
+                            [f"{option}={value}", "page.cpt"]
+                        )
+                self.assertIn(f"argument {option}:", output.stderr.getvalue())
+
+    def test_no_files(self):
+        self.assertEqual([], list(check_chameleon.check_chameleon.check_files([])))
+
+    def test_excluded_files_are_validated_without_a_tree(self):
+        broken = "<html>\n<body>\n<img>\n</body>\n</html>\n"
+        for content, expected in (
+            (NESTED_ERRORS, 0),
+            (broken, 1),
+            (broken.replace("<html>", "<!DOCTYPE html>\n<html>"), 1),
+        ):
+            for stream_threshold in (None, 0):
+                with self.subTest(content=content, stream_threshold=stream_threshold):
+                    filename = self.given_a_file_in_test_dir("page.cpt", content)
+                    checked = check_chameleon.check_chameleon.Context(
+                        filename, stream_threshold=stream_threshold
+                    )
+                    excluded = check_chameleon.check_chameleon.Context(
+                        filename,
+                        a11y_lint_exclude=self.directory,
+                        stream_threshold=stream_threshold,
+                    )
+                    errors = excluded.run()
+                    self.assertIsNone(excluded.node)
+                    self.assertEqual(expected, len(errors))
+                    if expected:
+                        self.assertEqual(checked.run(), errors)
+
+    def test_profile_timings_of_excluded_file(self):
+        filename = self.given_a_file_in_test_dir("page.cpt", NESTED_ERRORS)
+        context = check_chameleon.check_chameleon.Context(
+            filename, a11y_lint_exclude=self.directory, profile=True
+        )
+        self.assertEqual([], context.run())
+        self.assertEqual({"read", "parse"}, set(context.timings))
+
+    def test_prefetch_is_capped(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", "<p/>") for i in range(6)
+        ]
+        sized = []
+
+        def file_size(filename):
+            sized.append(filename)
+            return 100
+
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon, "_file_size", file_size
+        ):
+            for max_bytes, ahead in ((250, [3, 4]), (50, [1, 2])):
+                with self.subTest(max_bytes=max_bytes):
+                    sized.clear()
+                    files = check_chameleon.check_chameleon.prefetch(
+                        filenames, max_bytes
+                    )
+                    filename, content = next(files)
+                    self.assertEqual(
+                        (filenames[0], b"<p/>"), (filename, content.result())
+                    )
+                    self.assertEqual(ahead[0], len(sized))
+                    next(files)
+                    self.assertEqual(ahead[1], len(sized))
+                    files.close()
+        self.assertEqual(
+            filenames,
+            [
+                filename
+                for filename, _ in check_chameleon.check_chameleon.prefetch(filenames)
+            ],
+        )
+
+    def test_prefetch_reports_read_errors_when_checked(self):
+        missing = os.path.join(self.directory, "missing.cpt")
+        files = check_chameleon.check_chameleon.prefetch([missing])
+        filename, content = next(files)
+        self.assertEqual(missing, filename)
+        with self.assertRaises(FileNotFoundError):
+            content.result()
+
+    def test_prefetch_pages_in_mapped_files(self):
+        filename = self.given_a_file_in_test_dir("large.cpt", NESTED_ERRORS)
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon, "MMAP_THRESHOLD", 10
+        ):
+            ((_, content),) = check_chameleon.check_chameleon.prefetch([filename])
+            self.assertIsInstance(content.result(), mmap.mmap)
+            self.assertEqual(
+                6,
+                len(
+                    check_chameleon.check_chameleon.check_file(
+                        filename, content=content.result()
+                    ).diagnostics
+                ),
+            )
+
+    def test_prefetch_does_not_change_results(self):
+        filenames = [
+            self.given_a_file_in_test_dir(f"file{i}.cpt", content)
+            for i, content in enumerate([NESTED_ERRORS, LINK_HREF, "gibberish"] * 2)
+        ]
+        outputs = []
+        for prefetch_bytes in ("0", "10", "1000000"):
+            with OutputCapture() as output:
+                check_chameleon.check_chameleon.main(
+                    ["--no-cache", "--jobs=1", f"--prefetch-bytes={prefetch_bytes}"]
+                    + filenames
+                )
+            outputs.append(output.captured)
+        self.assertEqual(1, len(set(outputs)))
+        self.assertEqual(14, len(outputs[0].splitlines()))
+
+    def test_profile_timings_of_prefetched_file(self):
+        filename = self.given_a_file_in_test_dir("page.cpt", NESTED_ERRORS)
+        (result,) = check_chameleon.check_chameleon._check_chunk(
+            [filename], profile=True
+        )
+        self.assertIn("read", result.timings)
+        (result,) = check_chameleon.check_chameleon._check_chunk(
+            [filename], profile=True, prefetch_bytes=0
+        )
+        self.assertIn("read", result.timings)
+        context = check_chameleon.check_chameleon.Context(
+            filename, profile=True, content=b"<p/>"
+        )
+        self.assertEqual([], context.run())
+        self.assertEqual(0.0, context.timings["read"])
+
+    def test_profile_timings(self):
+        filename = self.given_a_file_in_test_dir("invalid.cpt", NESTED_ERRORS)
+        for stream_threshold in (None, 0):
+            with self.subTest(stream_threshold=stream_threshold):
+                context = check_chameleon.check_chameleon.Context(
+                    filename, stream_threshold=stream_threshold, profile=True
+                )
+                self.assertEqual(6, len(context.run()))
+                self.assertEqual(
+                    {
+                        "read",
+                        "parse",
+                        "missing_alt",
+                        "missing_button_content",
+                        "missing_for",
+                        "missing_href",
+                        "missing_link_content",
+                    },
+                    set(context.timings),
+                )
+                self.assertTrue(all(t >= 0 for t in context.timings.values()))
+
+    def test_no_timings_without_profile(self):
+        filename = self.given_a_file_in_test_dir("valid.cpt", LINK_HREF)
+        context = check_chameleon.check_chameleon.Context(filename)
+        context.run()
+        self.assertIsNone(context.timings)
+
+    def test_profile_summary(self):
+        first = self.given_a_file_in_test_dir("first.cpt", NESTED_ERRORS)
+        second = self.given_a_file_in_test_dir("second.cpt", LINK_HREF)
+        # Cache the second file.
+        with OutputCapture():
+            check_chameleon.check_chameleon.main([second])
+        with OutputCapture(separate=True) as output:
+            self.assertEqual(
+                check_chameleon.check_chameleon.main(["--profile=1", first, second]),
+                1,
+            )
+        self.assertEqual(6, len(output.stdout.getvalue().splitlines()))
+        summary = output.stderr.getvalue().splitlines()
+        self.assertEqual("Profile of 2 files (1 cached):", summary[0])
+        self.assertIn("Slowest files:", summary)
+        self.assertTrue(summary[-1].endswith(first))
+        self.assertEqual(10, len(summary))
+
+    def test_profile_summary_of_cached_files(self):
+        with OutputCapture(separate=True) as output:
+            check_chameleon.check_chameleon.print_profile({"cached.cpt": None}, 10)
+        output.compare(stderr="Profile of 1 files (1 cached):")
+
+
+class TestLibrary(unittest.TestCase):
+    def test_check_bytes(self):
+        for data in (IMG_MISSING_ALT, IMG_MISSING_ALT.encode("utf-8")):
+            (diagnostic,) = check_chameleon.check_chameleon.check_bytes(data)
+            self.assertEqual(("<bytes>", 5, None, "CC002"), diagnostic.fields()[:4])
+        self.assertEqual(
+            [],
+            check_chameleon.check_chameleon.check_bytes(
+                IMG_MISSING_ALT, "page.cpt", ignore=("CC002",)
+            ),
+        )
+        (diagnostic,) = check_chameleon.check_chameleon.check_bytes(
+            b"<p>\n</b>", "broken.cpt"
+        )
+        self.assertEqual(("broken.cpt", 2, 5, "CC000"), diagnostic.fields()[:4])
+
+    def test_check_tree(self):
+        tree = lxml.etree.fromstring(NESTED_ERRORS).getroottree()
+        source = lxml.etree.tostring(tree)
+        expected = [
+            (diagnostic.line, diagnostic.code)
+            for diagnostic in check_chameleon.check_chameleon.check_bytes(NESTED_ERRORS)
+        ]
+        self.assertTrue(expected)
+        for element in (tree, tree.getroot()):
+            found = check_chameleon.check_chameleon.check_tree(element, "page.cpt")
+            self.assertEqual(expected, [(d.line, d.code) for d in found])
+            self.assertEqual({"page.cpt"}, {d.filename for d in found})
+        # The tree of the caller is left as it is.
+        self.assertEqual(source, lxml.etree.tostring(tree))
+
+    def test_selection_can_be_given_as_lists(self):
+        for check in (
+            check_chameleon.check_chameleon.check_bytes,
+            lambda data, **kw: check_chameleon.check_chameleon.check_tree(
+                lxml.etree.fromstring(data), **kw
+            ),
+        ):
+            self.assertEqual(
+                [], check(IMG_MISSING_ALT, select=["CC"], ignore=["CC002"])
+            )
+            self.assertEqual(
+                ["CC002"],
+                [d.code for d in check(IMG_MISSING_ALT, select=["CC002"])],
+            )
+
+    def test_check_excluded_tree(self):
+        tree = lxml.etree.fromstring(IMG_MISSING_ALT)
+        self.assertEqual(
+            [],
+            check_chameleon.check_chameleon.check_tree(
+                tree, "/excluded/page.cpt", a11y_lint_exclude="/excluded"
+            ),
+        )
@@ -0,0 +1,247 @@
+import os
+import os.path
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.cache
+import check_chameleon.check_chameleon
+import check_chameleon.daemon
+
+LINK_MISSING_HREF = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <a>Link</a>
+  </body>
+</html>
+"""
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = unittest.mock.patch.dict(
+            os.environ,
+            {
+                "XDG_RUNTIME_DIR": self.directory,
+                "XDG_CACHE_HOME": os.path.join(self.directory, "cache"),
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = unittest.mock.patch.object(check_chameleon.cache, "_memory", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        self.filename = os.path.join(self.directory, "invalid.cpt")
+        with open(self.filename, "w") as stream:
+            stream.write(LINK_MISSING_HREF)
+
+    def start_server(self, idle_timeout: float = 0.5) -> threading.Thread:
+        server = check_chameleon.daemon.Server(
+            check_chameleon.daemon.socket_path(self.directory), idle_timeout
+        )
+        thread = threading.Thread(target=server.serve_until_idle)
+        thread.start()
+        return thread
+
+    def test_repository_root(self):
+        repository = os.path.join(self.directory, "repository")
+        nested = os.path.join(repository, "a", "b")
+        os.makedirs(nested)
+        os.mkdir(os.path.join(repository, ".git"))
+        self.assertEqual(repository, check_chameleon.daemon.repository_root(nested))
+        self.assertEqual(
+            self.directory, check_chameleon.daemon.repository_root(self.directory)
+        )
+
+    def test_socket_path_is_per_repository(self):
+        path = check_chameleon.daemon.socket_path(self.directory)
+        directory = os.path.dirname(path)
+        self.assertEqual(self.directory, os.path.dirname(directory))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(directory).st_mode))
+        self.assertNotEqual(path, check_chameleon.daemon.socket_path("/elsewhere"))
+
+    def test_no_server_in_a_shared_directory(self):
+        directory = check_chameleon.daemon.private_directory()
+        os.chmod(directory, 0o777)
+        with self.assertRaises(PermissionError):
+            check_chameleon.daemon.socket_path(self.directory)
+        with unittest.mock.patch("subprocess.Popen") as popen:
+            with OutputCapture(separate=True) as output:
+                self.assertEqual(1, check_chameleon.daemon.client_main([self.filename]))
+                self.assertEqual(1, check_chameleon.daemon.serve(self.directory))
+        popen.assert_not_called()
+        self.assertTrue(output.stdout.getvalue().startswith(f"{self.filename}:3 "))
+        self.assertIn("is not a private directory", output.stderr.getvalue())
+
+    def test_servers_of_other_users_are_not_trusted(self):
+        thread = self.start_server()
+        path = check_chameleon.daemon.socket_path(self.directory)
+        with unittest.mock.patch.object(
+            check_chameleon.daemon, "_peer_uid", return_value=os.getuid() + 1
+        ):
+            self.assertIsNone(
+                check_chameleon.daemon.request(path, [self.filename], self.directory)
+            )
+        # Without SO_PEERCRED, the owner of the socket is checked.
+        with unittest.mock.patch.object(check_chameleon.daemon, "SO_PEERCRED", None):
+            response = check_chameleon.daemon.request(
+                path, [self.filename], self.directory
+            )
+        self.assertEqual(1, response["code"])
+        thread.join(10)
+
+    def test_environment_of_the_client_is_applied(self):
+        seen = []
+
+        def main(argv):
+            seen.append(
+                {
+                    name: os.environ.get(name)
+                    for name in ("GIT_INDEX_FILE", "GIT_DIR", "XDG_CACHE_HOME", "HOME")
+                }
+            )
+            return 0
+
+        thread = self.start_server()
+        path = check_chameleon.daemon.socket_path(self.directory)
+        with (
+            unittest.mock.patch.dict(os.environ, {"GIT_DIR": "server"}),
+            unittest.mock.patch.object(check_chameleon.check_chameleon, "main", main),
+        ):
+            environ = dict(os.environ)
+            check_chameleon.daemon.request(
+                path,
+                [],
+                self.directory,
+                {"GIT_INDEX_FILE": "index.lock", "XDG_CACHE_HOME": "client"},
+            )
+            self.assertEqual(environ, os.environ)
+        thread.join(10)
+        self.assertEqual(
+            [
+                {
+                    "GIT_INDEX_FILE": "index.lock",
+                    "GIT_DIR": None,
+                    "XDG_CACHE_HOME": "client",
+                    "HOME": os.environ.get("HOME"),
+                }
+            ],
+            seen,
+        )
+
+    def test_client_reproduces_main(self):
+        with OutputCapture(separate=True) as expected:
+            code = check_chameleon.check_chameleon.main([self.filename])
+        thread = self.start_server(idle_timeout=0.5)
+        with OutputCapture(separate=True) as output:
+            self.assertEqual(code, check_chameleon.daemon.client_main([self.filename]))
+            self.assertEqual(2, check_chameleon.daemon.client_main(["--bogus"]))
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(
+            os.path.exists(check_chameleon.daemon.socket_path(self.directory))
+        )
+        self.assertEqual(expected.stdout.getvalue(), output.stdout.getvalue())
+        self.assertIn("unrecognized arguments", output.stderr.getvalue())
+
+    def test_long_running_options_are_not_forwarded(self):
+        long_running_option = check_chameleon.daemon.long_running_option
+        self.assertEqual("--watch", long_running_option(["--wat", "x.cpt"]))
+        self.assertEqual("--daemon", long_running_option(["--daemon"]))
+        self.assertIsNone(long_running_option(["--diff", "--", "--watch"]))
+        self.assertIsNone(long_running_option(["-j", "2", "x.cpt"]))
+        with (
+            unittest.mock.patch.object(check_chameleon.daemon, "request") as request,
+            unittest.mock.patch("subprocess.Popen") as popen,
+            OutputCapture(separate=True) as output,
+        ):
+            self.assertEqual(
+                2, check_chameleon.daemon.client_main(["--watch", self.filename])
+            )
+        request.assert_not_called()
+        popen.assert_not_called()
+        self.assertIn("--watch is not supported", output.stderr.getvalue())
+        # Nor run by a server when sent anyway.
+        thread = self.start_server()
+        response = check_chameleon.daemon.request(
+            check_chameleon.daemon.socket_path(self.directory),
+            ["--watch=yes"],
+            self.directory,
+        )
+        thread.join(10)
+        self.assertEqual(2, response["code"])
+
+    def test_server_reports_unexpected_errors(self):
+        thread = self.start_server()
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon, "main", side_effect=RuntimeError("boom")
+        ):
+            with OutputCapture(separate=True) as output:
+                self.assertEqual(1, check_chameleon.daemon.client_main(["x.cpt"]))
+        thread.join(10)
+        self.assertIn("RuntimeError: boom", output.stderr.getvalue())
+
+    def test_only_one_server_per_repository(self):
+        thread = self.start_server()
+        with unittest.mock.patch.object(check_chameleon.daemon, "Server") as server:
+            self.assertEqual(0, check_chameleon.daemon.serve(self.directory))
+        server.assert_not_called()
+        thread.join(10)
+
+    def test_serve_replaces_stale_socket(self):
+        path = check_chameleon.daemon.socket_path(self.directory)
+        with open(path, "w"):
+            pass
+        with unittest.mock.patch.object(check_chameleon.daemon, "Server") as server:
+            self.assertEqual(0, check_chameleon.daemon.serve(self.directory, 7))
+        self.assertFalse(os.path.exists(path))
+        server.assert_called_once_with(path, 7)
+        server.return_value.serve_until_idle.assert_called_once_with()
+        self.assertIsNotNone(check_chameleon.cache._memory)
+
+    def test_client_without_server_checks_in_process(self):
+        cwd = os.getcwd()
+        self.assertEqual(self.directory, cwd)
+        with unittest.mock.patch("subprocess.Popen") as popen:
+            with OutputCapture() as output:
+                with unittest.mock.patch("sys.argv", ["client", self.filename]):
+                    self.assertEqual(1, check_chameleon.daemon.client_main())
+        self.assertEqual(cwd, os.getcwd())
+        self.assertTrue(output.captured.startswith(f"{self.filename}:3 "))
+        self.assertEqual(
+            [unittest.mock.ANY, "-m", "check_chameleon.daemon"],
+            popen.call_args.args[0],
+        )
+        self.assertTrue(popen.call_args.kwargs["start_new_session"])
+
+    def test_main_daemon_option(self):
+        with unittest.mock.patch.object(
+            check_chameleon.daemon, "serve", return_value=0
+        ) as serve:
+            self.assertEqual(
+                0,
+                check_chameleon.check_chameleon.main(["--daemon", "--idle-timeout=3"]),
+            )
+        serve.assert_called_once_with(os.getcwd(), 3.0)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_least_recently_used_entries_are_dropped(self):
+        with unittest.mock.patch.object(check_chameleon.cache, "_memory", None):
+            check_chameleon.cache.keep_in_memory(max_entries=2)
+            check_chameleon.cache._remember("a", 1)
+            check_chameleon.cache._remember("b", 2)
+            self.assertEqual(1, check_chameleon.cache._recall("a"))
+            check_chameleon.cache._remember("c", 3)
+            self.assertIsNone(check_chameleon.cache._recall("b"))
+            self.assertEqual(1, check_chameleon.cache._recall("a"))
+            self.assertEqual(3, check_chameleon.cache._recall("c"))
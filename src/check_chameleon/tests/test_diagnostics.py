@@ -0,0 +1,302 @@
+import io
+import json
+import os
+import os.path
+import pickle
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+import check_chameleon.diagnostics
+from check_chameleon.checks import missing_alt, missing_href
+from check_chameleon.diagnostics import (
+    SYNTAX_ERROR,
+    Diagnostic,
+    NdjsonFormatter,
+    SarifFormatter,
+    ShortFormatter,
+    TextFormatter,
+)
+
+INVALID = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <a>Link</a>
+    <img src="image.png"/>
+  </body>
+</html>
+"""
+
+SYNTAX = """\
+<html>
+  <p></b>
+</html>
+"""
+
+
+undocumented = check_chameleon.check_chameleon.check("XX001", "p")(
+    lambda context, node: None
+)
+
+
+DIAGNOSTICS = [
+    Diagnostic("page.cpt", 3, None, "CC001", "No href."),
+    Diagnostic("broken page.cpt", 2, 10, SYNTAX_ERROR, "Mismatch, line 2."),
+]
+
+
+class TestDiagnostic(unittest.TestCase):
+    def test_messages_are_shared(self):
+        text = "".join(["Shared ", "message."])
+        first = Diagnostic("a.cpt", 1, None, "CC001", text)
+        second = Diagnostic("b.cpt", 2, None, "CC001", "".join(["Shared ", "message."]))
+        unpickled = pickle.loads(pickle.dumps(second))
+        self.assertIs(first.message, second.message)
+        self.assertIs(first.message, unpickled.message)
+        self.assertEqual(second, unpickled)
+
+    def test_catalog_is_bounded(self):
+        with (
+            unittest.mock.patch.object(check_chameleon.diagnostics, "_messages", {}),
+            unittest.mock.patch.object(check_chameleon.diagnostics, "MAX_MESSAGES", 1),
+        ):
+            Diagnostic("a.cpt", 1, None, "CC001", "First.")
+            Diagnostic("a.cpt", 1, None, "CC001", "Second.")
+            self.assertEqual(
+                {"First.": "First."}, check_chameleon.diagnostics._messages
+            )
+
+    def test_compare(self):
+        diagnostic = Diagnostic("a.cpt", 1, None, "CC001", "Message.")
+        self.assertEqual(diagnostic, Diagnostic("a.cpt", 1, None, "CC001", "Message."))
+        self.assertNotEqual(
+            diagnostic, Diagnostic("a.cpt", 2, None, "CC001", "Message.")
+        )
+        self.assertNotEqual(diagnostic, diagnostic.fields())
+        self.assertEqual(1, len({diagnostic, pickle.loads(pickle.dumps(diagnostic))}))
+        self.assertEqual("<Diagnostic CC001 a.cpt:1>", repr(diagnostic))
+        self.assertFalse(hasattr(diagnostic, "__dict__"))
+
+
+class TestFormatters(unittest.TestCase):
+    def test_text(self):
+        stream = io.StringIO()
+        formatter = TextFormatter(stream)
+        formatter.write(DIAGNOSTICS)
+        formatter.close()
+        self.assertEqual(
+            "page.cpt:3 No href.\nbroken page.cpt: Mismatch, line 2.\n",
+            stream.getvalue(),
+        )
+
+    def test_short(self):
+        stream = io.StringIO()
+        formatter = ShortFormatter(stream)
+        formatter.write(
+            [
+                Diagnostic("a.cpt", 3, None, "CC002", "No alt. Add one."),
+                Diagnostic("a.cpt", 4, None, "CC001", "No href. Add one"),
+                Diagnostic("a.cpt", 5, None, "CC001", "Only a fragment."),
+            ]
+        )
+        formatter.write(DIAGNOSTICS)
+        formatter.close()
+        self.assertEqual(
+            [
+                "a.cpt:3 CC002 No alt.",
+                "a.cpt:4 CC001 No href.",
+                "a.cpt:5 CC001 Only a fragment.",
+                "page.cpt:3 CC001 No href.",
+                "broken page.cpt: Mismatch, line 2.",
+                "",
+                "CC001 No href. Add one",
+                "CC001 Only a fragment.",
+                "CC001 No href.",
+                "CC002 No alt. Add one.",
+            ],
+            stream.getvalue().splitlines(),
+        )
+
+    def test_short_without_diagnostics(self):
+        stream = io.StringIO()
+        formatter = ShortFormatter(stream)
+        formatter.write([])
+        formatter.close()
+        self.assertEqual("", stream.getvalue())
+
+    def test_ndjson(self):
+        stream = io.StringIO()
+        formatter = NdjsonFormatter(stream)
+        formatter.write(DIAGNOSTICS)
+        formatter.close()
+        self.assertEqual(
+            [
+                {
+                    "file": "page.cpt",
+                    "line": 3,
+                    "column": None,
+                    "code": "CC001",
+                    "message": "No href.",
+                },
+                {
+                    "file": "broken page.cpt",
+                    "line": 2,
+                    "column": 10,
+                    "code": SYNTAX_ERROR,
+                    "message": "Mismatch, line 2.",
+                },
+            ],
+            [json.loads(line) for line in stream.getvalue().splitlines()],
+        )
+
+    def test_sarif(self):
+        stream = io.StringIO()
+        formatter = SarifFormatter(stream, [missing_href, missing_alt, undocumented])
+        formatter.write(DIAGNOSTICS[:1])
+        formatter.write([])
+        formatter.write(DIAGNOSTICS[1:])
+        formatter.close()
+        log = json.loads(stream.getvalue())
+        self.assertEqual("2.1.0", log["version"])
+        (run,) = log["runs"]
+        self.assertEqual(
+            [
+                (SYNTAX_ERROR, "syntax_error"),
+                ("CC001", "missing_href"),
+                ("CC002", "missing_alt"),
+                ("XX001", "<lambda>"),
+            ],
+            [(rule["id"], rule["name"]) for rule in run["tool"]["driver"]["rules"]],
+        )
+        self.assertEqual(
+            {"text": "Images need an alt attribute, empty for decorative images."},
+            run["tool"]["driver"]["rules"][2]["shortDescription"],
+        )
+        self.assertNotIn("shortDescription", run["tool"]["driver"]["rules"][3])
+        self.assertEqual(
+            [
+                {
+                    "ruleId": "CC001",
+                    "level": "error",
+                    "message": {"text": "No href."},
+                    "locations": [
+                        {
+                            "physicalLocation": {
+                                "artifactLocation": {"uri": "page.cpt"},
+                                "region": {"startLine": 3},
+                            }
+                        }
+                    ],
+                },
+                {
+                    "ruleId": SYNTAX_ERROR,
+                    "level": "error",
+                    "message": {"text": "Mismatch, line 2."},
+                    "locations": [
+                        {
+                            "physicalLocation": {
+                                "artifactLocation": {"uri": "broken%20page.cpt"},
+                                "region": {"startLine": 2, "startColumn": 10},
+                            }
+                        }
+                    ],
+                },
+            ],
+            run["results"],
+        )
+
+    def test_sarif_without_results(self):
+        stream = io.StringIO()
+        SarifFormatter(stream).close()
+        self.assertEqual([], json.loads(stream.getvalue())["runs"][0]["results"])
+
+
+class TestFormatOption(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def given_a_file_in_test_dir(self, filename: str, content: str) -> str:
+        filename = os.path.join(self.directory, filename)
+        with open(filename, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        return filename
+
+    def run_main(self, *args: str) -> tuple[int, str]:
+        with OutputCapture() as output:
+            result = check_chameleon.check_chameleon.main(["--no-cache", *args])
+        return result, output.captured
+
+    def test_ndjson_fields(self):
+        invalid = self.given_a_file_in_test_dir("invalid.cpt", INVALID)
+        syntax = self.given_a_file_in_test_dir("syntax.cpt", SYNTAX)
+        result, output = self.run_main("--format=ndjson", invalid, syntax)
+        self.assertEqual(1, result)
+        self.assertEqual(
+            [
+                (invalid, 3, None, "CC001"),
+                (invalid, 4, None, "CC002"),
+                (syntax, 2, 10, SYNTAX_ERROR),
+            ],
+            [
+                (item["file"], item["line"], item["column"], item["code"])
+                for item in map(json.loads, output.splitlines())
+            ],
+        )
+
+    def test_short_output(self):
+        first = self.given_a_file_in_test_dir("first.cpt", INVALID)
+        second = self.given_a_file_in_test_dir("second.cpt", INVALID)
+        result, output = self.run_main("--format=short", first, second)
+        self.assertEqual(1, result)
+        lines = output.splitlines()
+        self.assertEqual(
+            f"{first}:3 CC001 The <a> element is missing the href attribute.",
+            lines[0],
+        )
+        self.assertEqual(["CC001", "CC002"], [line[:5] for line in lines[5:]])
+
+    def test_sarif_output(self):
+        invalid = self.given_a_file_in_test_dir("invalid.cpt", INVALID)
+        result, output = self.run_main("--format=sarif", "--select=CC002", invalid)
+        self.assertEqual(1, result)
+        (run,) = json.loads(output)["runs"]
+        self.assertEqual(
+            [SYNTAX_ERROR, "CC002"],
+            [rule["id"] for rule in run["tool"]["driver"]["rules"]],
+        )
+        self.assertEqual(["CC002"], [result["ruleId"] for result in run["results"]])
+
+    def test_sarif_output_without_errors(self):
+        valid = self.given_a_file_in_test_dir("valid.cpt", "<p>Text</p>")
+        result, output = self.run_main("--format=sarif", valid)
+        self.assertEqual(0, result)
+        self.assertEqual([], json.loads(output)["runs"][0]["results"])
+
+    def test_codes_when_profiling(self):
+        invalid = self.given_a_file_in_test_dir("invalid.cpt", INVALID)
+        context = check_chameleon.check_chameleon.Context(invalid, profile=True)
+        context.run()
+        self.assertEqual(
+            ["CC001", "CC002"],
+            [diagnostic.code for diagnostic in context.diagnostics],
+        )
+
+    def test_output_is_written_per_file(self):
+        first = self.given_a_file_in_test_dir("first.cpt", INVALID)
+        second = self.given_a_file_in_test_dir("second.cpt", INVALID)
+        written = []
+        with unittest.mock.patch.object(
+            TextFormatter,
+            "write",
+            lambda self, diagnostics: written.append(diagnostics),
+        ):
+            self.run_main("--jobs=1", first, second)
+        self.assertEqual(
+            [[first] * 2, [second] * 2],
+            [[diagnostic.filename for diagnostic in batch] for batch in written],
+        )
@@ -0,0 +1,175 @@
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+from check_chameleon.diff import LineRanges, parse_diff
+
+DIFF = """\
+diff --git a/templates/page.cpt b/templates/page.cpt
+index 1111111..2222222 100644
+--- a/templates/page.cpt
++++ b/templates/page.cpt
+@@ -3 +3 @@
+-    <a>Old</a>
++    <a>New</a>
+@@ -10,2 +10,0 @@
+-    <p>Removed</p>
+-    <p>Removed</p>
+@@ -20,0 +19,3 @@
++    <p>Added</p>
++    <p>Added</p>
++    <p>Added</p>
+diff --git a/old.cpt b/old.cpt
+deleted file mode 100644
+--- a/old.cpt
++++ /dev/null
+@@ -1 +0,0 @@
+-<p/>
+diff --git "a/sp\\303\\251cial name.cpt" "b/sp\\303\\251cial name.cpt"
+--- "a/sp\\303\\251cial name.cpt"
++++ "b/sp\\303\\251cial name.cpt"
+@@ -1 +1,2 @@
+-<p/>
++<p>
++</p>
+diff --git a/only-removed.cpt b/only-removed.cpt
+--- a/only-removed.cpt
++++ b/only-removed.cpt
+@@ -4 +3,0 @@
+-<p/>
+"""
+
+TEMPLATE = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <a>Old link</a>
+    <p>Text</p>
+    <img src="old.png"/>
+  </body>
+</html>
+"""
+
+
+class TestLineRanges(unittest.TestCase):
+    def test_lookup(self):
+        ranges = LineRanges([(10, 12), (1, 1), (5, 6)])
+        self.assertEqual(
+            [1, 5, 6, 10, 11, 12],
+            [line for line in range(15) if line in ranges],
+        )
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        ranges = LineRanges([(1, 3), (4, 5), (2, 2), (8, 9)])
+        self.assertEqual("<LineRanges 1-5, 8-9>", repr(ranges))
+
+
+class TestParseDiff(unittest.TestCase):
+    def test_changed_lines_per_file(self):
+        changed = parse_diff(DIFF, "/repo")
+        self.assertEqual(
+            {
+                "/repo/templates/page.cpt",
+                "/repo/spécial name.cpt",
+                "/repo/only-removed.cpt",
+            },
+            set(changed),
+        )
+        page = changed["/repo/templates/page.cpt"]
+        self.assertEqual([3, 10, 19, 20, 21], [n for n in range(30) if n in page])
+        special = changed["/repo/spécial name.cpt"]
+        self.assertEqual([1, 2], [n for n in range(30) if n in special])
+        removed = changed["/repo/only-removed.cpt"]
+        self.assertEqual([3], [n for n in range(30) if n in removed])
+
+    def test_removal_at_the_start(self):
+        changed = parse_diff(
+            "--- a/page.cpt\n+++ b/page.cpt\n@@ -1 +0,0 @@\n-<p/>\n", "/repo"
+        )
+        self.assertEqual([1], [n for n in range(5) if n in changed["/repo/page.cpt"]])
+
+
+class TestDiffMode(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        self.git("init", "-q")
+        self.git("config", "user.email", "test@example.com")
+        self.git("config", "user.name", "Test")
+
+    def git(self, *args: str) -> None:
+        subprocess.run(["git", *args], check=True, capture_output=True)
+
+    def write(self, filename: str, content: str) -> None:
+        with open(filename, "w") as stream:
+            stream.write(content)
+
+    def run_main(self, *args: str) -> tuple[int, list[str]]:
+        with OutputCapture() as output:
+            result = check_chameleon.check_chameleon.main(["--no-cache", *args])
+        return result, output.captured.splitlines()
+
+    def test_only_changed_lines_are_reported(self):
+        self.write("page.cpt", TEMPLATE)
+        self.write("other.cpt", "gibberish")
+        self.git("add", ".")
+        self.git("commit", "-qm", "initial")
+        self.write("page.cpt", TEMPLATE.replace("old.png", "new.png"))
+        self.git("add", "page.cpt")
+        result, output = self.run_main("--diff", "page.cpt", "other.cpt")
+        self.assertEqual(1, result)
+        self.assertEqual(["page.cpt:5"], [line.split(" ")[0] for line in output])
+        self.assertEqual(2, len(self.run_main("page.cpt", "other.cpt")[1]) - 1)
+
+    def test_templates_in_other_encodings(self):
+        latin_1 = '<?xml version="1.0" encoding="iso-8859-1"?>\n' + TEMPLATE
+        with open("page.cpt", "wb") as stream:
+            stream.write(latin_1.encode("latin-1"))
+        self.git("add", ".")
+        self.git("commit", "-qm", "initial")
+        with open("page.cpt", "wb") as stream:
+            stream.write(latin_1.replace("old.png", "café.png").encode("latin-1"))
+        self.git("add", "page.cpt")
+        result, output = self.run_main("--diff", "page.cpt")
+        self.assertEqual(1, result)
+        self.assertEqual(["page.cpt:6"], [line.split(" ")[0] for line in output])
+
+    def test_unchanged_files_are_skipped(self):
+        self.write("other.cpt", "gibberish")
+        self.git("add", ".")
+        self.git("commit", "-qm", "initial")
+        self.assertEqual((0, []), self.run_main("--diff", "other.cpt"))
+
+    def test_syntax_errors_in_changed_files_are_reported(self):
+        self.write("page.cpt", TEMPLATE)
+        self.git("add", ".")
+        self.git("commit", "-qm", "initial")
+        self.write("page.cpt", TEMPLATE.replace("<p>Text</p>", "<p>Text"))
+        self.git("commit", "-qam", "broken")
+        result, output = self.run_main("--diff-range", "HEAD~1..HEAD", "page.cpt")
+        self.assertEqual(1, result)
+        self.assertEqual(["page.cpt:"], [line.split(" ")[0] for line in output])
+
+    def test_files_with_only_removed_lines_are_checked(self):
+        self.write("page.cpt", TEMPLATE)
+        self.git("add", ".")
+        self.git("commit", "-qm", "initial")
+        self.write("page.cpt", TEMPLATE.replace("  </body>\n", ""))
+        self.git("add", "page.cpt")
+        result, output = self.run_main("--diff", "page.cpt")
+        self.assertEqual(1, result)
+        self.assertEqual(["page.cpt:"], [line.split(" ")[0] for line in output])
+
+    def test_outside_of_a_git_repository(self):
+        shutil.rmtree(".git")
+        with OutputCapture(separate=True) as output:
+            with self.assertRaises(SystemExit):
+                check_chameleon.check_chameleon.main(["--diff", "page.cpt"])
+        self.assertIn("cannot read the git diff", output.stderr.getvalue())
@@ -0,0 +1,180 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+from check_chameleon.discover import GitIgnore, find_templates, is_ignored
+
+IMG_MISSING_ALT = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <img src="image.png"/>
+  </body>
+</html>
+"""
+
+
+class TestGitIgnore(unittest.TestCase):
+    def assertIgnored(self, lines, path, is_directory=False, expected=True):
+        ignore = GitIgnore("/repo", lines)
+        self.assertEqual(
+            expected, is_ignored([ignore], f"/repo/{path}", is_directory), path
+        )
+
+    def test_name_matches_at_any_depth(self):
+        self.assertIgnored(["*.pyc"], "a/b/c.pyc")
+        self.assertIgnored(["build"], "a/build", is_directory=True)
+        self.assertIgnored(["?.cpt"], "a/x.cpt")
+        self.assertIgnored(["?.cpt"], "a/xy.cpt", expected=False)
+
+    def test_slash_anchors_to_directory(self):
+        self.assertIgnored(["/build"], "build")
+        self.assertIgnored(["/build"], "a/build", expected=False)
+        self.assertIgnored(["a/*.cpt"], "a/x.cpt")
+        self.assertIgnored(["a/*.cpt"], "b/a/x.cpt", expected=False)
+        self.assertIgnored(["a/*.cpt"], "a/b/x.cpt", expected=False)
+
+    def test_double_star(self):
+        self.assertIgnored(["**/generated"], "a/b/generated")
+        self.assertIgnored(["a/**/x.cpt"], "a/x.cpt")
+        self.assertIgnored(["a/**/x.cpt"], "a/b/c/x.cpt")
+        self.assertIgnored(["a/**"], "a/b/x.cpt")
+
+    def test_directory_only(self):
+        self.assertIgnored(["cache/"], "cache", is_directory=True)
+        self.assertIgnored(["cache/"], "cache", expected=False)
+
+    def test_last_match_wins(self):
+        lines = ["*.cpt", "!keep.cpt"]
+        self.assertIgnored(lines, "drop.cpt")
+        self.assertIgnored(lines, "keep.cpt", expected=False)
+        self.assertIgnored([*lines, "keep*"], "keep.cpt")
+
+    def test_character_classes_and_escapes(self):
+        self.assertIgnored(["[ab].cpt"], "a.cpt")
+        self.assertIgnored(["[!ab].cpt"], "a.cpt", expected=False)
+        self.assertIgnored(["[!ab].cpt"], "c.cpt")
+        self.assertIgnored(["\\#x.cpt"], "#x.cpt")
+        self.assertIgnored(["\\!x.cpt"], "!x.cpt")
+        self.assertIgnored(["[.cpt"], "[.cpt")
+
+    def test_comments_blank_lines_and_trailing_spaces(self):
+        ignore = GitIgnore("/repo", ["# comment\n", "\n", "x.cpt  \n", "/\n"])
+        self.assertEqual(1, len(ignore.rules))
+        self.assertIgnored(["y.cpt\\ "], "y.cpt ")
+
+
+class TestFindTemplates(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.previous = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, self.previous)
+
+    def given_files(self, *paths: str, content: str = "<p/>") -> None:
+        for path in paths:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as stream:
+                stream.write(content)
+
+    def test_walks_directories_in_order(self):
+        self.given_files("t/b.cpt", "t/a/z.cpt", "t/a/notes.txt", "t/c.pt")
+        self.assertEqual(
+            ["t/a/z.cpt", "t/b.cpt"], list(find_templates(["t"], include=["*.cpt"]))
+        )
+        self.assertEqual(
+            ["t/a/z.cpt", "t/b.cpt", "t/c.pt"],
+            list(find_templates(["t"], include=["*.cpt", "*.pt"])),
+        )
+
+    def test_files_are_passed_through(self):
+        self.given_files("notes.txt")
+        self.assertEqual(["notes.txt"], list(find_templates(["notes.txt"])))
+
+    def test_exclude(self):
+        self.given_files("t/a.cpt", "t/skins/b.cpt", "t/old/c.cpt", "d.cpt")
+        self.assertEqual(
+            ["t/a.cpt"],
+            list(find_templates(["t", "d.cpt"], exclude=["skins", "*/old", "d.*"])),
+        )
+
+    def test_overlapping_inputs_are_deduplicated(self):
+        self.given_files("t/a.cpt", "t/sub/b.cpt")
+        self.assertEqual(
+            ["t/sub/b.cpt", "t/a.cpt"],
+            list(find_templates(["t/sub", "t", "t/sub/b.cpt", "./t"])),
+        )
+
+    def test_gitignore(self):
+        os.mkdir(".git")
+        self.given_files(
+            "t/a.cpt",
+            "t/build/b.cpt",
+            "t/sub/c.cpt",
+            "t/sub/keep.cpt",
+            "t/sub/.git/d.cpt",
+        )
+        self.given_files(".gitignore", content="build/\n*.cpt\n!/t/a.cpt\n")
+        self.given_files("t/sub/.gitignore", content="!keep.cpt\n")
+        self.assertEqual(["t/a.cpt", "t/sub/keep.cpt"], list(find_templates(["t"])))
+        # Files named explicitly are always checked.
+        self.assertEqual(["t/sub/c.cpt"], list(find_templates(["t/sub/c.cpt"])))
+
+    def test_gitignore_outside_a_repository_is_not_used(self):
+        self.given_files("t/a.cpt")
+        self.given_files("t/.gitignore", content="*.cpt\n")
+        self.assertEqual(["t/a.cpt"], list(find_templates(["t"])))
+
+    def test_unreadable_gitignore(self):
+        os.mkdir(".git")
+        self.given_files("t/a.cpt")
+        with open("t/.gitignore", "wb") as stream:
+            stream.write(b"\xff\n")
+        self.assertEqual(["t/a.cpt"], list(find_templates(["t"])))
+
+    def test_unreadable_directory_is_skipped(self):
+        self.given_files("t/a.cpt", "t/locked/b.cpt")
+        scandir = os.scandir
+
+        def locked_scandir(path):
+            if path.endswith("locked"):
+                raise PermissionError(path)
+            return scandir(path)
+
+        with unittest.mock.patch("os.scandir", locked_scandir):
+            self.assertEqual(["t/a.cpt"], list(find_templates(["t"])))
+
+    def test_main_checks_directories(self):
+        self.given_files("t/a.cpt", "t/b.pt", content=IMG_MISSING_ALT)
+        with OutputCapture() as output:
+            self.assertEqual(
+                1, check_chameleon.check_chameleon.main(["--no-cache", "t"])
+            )
+        self.assertEqual(
+            ["t/a.cpt"], [line.split(":")[0] for line in output.captured.splitlines()]
+        )
+        with OutputCapture() as output:
+            check_chameleon.check_chameleon.main(
+                ["--no-cache", "--include=*.cpt,*.pt", "--exclude=a.*", "t"]
+            )
+        self.assertEqual(
+            ["t/b.pt"], [line.split(":")[0] for line in output.captured.splitlines()]
+        )
+
+    def test_main_reads_globs_from_pyproject(self):
+        self.given_files("t/a.cpt", "t/b.pt", content=IMG_MISSING_ALT)
+        self.given_files(
+            "pyproject.toml",
+            content='[tool.check-chameleon]\ninclude = ["*.pt"]\nexclude = ["x*"]\n',
+        )
+        with OutputCapture() as output:
+            check_chameleon.check_chameleon.main(["--no-cache", "t"])
+        self.assertEqual(
+            ["t/b.pt"], [line.split(":")[0] for line in output.captured.splitlines()]
+        )
@@ -0,0 +1,331 @@
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import check_chameleon.check_chameleon
+import check_chameleon.lsp
+from check_chameleon.lsp import Server, read_message, uri_to_path, write_message
+
+IMG_MISSING_ALT = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <img src="image.png"/>
+  </body>
+</html>
+"""
+
+VALID = IMG_MISSING_ALT.replace("/>", ' alt=""/>')
+
+URI = "file:///project/page%20one.cpt"
+
+
+def framed(*messages: dict) -> io.BytesIO:
+    stream = io.BytesIO()
+    for message in messages:
+        write_message(stream, message)
+    stream.seek(0)
+    return stream
+
+
+def sent(output: io.BytesIO) -> list[dict]:
+    output.seek(0)
+    messages = []
+    while (message := read_message(output)) is not None:
+        messages.append(message)
+    output.seek(0)
+    output.truncate()
+    return messages
+
+
+def did_open(text: str, uri: str = URI) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "method": "textDocument/didOpen",
+        "params": {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "xml",
+                "version": 1,
+                "text": text,
+            }
+        },
+    }
+
+
+def did_change(text: str, uri: str = URI) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "method": "textDocument/didChange",
+        "params": {
+            "textDocument": {"uri": uri, "version": 2},
+            "contentChanges": [{"text": text}],
+        },
+    }
+
+
+def notification(method: str, uri: str = URI) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "method": method,
+        "params": {"textDocument": {"uri": uri}},
+    }
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.output = io.BytesIO()
+        self.server = Server(self.output, debounce=0)
+
+    def published(self) -> list[list[tuple[int, int, int, str]]]:
+        result = []
+        for message in sent(self.output):
+            self.assertEqual("textDocument/publishDiagnostics", message["method"])
+            result.append(
+                [
+                    (
+                        diagnostic["range"]["start"]["line"],
+                        diagnostic["range"]["start"]["character"],
+                        diagnostic["range"]["end"]["character"],
+                        diagnostic["code"],
+                    )
+                    for diagnostic in message["params"]["diagnostics"]
+                ]
+            )
+        return result
+
+    def test_buffers_are_checked(self):
+        self.server.handle(did_open(IMG_MISSING_ALT))
+        # Lines count from 0, without the DOCTYPE added in front.
+        self.assertEqual([[(2, 0, 26, "CC002")]], self.published())
+        self.server.handle(did_change(VALID))
+        # Debounced, the change is checked once it is due.
+        self.assertEqual([], self.published())
+        self.assertIsNone(self.server.check_due())
+        self.assertEqual([[]], self.published())
+        # Nothing is published while the diagnostics stay the same.
+        self.server.handle(did_change(VALID + "\n"))
+        self.server.handle(notification("textDocument/didSave"))
+        self.server.handle(notification("textDocument/didSave"))
+        self.assertEqual([], self.published())
+        self.server.handle(did_change("<p>\n</b>"))
+        self.server.check_due()
+        self.assertEqual([[(1, 4, 4, "CC000")]], self.published())
+        self.server.handle(notification("textDocument/didClose"))
+        self.assertEqual([[]], self.published())
+        self.assertEqual({}, self.server.documents)
+
+    def test_edits_are_debounced(self):
+        self.server.debounce = 60
+        self.server.handle(did_open(VALID))
+        sent(self.output)
+        self.server.handle(did_change(IMG_MISSING_ALT))
+        self.server.handle(did_open(VALID, "file:///other.cpt"))
+        self.server.handle(did_change(IMG_MISSING_ALT, "file:///other.cpt"))
+        self.server.documents["file:///other.cpt"].due += 10
+        sent(self.output)
+        self.assertGreater(self.server.check_due(), 50)
+        self.assertEqual([], self.published())
+
+    def test_unchanged_text_is_not_checked_again(self):
+        self.server.handle(did_open(IMG_MISSING_ALT))
+        document = self.server.documents[URI]
+        self.assertEqual("/project/page one.cpt", document.path)
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon.Context, "run"
+        ) as run:
+            self.server.handle(did_change(IMG_MISSING_ALT))
+            self.server.check_due()
+        run.assert_not_called()
+
+    def test_tal_attributes_are_parsed_once_per_document(self):
+        text = IMG_MISSING_ALT.replace(
+            "<img",
+            '<img xmlns:tal="http://xml.zope.org/namespaces/tal"'
+            ' tal:attributes="alt view/alt"',
+        )
+        self.server.handle(did_open(text))
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon,
+            "parse_tal_attributes",
+            side_effect=AssertionError("parsed again"),
+        ):
+            self.server.handle(did_change(text.replace("<body>", "<body>\n")))
+            self.server.check_due()
+        with unittest.mock.patch.object(check_chameleon.lsp, "MAX_TAL_ATTRIBUTES", 0):
+            self.server.handle(did_change(text))
+            self.server.check_due()
+        self.assertEqual(
+            {"view/alt"},
+            set(self.server.documents[URI].tal_attributes["alt view/alt"].values()),
+        )
+
+    def test_unknown_documents_and_methods(self):
+        self.server.handle(did_change(VALID))
+        self.server.handle(notification("textDocument/didSave"))
+        self.server.handle(notification("textDocument/didClose"))
+        self.server.handle({"jsonrpc": "2.0", "method": "$/cancelRequest"})
+        self.server.handle({"jsonrpc": "2.0", "id": 3, "method": "textDocument/hover"})
+        self.server.handle({"jsonrpc": "2.0", "id": 4, "result": None})
+        (error,) = sent(self.output)
+        self.assertEqual(3, error["id"])
+        self.assertEqual(-32601, error["error"]["code"])
+
+    def test_empty_change_is_ignored(self):
+        self.server.handle(did_open(VALID))
+        message = did_change(VALID)
+        message["params"]["contentChanges"] = []
+        self.server.handle(message)
+        self.assertIsNone(self.server.documents[URI].due)
+
+
+class TestProtocol(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_session(self):
+        with open(os.path.join(self.directory, "pyproject.toml"), "w") as stream:
+            stream.write('[tool.check-chameleon]\nselect = ["CC001"]\n')
+        output = io.BytesIO()
+        code = Server(output, debounce=0).serve(
+            framed(
+                {
+                    "jsonrpc": "2.0",
+                    "id": 1,
+                    "method": "initialize",
+                    "params": {
+                        "rootUri": f"file://{self.directory}",
+                        "initializationOptions": {"a11y_lint_exclude": "/excluded"},
+                    },
+                },
+                {"jsonrpc": "2.0", "method": "initialized", "params": {}},
+                did_open(VALID),
+                did_change(IMG_MISSING_ALT.replace("<img", "<a>Link</a><img")),
+                {"jsonrpc": "2.0", "id": 2, "method": "shutdown"},
+                {"jsonrpc": "2.0", "method": "exit"},
+            )
+        )
+        self.assertEqual(0, code)
+        initialized, *rest = sent(output)
+        self.assertEqual(
+            {"openClose": True, "change": 1},
+            initialized["result"]["capabilities"]["textDocumentSync"],
+        )
+        self.assertEqual(
+            [[], ["CC001"], None],
+            [
+                [d["code"] for d in m["params"]["diagnostics"]]
+                if "params" in m
+                else m["result"]
+                for m in rest
+            ],
+        )
+
+    def test_changes_are_checked_while_waiting(self):
+        read_end, write_end = os.pipe()
+        output = io.BytesIO()
+        server = Server(output, debounce=0.01)
+        with open(read_end, "rb") as input, open(write_end, "wb") as stream:
+            write_message(stream, did_open(VALID))
+            write_message(stream, did_change(IMG_MISSING_ALT))
+            thread = threading.Thread(target=server.serve, args=(input,))
+            thread.start()
+            # The change is checked without waiting for another message.
+            while output.getvalue().count(b"Content-Length") < 2:
+                time.sleep(0.01)
+            write_message(stream, {"jsonrpc": "2.0", "method": "exit"})
+            thread.join()
+        self.assertEqual(
+            [[], ["CC002"]],
+            [[d["code"] for d in m["params"]["diagnostics"]] for m in sent(output)],
+        )
+
+    def test_relative_a11y_lint_exclude_is_one_of_the_workspace(self):
+        output = io.BytesIO()
+        server = Server(output, debounce=0)
+        server.handle(
+            {
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "initialize",
+                "params": {
+                    "rootUri": f"file://{self.directory}",
+                    "initializationOptions": {"a11y_lint_exclude": "src/excluded/"},
+                },
+            }
+        )
+        for path in ("src/excluded/page.cpt", "src/page.cpt"):
+            server.handle(did_open(IMG_MISSING_ALT, f"file://{self.directory}/{path}"))
+        (_, excluded, checked) = sent(output)
+        self.assertEqual(
+            [[], ["CC002"]],
+            [
+                [d["code"] for d in m["params"]["diagnostics"]]
+                for m in (excluded, checked)
+            ],
+        )
+
+    def test_rules(self):
+        with open(os.path.join(self.directory, "pyproject.toml"), "w") as stream:
+            stream.write('[tool.check-chameleon]\nrules = ["rules.toml"]\n')
+        initialize = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "initialize",
+            "params": {"rootUri": f"file://{self.directory}"},
+        }
+        output = io.BytesIO()
+        server = Server(output, debounce=0)
+        server.handle(initialize)
+        (message, _) = sent(output)
+        self.assertEqual("window/showMessage", message["method"])
+        self.assertIn("cannot load rules", message["params"]["message"])
+        self.assertEqual(
+            "CC001", server.checks[0].code, "The other checks are still loaded."
+        )
+        with open(os.path.join(self.directory, "rules.toml"), "w") as stream:
+            stream.write(
+                '[[rules]]\ncode = "XX001"\ntags = ["img"]\nmessage = "Image."\n'
+            )
+        server.handle(initialize)
+        server.handle(did_open(IMG_MISSING_ALT))
+        (_, published) = sent(output)
+        self.assertEqual(
+            ["CC002", "XX001"],
+            [d["code"] for d in published["params"]["diagnostics"]],
+        )
+
+    def test_end_of_input_without_shutdown(self):
+        output = io.BytesIO()
+        server = Server(output)
+        self.assertEqual(
+            1, server.serve(framed({"jsonrpc": "2.0", "id": 1, "method": "initialize"}))
+        )
+
+    def test_headers(self):
+        stream = io.BytesIO(
+            b"Content-Type: application/vscode-jsonrpc\r\n"
+            b"Content-Length: 2\r\n\r\n{}"
+            b"X-Other: 1\r\n\r\n"
+        )
+        self.assertEqual({}, read_message(stream))
+        self.assertIsNone(read_message(stream))
+
+    def test_uri_to_path(self):
+        self.assertEqual("/a b/c.cpt", uri_to_path("file:///a%20b/c.cpt"))
+        self.assertEqual("untitled:1", uri_to_path("untitled:1"))
+
+    def test_main(self):
+        stdin = unittest.mock.Mock(buffer=framed({"jsonrpc": "2.0", "method": "exit"}))
+        stdout = unittest.mock.Mock(buffer=io.BytesIO())
+        with (
+            unittest.mock.patch("sys.stdin", stdin),
+            unittest.mock.patch("sys.stdout", stdout),
+        ):
+            self.assertEqual(1, check_chameleon.lsp.main())
@@ -0,0 +1,299 @@
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+import check_chameleon.macros
+from check_chameleon.macros import MacroIndex, index_path, scan
+
+LAYOUT = """\
+<html xmlns="http://www.w3.org/1999/xhtml"
+      xmlns:metal="http://xml.zope.org/namespaces/metal"
+      metal:define-macro="page">
+  <body>
+    <a href="/">Home</a>
+    <a href="/next"><span metal:define-slot="link"/></a>
+    <div metal:define-macro="box">
+      <img src="box.png" metal:define-slot="image"/>
+    </div>
+  </body>
+</html>
+"""
+
+# Fills the link of the layout with nothing.
+PAGE = """\
+<html xmlns="http://www.w3.org/1999/xhtml"
+      xmlns:metal="http://xml.zope.org/namespaces/metal"
+      metal:use-macro="context/@@layout/macros/page">
+  <span metal:fill-slot="link"></span>
+</html>
+"""
+
+GOOD_PAGE = """\
+<html xmlns="http://www.w3.org/1999/xhtml"
+      xmlns:metal="http://xml.zope.org/namespaces/metal"
+      metal:use-macro="context/@@layout/macros/page">
+  <span metal:fill-slot="link">Next</span>
+</html>
+"""
+
+MISSING_LINK_CONTENT = "In macro page of layout.cpt line 6: The <a> element requires"
+
+
+class MacrosTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.previous = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, self.previous)
+        check_chameleon.macros._parse_macros.cache_clear()
+
+    def given_file(self, path: str, content: str, age: int = 60) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def given_index(self, *filenames: str) -> MacroIndex:
+        index = MacroIndex()
+        index.update(filenames)
+        return index
+
+
+class TestScan(MacrosTestCase):
+    def test_definitions_and_uses(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("page.cpt", PAGE)
+        entry = scan("layout.cpt")
+        self.assertEqual({"page": 3, "box": 7}, entry["defines"])
+        self.assertEqual([], entry["uses"])
+        self.assertEqual(["context/@@layout/macros/page"], scan("page.cpt")["uses"])
+
+    def test_templates_without_metal_are_not_parsed(self):
+        self.given_file("plain.cpt", "<p>Text</p>")
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon.Context,
+            "parse",
+            side_effect=AssertionError("parsed"),
+        ):
+            entry = scan("plain.cpt")
+        self.assertEqual({}, entry["defines"])
+        self.assertEqual(64, len(entry["hash"]))
+
+    def test_invalid_template(self):
+        self.given_file("broken.cpt", LAYOUT.replace("</body>", ""))
+        self.assertEqual({}, scan("broken.cpt")["defines"])
+
+
+class TestMacroIndex(MacrosTestCase):
+    def test_resolve_by_name(self):
+        self.given_file("layout.cpt", LAYOUT)
+        index = self.given_index("layout.cpt")
+        layout = os.path.abspath("layout.cpt")
+        self.assertEqual((layout, "page"), index.resolve("here/macros/page", "x.cpt"))
+        self.assertEqual((layout, "box"), index.resolve("view.macros['box']", "x.cpt"))
+        self.assertIsNone(index.resolve("here/macros/other", "x.cpt"))
+        self.assertIsNone(index.resolve("python: view.layout", "x.cpt"))
+
+    def test_resolve_ambiguous_name_by_file_name(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("forms/base.cpt", LAYOUT)
+        index = self.given_index("layout.cpt", "forms/base.cpt")
+        self.assertEqual(
+            (os.path.abspath("forms/base.cpt"), "page"),
+            index.resolve("context/@@base/macros/page", "x.cpt"),
+        )
+        self.assertIsNone(index.resolve("context/macros/page", "x.cpt"))
+
+    def test_resolve_load(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("forms/base.cpt", LAYOUT)
+        index = self.given_index("layout.cpt", "forms/base.cpt")
+        self.assertEqual(
+            (os.path.abspath("layout.cpt"), "box"),
+            index.resolve("load: ../layout.cpt/macros/box", "forms/page.cpt"),
+        )
+        self.assertEqual(
+            (os.path.abspath("forms/base.cpt"), ""),
+            index.resolve("load: base.cpt", "forms/page.cpt"),
+        )
+        self.assertIsNone(index.resolve("load: base.cpt/macros/x", "forms/page.cpt"))
+        self.assertIsNone(index.resolve("load: missing.cpt", "forms/page.cpt"))
+
+    def test_dependencies_and_dependents(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("page.cpt", PAGE)
+        self.given_file(
+            "self.cpt",
+            LAYOUT.replace("<body>", '<body metal:use-macro="macros/box">').replace(
+                "box", "own"
+            ),
+        )
+        self.given_file("other.cpt", "<p>Text</p>")
+        index = self.given_index("layout.cpt", "page.cpt", "self.cpt", "other.cpt")
+        self.assertEqual(
+            [os.path.abspath("layout.cpt")], index.dependencies("page.cpt")
+        )
+        self.assertEqual([], index.dependencies("self.cpt"))
+        self.assertEqual([], index.dependencies("unknown.cpt"))
+        self.assertEqual(
+            [os.path.abspath("page.cpt")], index.dependents(["layout.cpt", "other.cpt"])
+        )
+        self.assertEqual([], index.dependents(["layout.cpt", "page.cpt"]))
+        (key,) = index.dependency_key("page.cpt")
+        self.assertEqual(
+            f"{os.path.abspath('layout.cpt')}\0{scan('layout.cpt')['hash']}", key
+        )
+
+    def test_unchanged_files_are_not_scanned_again(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("page.cpt", PAGE)
+        self.given_file("new.cpt", PAGE, age=0)
+        index = MacroIndex(os.path.join("cache", "index.json"))
+        index.update(["layout.cpt", "page.cpt", "missing.cpt"])
+        self.assertTrue(index.changed)
+        index.save()
+        self.assertFalse(index.changed)
+        index = MacroIndex.load(index.path)
+        self.assertEqual(
+            {os.path.abspath("layout.cpt"), os.path.abspath("page.cpt")},
+            index.files.keys(),
+        )
+        with unittest.mock.patch.object(
+            check_chameleon.macros, "scan", wraps=scan
+        ) as scanned:
+            index.update(["layout.cpt", "page.cpt"])
+            self.assertFalse(index.changed)
+            # Modified just now, so scanned every time.
+            index.update(["layout.cpt", "new.cpt"])
+            index.update(["layout.cpt", "new.cpt"])
+        self.assertEqual(
+            [(os.path.abspath("new.cpt"),)] * 2,
+            [c.args for c in scanned.call_args_list],
+        )
+        self.assertTrue(index.changed)
+        self.assertIsNone(index.files[os.path.abspath("new.cpt")]["stat"])
+
+    def test_unreadable_files_are_skipped(self):
+        self.given_file("layout.cpt", LAYOUT)
+        with unittest.mock.patch.object(
+            check_chameleon.macros, "scan", side_effect=PermissionError
+        ):
+            index = self.given_index("layout.cpt")
+        self.assertEqual({}, index.files)
+
+    def test_load_ignores_unusable_index(self):
+        self.given_file("index.json", "{")
+        self.assertEqual({}, MacroIndex.load("index.json").files)
+        self.given_file("index.json", json.dumps({"schema": 0, "files": {"x": 1}}))
+        self.assertEqual({}, MacroIndex.load("index.json").files)
+        self.assertEqual({}, MacroIndex.load("missing.json").files)
+        self.assertEqual({}, MacroIndex.load(None).files)
+
+    def test_save_without_path_or_to_unwritable_place(self):
+        self.given_file("layout.cpt", LAYOUT)
+        index = self.given_index("layout.cpt")
+        index.save()
+        self.assertTrue(index.changed)
+        self.given_file("blocker", "")
+        index.path = os.path.join("blocker", "index.json")
+        index.save()
+        self.assertTrue(index.changed)
+
+    def test_index_path(self):
+        path = index_path("cache", "/repo")
+        self.assertEqual(os.path.join("cache", "macros"), os.path.dirname(path))
+        self.assertNotEqual(path, index_path("cache", "/other"))
+
+    def test_assemble_missing_macro(self):
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("page.cpt", PAGE)
+        index = self.given_index("layout.cpt", "page.cpt")
+        context = check_chameleon.check_chameleon.Context("page.cpt", checks=())
+        context.parse()
+        self.assertEqual(
+            "layout.cpt", os.path.basename(index.assemble(context.node, "page.cpt")[0])
+        )
+        # The index is out of date.
+        self.given_file("layout.cpt", LAYOUT.replace('"page"', '"other"'))
+        self.assertIsNone(index.assemble(context.node, "page.cpt"))
+        self.given_file("layout.cpt", LAYOUT.replace("</body>", ""))
+        self.assertIsNone(index.assemble(context.node, "page.cpt"))
+        os.unlink("layout.cpt")
+        self.assertIsNone(index.assemble(context.node, "page.cpt"))
+
+
+class TestCheckInContext(MacrosTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.given_file("layout.cpt", LAYOUT)
+        self.given_file("page.cpt", PAGE)
+        self.given_file("good.cpt", GOOD_PAGE)
+        self.given_file("unresolved.cpt", PAGE.replace("macros/page", "macros/other"))
+        self.index = self.given_index(
+            "layout.cpt", "page.cpt", "good.cpt", "unresolved.cpt"
+        )
+
+    def check(self, filename: str, **kw) -> list[str]:
+        context = check_chameleon.check_chameleon.Context(filename, **kw)
+        return context.run()
+
+    def test_slots_are_checked_in_the_using_template(self):
+        for stream_threshold in (None, 0):
+            with self.subTest(stream_threshold=stream_threshold):
+                kw = dict(macros=self.index, stream_threshold=stream_threshold)
+                self.assertEqual(
+                    ["layout.cpt:6", "layout.cpt:8"],
+                    [error.split()[0] for error in self.check("layout.cpt")],
+                )
+                self.assertEqual([], self.check("layout.cpt", **kw))
+                (error,) = self.check("page.cpt", **kw)
+                self.assertTrue(
+                    error.startswith(f"page.cpt:3 {MISSING_LINK_CONTENT}"), error
+                )
+                self.assertEqual([], self.check("good.cpt", **kw))
+                self.assertEqual([], self.check("unresolved.cpt", **kw))
+
+    def test_main(self):
+        cache_dir = os.path.join(self.directory, "cache")
+
+        def run_main(*args):
+            with OutputCapture() as output:
+                result = check_chameleon.check_chameleon.main(
+                    ["--cache-dir", cache_dir, *args]
+                )
+            return result, output.captured.splitlines()
+
+        result, lines = run_main("--macros", "layout.cpt")
+        self.assertEqual(1, result)
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].startswith(f"page.cpt:3 {MISSING_LINK_CONTENT}"))
+        self.assertEqual(
+            ["page.cpt:3"],
+            [line.split()[0] for line in run_main("--macros", "page.cpt")[1]],
+        )
+        # A change of the macro is seen by the cached result of its user.
+        self.given_file("layout.cpt", LAYOUT.replace("<span", "Next<span"))
+        self.assertEqual((0, []), run_main("--macros", "page.cpt"))
+        self.given_file("pyproject.toml", "[tool.check-chameleon]\nmacros = true\n")
+        self.given_file("layout.cpt", LAYOUT)
+        self.assertEqual(1, run_main("layout.cpt")[0])
+        self.assertEqual(1, run_main("--no-cache", "layout.cpt")[0])
+
+    def test_index_is_sent_to_workers_once(self):
+        with unittest.mock.patch.dict(
+            check_chameleon.check_chameleon._worker_options, clear=True
+        ):
+            check_chameleon.check_chameleon._init_worker({"macros": self.index})
+            (result,) = check_chameleon.check_chameleon._check_chunk(["page.cpt"])
+        self.assertEqual(["CC003"], [d.code for d in result.diagnostics])
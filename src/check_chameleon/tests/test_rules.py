@@ -0,0 +1,287 @@
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import lxml.etree
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+import check_chameleon.rules
+from check_chameleon.rules import Rule, compile_rule
+
+PAGE = """\
+<html
+  xmlns="http://www.w3.org/1999/xhtml"
+  xmlns:tal="http://xml.zope.org/namespaces/tal">
+  <body>
+    <a href="one.html" target="_blank">One</a>
+    <a href="two.html" target="_blank" aria-label="Two (new window)">Two</a>
+    <a href="three.html" tal:attributes="target view/target">Three</a>
+    <a href="four.html" target=" ">Four</a>
+    <img src="image.png" alt=""/>
+    <button type="button"><img src="icon.png" alt=""/></button>
+    <div role="  "><p>Text</p></div>
+  </body>
+</html>
+"""
+
+RULES_YAML = """\
+rules:
+  - code: XX001
+    tags: [a]
+    attributes: {target: _blank, aria-label: false}
+    message: Links opening a new window need to say so.
+  - code: XX002
+    tags: button
+    without: [text]
+    message: Buttons need text.
+    name: button_text
+    description: Buttons need text, not only an icon.
+"""
+
+RULES_TOML = """\
+[[rules]]
+code = "XX003"
+tags = ["*"]
+attributes = {role = ""}
+message = "Roles need a value."
+"""
+
+
+def check(*rules: Rule, stream_threshold=None) -> list[tuple[int, str]]:
+    context = check_chameleon.check_chameleon.Context(
+        "page.cpt",
+        stream_threshold=stream_threshold,
+        checks=[compile_rule(rule) for rule in rules],
+        content=PAGE.encode("utf-8"),
+    )
+    context.run()
+    return [(diagnostic.line, diagnostic.code) for diagnostic in context.diagnostics]
+
+
+class TestRules(unittest.TestCase):
+    def test_attributes(self):
+        for expected, lines in (
+            (None, []),
+            (False, [8]),
+            (True, [5, 6, 7]),
+            (" _blank ", [5, 6]),
+            (["_blank", "view/target"], [5, 6, 7]),
+        ):
+            with self.subTest(expected=expected):
+                rule = Rule("XX001", ("a",), "Target.", {"target": expected})
+                self.assertEqual([(line, "XX001") for line in lines], check(rule))
+        rule = Rule("XX001", ("a",), "Label.", {"aria-label": None})
+        self.assertEqual([(5, "XX001"), (7, "XX001"), (8, "XX001")], check(rule))
+
+    def test_content(self):
+        rule = Rule("XX002", ("a", "button"), "No text.", without=("text",))
+        self.assertEqual([(10, "XX002")], check(rule))
+        with self.assertRaises(TypeError):
+            # The default is shared by all rules.
+            rule.attributes["role"] = True
+        rule = rule._replace(without=("text", "image"))
+        self.assertEqual([], check(rule))
+
+    def test_where(self):
+        rule = Rule("XX004", ("img",), "Icon.", where="boolean(parent::xhtml:button)")
+        self.assertEqual([(10, "XX004")], check(rule))
+
+    def test_all_elements(self):
+        rule = Rule("XX003", ("*",), "Roles need a value.", {"role": False})
+        self.assertEqual([], check(rule._replace(attributes={"role": True})))
+        rule = rule._replace(attributes={"role": ""})
+        self.assertEqual([(11, "XX003")], check(rule))
+
+    def test_streaming_reports_the_same(self):
+        rules = (
+            Rule("XX001", ("a",), "Target.", {"target": True}),
+            Rule("XX002", ("button",), "No text.", without=("text",)),
+            Rule("XX003", ("*",), "Role.", {"role": ""}),
+        )
+        self.assertEqual(check(*rules), check(*rules, stream_threshold=0))
+
+    def test_check_attributes(self):
+        check = compile_rule(Rule("XX001", ("a",), "Target."))
+        self.assertEqual("XX001", check.code)
+        self.assertEqual(("a",), check.tags)
+        self.assertFalse(check.ids)
+        self.assertEqual("rule_XX001", check.__name__)
+        self.assertEqual("Target.", check.__doc__)
+
+    def test_invalid_rules(self):
+        for rule, message in (
+            (Rule("", ("a",), "Message."), "rules need a code, tags and a message"),
+            (
+                Rule("XX001", ("*",), "Message.", without=("text",)),
+                "XX001: rules for all elements can only check attributes",
+            ),
+            (
+                Rule("XX001", ("a",), "Message.", without=("colour",)),
+                "XX001: unknown content 'colour'",
+            ),
+            (
+                Rule("XX001", ("a",), "Message.", {"href": 1}),
+                "XX001: invalid attribute value 1",
+            ),
+            (
+                Rule("XX001", ("a",), "Message.", {"href": ["a", None]}),
+                "XX001: invalid attribute value ['a', None]",
+            ),
+            (
+                Rule("XX001", ("a",), "Message.", where="//["),
+                "XX001: Invalid expression",
+            ),
+        ):
+            with self.subTest(message=message):
+                with self.assertRaises(ValueError) as raised:
+                    compile_rule(rule)
+                self.assertEqual(message, str(raised.exception))
+
+
+class TestRuleFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory)
+        with open("page.cpt", "w") as stream:
+            stream.write(PAGE)
+        self.write("rules.yaml", RULES_YAML)
+        self.write("rules.toml", RULES_TOML)
+
+    def write(self, filename: str, content: str) -> str:
+        with open(filename, "w") as stream:
+            stream.write(content)
+        return filename
+
+    def test_load(self):
+        checks = check_chameleon.rules.load(["rules.yaml", "rules.toml"])
+        self.assertEqual(["XX001", "XX002", "XX003"], [c.code for c in checks])
+        self.assertEqual("button_text", checks[1].__name__)
+        self.assertEqual("Buttons need text, not only an icon.", checks[1].__doc__)
+        # Unchanged files give the same checks.
+        self.assertEqual(
+            checks, check_chameleon.rules.load(["rules.yaml", "rules.toml"])
+        )
+        self.write("rules.toml", RULES_TOML.replace('""', '"main"'))
+        changed = check_chameleon.rules.load(["rules.yaml", "rules.toml"])
+        self.assertEqual(checks[:2], changed[:2])
+        self.assertIsNot(checks[2], changed[2])
+
+    def test_invalid_files(self):
+        for filename, content, message in (
+            ("empty.yaml", "", "expected a list of rules under `rules`"),
+            ("broken.yaml", "rules: [", "while parsing a flow node"),
+            ("broken.toml", "[[rules]", "Expected ']]'"),
+            ("entry.yaml", "rules: [XX001]", "rule 1: rules are tables, not 'XX001'"),
+            (
+                "keys.toml",
+                '[[rules]]\ncode = "XX001"\ntag = "a"\nmessage = "Message."\n',
+                "rule 1: unknown keys tag",
+            ),
+            (
+                "tags.toml",
+                '[[rules]]\ncode = "XX001"\nmessage = "Message."\n',
+                "rules need a code, tags and a message",
+            ),
+            ("duplicate.yaml", RULES_YAML, "duplicate rule XX001"),
+            (
+                "builtin.toml",
+                '[[rules]]\ncode = "CC001"\ntags = ["a"]\nmessage = "Message."\n',
+                "CC001 is already a check",
+            ),
+        ):
+            with self.subTest(filename=filename):
+                self.write(filename, content)
+                with self.assertRaises(ValueError) as raised:
+                    check_chameleon.rules.load(["rules.yaml", filename])
+                self.assertTrue(str(raised.exception).startswith(f"{filename}: "))
+                self.assertIn(message, str(raised.exception))
+
+    def test_yaml_needs_pyyaml(self):
+        with unittest.mock.patch.dict(sys.modules, {"yaml": None}):
+            with self.assertRaises(ValueError) as raised:
+                check_chameleon.rules.read("rules.yaml")
+        self.assertIn("install pre-commit-check-chameleon[yaml]", str(raised.exception))
+
+    def reported(self, *args: str) -> list[str]:
+        with OutputCapture() as output:
+            check_chameleon.check_chameleon.main([*args, "page.cpt"])
+        return [line.split(" ", 1)[0] for line in output.captured.splitlines()]
+
+    def test_main(self):
+        self.assertEqual(
+            ["page.cpt:5", "page.cpt:10", "page.cpt:11"],
+            self.reported(
+                "--no-cache",
+                "--rules",
+                "rules.yaml",
+                "--rules=rules.toml",
+                "--select=XX",
+            ),
+        )
+        with open("pyproject.toml", "w") as stream:
+            stream.write('[tool.check-chameleon]\nrules = ["rules.toml"]\n')
+        self.assertEqual(["page.cpt:11"], self.reported("--no-cache", "--select=XX"))
+
+    def test_rules_are_part_of_the_cache_key(self):
+        cache_dir = os.path.join(self.directory, "cache")
+        args = ("--cache-dir", cache_dir, "--rules=rules.toml", "--select=XX")
+        self.assertEqual(["page.cpt:11"], self.reported(*args))
+        self.write("rules.toml", RULES_TOML.replace('""', '"main"'))
+        self.assertEqual([], self.reported(*args))
+
+    def test_rules_are_loaded_once_per_run(self):
+        filenames = [self.write(f"page{number}.cpt", PAGE) for number in range(10)]
+        load = unittest.mock.Mock(wraps=check_chameleon.rules.load)
+        for jobs in ("1", "2"):
+            with self.subTest(jobs=jobs):
+                load.reset_mock()
+                with unittest.mock.patch.object(check_chameleon.rules, "load", load):
+                    with OutputCapture() as output:
+                        check_chameleon.check_chameleon.main(
+                            [
+                                "--no-cache",
+                                f"--jobs={jobs}",
+                                "--rules=rules.toml",
+                                "--select=XX",
+                                *filenames,
+                            ]
+                        )
+                self.assertEqual(10, len(output.captured.splitlines()))
+                self.assertEqual(1, load.call_count)
+
+    def test_unchanged_rules_are_not_validated_again(self):
+        available = unittest.mock.Mock(
+            wraps=check_chameleon.check_chameleon.available_checks
+        )
+        with unittest.mock.patch.object(
+            check_chameleon.check_chameleon, "available_checks", available
+        ):
+            first = check_chameleon.rules.load(["rules.yaml"])
+            self.assertIs(first, check_chameleon.rules.load(["rules.yaml"]))
+            self.write("rules.yaml", RULES_YAML.replace("XX002", "XX0020"))
+            self.assertIsNot(first, check_chameleon.rules.load(["rules.yaml"]))
+        self.assertEqual(2, available.call_count)
+
+    def test_main_with_invalid_rules(self):
+        with OutputCapture(separate=True) as output:
+            with self.assertRaises(SystemExit):
+                check_chameleon.check_chameleon.main(["--rules=missing.yaml"])
+        self.assertIn("cannot load rules:", output.stderr.getvalue())
+
+    def test_check_bytes_and_tree(self):
+        library = check_chameleon.check_chameleon
+        found = library.check_bytes(PAGE, select=("XX",), rules=("rules.toml",))
+        self.assertEqual([11], [diagnostic.line for diagnostic in found])
+        found = library.check_tree(
+            lxml.etree.fromstring(PAGE),
+            select=("XX",),
+            rules=("rules.toml",),
+        )
+        self.assertEqual([11], [diagnostic.line for diagnostic in found])
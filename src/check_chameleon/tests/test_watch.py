@@ -0,0 +1,242 @@
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from testfixtures import OutputCapture
+
+import check_chameleon.check_chameleon
+import check_chameleon.watch
+from check_chameleon.diagnostics import Diagnostic
+from check_chameleon.watch import (
+    InotifyWatcher,
+    PollingWatcher,
+    compare,
+    open_watcher,
+    run,
+)
+
+IMG_MISSING_ALT = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <img src="image.png"/>
+  </body>
+</html>
+"""
+
+VALID = """\
+<html xmlns="http://www.w3.org/1999/xhtml">
+  <body>
+    <img src="image.png" alt=""/>
+  </body>
+</html>
+"""
+
+
+class FakeWatcher:
+    """Apply a change to the files on each wait, then report its paths."""
+
+    def __init__(self, *changes):
+        self.changes = list(changes)
+        self.closed = False
+        self.later = []
+
+    def wait(self, timeout):
+        if timeout is not None:
+            # Debouncing: paths reported a bit later are part of the batch.
+            later, self.later = self.later, []
+            return {os.path.abspath(path) for path in later}
+        if not self.changes:
+            raise KeyboardInterrupt
+        change, paths, *later = self.changes.pop(0)
+        self.later = [path for paths in later for path in paths]
+        change()
+        return {os.path.abspath(path) for path in paths}
+
+    def close(self):
+        self.closed = True
+
+
+class WatchTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.previous = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, self.previous)
+
+    def given_file(self, path: str, content: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        return path
+
+    def writing(self, path: str, content: str):
+        return lambda: self.given_file(path, content)
+
+
+class TestCompare(unittest.TestCase):
+    def test_new_resolved_and_moved(self):
+        before = [
+            Diagnostic("a.cpt", 3, None, "CC001", "No href."),
+            Diagnostic("a.cpt", 5, None, "CC002", "No alt."),
+            Diagnostic("a.cpt", 7, None, "CC002", "No alt."),
+        ]
+        after = [
+            Diagnostic("a.cpt", 3, None, "CC001", "No href."),
+            # Moved down by a line.
+            Diagnostic("a.cpt", 6, None, "CC002", "No alt."),
+            Diagnostic("a.cpt", 9, None, "CC003", "No content."),
+        ]
+        new, resolved = compare(before, after)
+        self.assertEqual([after[2]], new)
+        self.assertEqual([before[2]], resolved)
+        self.assertEqual(([], []), compare(after, after))
+
+
+class TestRun(WatchTestCase):
+    def test_only_changes_are_printed(self):
+        self.given_file("t/a.cpt", IMG_MISSING_ALT)
+        self.given_file("t/b.cpt", VALID)
+        watcher = FakeWatcher(
+            # Fixed.
+            (self.writing("t/a.cpt", VALID), ["t/a.cpt"]),
+            # Broken.
+            (
+                self.writing("t/b.cpt", IMG_MISSING_ALT),
+                ["t/.b.cpt.swp"],
+                ["t/b.cpt"],
+            ),
+            # Moved down, not reported again.
+            (self.writing("t/b.cpt", "\n" + IMG_MISSING_ALT), ["t/b.cpt"]),
+            # A new template is found, other files are not checked.
+            (self.writing("t/c.cpt", IMG_MISSING_ALT), ["t/c.cpt"]),
+            (self.writing("t/notes.txt", IMG_MISSING_ALT), ["t/notes.txt"]),
+            # Removed templates have their errors resolved.
+            (lambda: os.unlink("t/c.cpt"), ["t/c.cpt"]),
+        )
+        stream = io.StringIO()
+        with OutputCapture(separate=True) as output:
+            self.assertEqual(
+                1, run(["t"], watcher=watcher, stream=stream, result_cache=None)
+            )
+        self.assertTrue(watcher.closed)
+        self.assertEqual(
+            [
+                "t/a.cpt:3",
+                "- t/a.cpt:3",
+                "+ t/b.cpt:3",
+                "+ t/c.cpt:3",
+                "- t/c.cpt:3",
+            ],
+            [line.split(" The")[0] for line in stream.getvalue().splitlines()],
+        )
+        # The text file does not count as a change.
+        self.assertEqual(5, len(output.stderr.getvalue().splitlines()))
+        self.assertIn("1 new, 0 resolved, 1 in total.", output.stderr.getvalue())
+
+    def test_clean_exit(self):
+        self.given_file("t/a.cpt", VALID)
+        stream = io.StringIO()
+        self.assertEqual(0, run(["t"], watcher=FakeWatcher(), stream=stream))
+        self.assertEqual("", stream.getvalue())
+
+    def test_users_of_changed_macros_are_checked(self):
+        from check_chameleon.macros import MacroIndex
+        from check_chameleon.tests.test_macros import LAYOUT, PAGE
+
+        self.given_file("layout.cpt", LAYOUT.replace("<span", "Next<span"))
+        self.given_file("page.cpt", PAGE)
+        index = MacroIndex()
+        index.update(["layout.cpt", "page.cpt"])
+        watcher = FakeWatcher(
+            (self.writing("layout.cpt", LAYOUT), ["layout.cpt"]),
+        )
+        stream = io.StringIO()
+        with OutputCapture():
+            run(["."], watcher=watcher, stream=stream, macros=index)
+        (line,) = stream.getvalue().splitlines()
+        self.assertTrue(line.startswith("+ ./page.cpt:3 In macro page"), line)
+
+    def test_main(self):
+        self.given_file("t/a.cpt", IMG_MISSING_ALT)
+        with (
+            unittest.mock.patch.object(
+                check_chameleon.watch, "open_watcher", lambda paths: FakeWatcher()
+            ),
+            OutputCapture() as output,
+        ):
+            self.assertEqual(
+                1,
+                check_chameleon.check_chameleon.main(["--no-cache", "--watch", "t"]),
+            )
+        self.assertTrue(output.captured.startswith("t/a.cpt:3 "))
+        with OutputCapture(), self.assertRaises(SystemExit):
+            check_chameleon.check_chameleon.main(["--watch", "--diff", "t"])
+
+
+class TestWatchers(WatchTestCase):
+    def test_inotify(self):
+        self.given_file("t/a.cpt", VALID)
+        self.given_file("other/b.cpt", VALID)
+        watcher = InotifyWatcher(["t", "other/b.cpt"])
+        self.addCleanup(watcher.close)
+        self.assertEqual(set(), watcher.wait(0))
+        self.given_file("t/a.cpt", IMG_MISSING_ALT)
+        self.given_file("other/b.cpt", IMG_MISSING_ALT)
+        self.assertEqual(
+            {os.path.abspath("t/a.cpt"), os.path.abspath("other/b.cpt")},
+            watcher.wait(1),
+        )
+        # New directories are watched, with what is in them already.
+        os.makedirs("t/new/deeper")
+        self.given_file("t/new/deeper/c.cpt", VALID)
+        changed = set()
+        while more := watcher.wait(0.1):
+            changed |= more
+        self.assertIn(os.path.abspath("t/new/deeper/c.cpt"), changed)
+        self.given_file("t/new/deeper/d.cpt", VALID)
+        self.assertIn(os.path.abspath("t/new/deeper/d.cpt"), watcher.wait(1))
+        shutil.rmtree("t/new")
+        changed = set()
+        while more := watcher.wait(0.1):
+            changed |= more
+        self.assertIn(os.path.abspath("t/new/deeper/d.cpt"), changed)
+        watcher.add(os.path.abspath("missing"))
+        self.assertNotIn(os.path.abspath("missing"), watcher.directories.values())
+
+    def test_inotify_read_interrupted(self):
+        self.given_file("t/a.cpt", VALID)
+        watcher = InotifyWatcher(["t"])
+        self.addCleanup(watcher.close)
+        self.given_file("t/a.cpt", IMG_MISSING_ALT)
+        with unittest.mock.patch("os.read", side_effect=BlockingIOError):
+            self.assertEqual(set(), watcher.wait(1))
+
+    def test_polling_fallback(self):
+        self.given_file("t/a.cpt", VALID)
+        libc = unittest.mock.Mock()
+        libc.inotify_init1.return_value = -1
+        with unittest.mock.patch("ctypes.CDLL", return_value=libc):
+            watcher = open_watcher(["t"])
+        self.assertIsInstance(watcher, PollingWatcher)
+        watcher.close()
+        self.assertIsInstance(open_watcher(["t"]), InotifyWatcher)
+
+    def test_polling(self):
+        self.given_file("t/sub/a.cpt", VALID)
+        watcher = PollingWatcher(["t"], interval=0.01)
+        self.assertEqual(set(), watcher.wait(0.03))
+        self.given_file("t/sub/a.cpt", IMG_MISSING_ALT)
+        self.given_file("t/b.cpt", VALID)
+        self.assertEqual(
+            {os.path.abspath("t/sub/a.cpt"), os.path.abspath("t/b.cpt")},
+            watcher.wait(None),
+        )
+        # Directories of files that are gone are skipped.
+        watcher = PollingWatcher(["t", "gone/c.cpt"], interval=0.01)
+        os.unlink("t/b.cpt")
+        self.assertEqual({os.path.abspath("t/b.cpt")}, watcher.wait(None))
@@ -0,0 +1,292 @@
+"""Check templates again as they change, see `check-chameleon --watch`.
+
+The first run checks all templates, then each batch of changes only checks
+the changed templates and prints the diagnostics that are new, prefixed with
+`+`, and the ones that are resolved, prefixed with `-`. The process stays
+alive between changes, so parsers, compiled XPath expressions, the loaded
+checks and the results of all templates stay in memory.
+
+Changes are noticed through inotify on Linux, by polling elsewhere.
+"""
+
+import collections
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+import typing
+
+from check_chameleon import check_chameleon as core
+from check_chameleon import discover
+from check_chameleon.diagnostics import Diagnostic
+
+# Changes are collected until none came in for this many seconds, as
+# editors often write a file in several steps.
+DEBOUNCE = 0.05
+
+POLL_INTERVAL = 0.5
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT = struct.Struct("iIII")
+
+
+def _directories(paths: typing.Iterable[str]) -> list[str]:
+    """Return the directories to watch for `paths`, recursively."""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(os.path.dirname(os.path.abspath(path)))
+            continue
+        for directory, names, _ in os.walk(os.path.abspath(path)):
+            names[:] = sorted(name for name in names if name != ".git")
+            found.append(directory)
+    return list(dict.fromkeys(found))
+
+
+class InotifyWatcher:
+    """Wait for changes in directories with the inotify API of Linux."""
+
+    def __init__(self, paths: typing.Iterable[str]):
+        name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(name, use_errno=True)
+        # Raises AttributeError where there is no inotify.
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in _directories(paths):
+            self.add(directory)
+
+    def add(self, directory: str) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def wait(self, timeout: float | None) -> set[str]:
+        """Return the paths changed within `timeout` seconds, or forever."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch new directories, and check what is in them.
+                    for added in _directories([path]):
+                        self.add(added)
+                        changed.update(
+                            os.path.join(added, entry) for entry in os.listdir(added)
+                        )
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wait for changes by comparing the size and time of the files."""
+
+    def __init__(self, paths: typing.Iterable[str], interval: float = POLL_INTERVAL):
+        self.paths = list(paths)
+        self.interval = interval
+        self.stamps = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        stamps = {}
+        for directory in _directories(self.paths):
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                # Files may go away while scanning.
+                with contextlib.suppress(OSError):
+                    if entry.is_file():
+                        stat = entry.stat()
+                        stamps[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return stamps
+
+    def wait(self, timeout: float | None) -> set[str]:
+        """Return the paths changed within `timeout` seconds, or forever."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay < 0:
+                    return set()
+            time.sleep(delay)
+            stamps = self.scan()
+            changed = {
+                path
+                for path in stamps.keys() | self.stamps.keys()
+                if stamps.get(path) != self.stamps.get(path)
+            }
+            self.stamps = stamps
+            if changed:
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(paths: typing.Iterable[str]):
+    """Return a watcher using inotify if possible, else polling."""
+    paths = list(paths)
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError):
+        return PollingWatcher(paths)
+
+
+def _without(diagnostics: list[Diagnostic], counts, key=None) -> list[Diagnostic]:
+    """Return `diagnostics` less `counts` of each (key of a) diagnostic."""
+    counts = counts.copy()
+    kept = []
+    for diagnostic in diagnostics:
+        found = diagnostic if key is None else key(diagnostic)
+        if counts[found] > 0:
+            counts[found] -= 1
+        else:
+            kept.append(diagnostic)
+    return kept
+
+
+def _kind(diagnostic: Diagnostic) -> tuple[str, str]:
+    return diagnostic.code, diagnostic.message
+
+
+def compare(
+    before: list[Diagnostic], after: list[Diagnostic]
+) -> tuple[list[Diagnostic], list[Diagnostic]]:
+    """Return the diagnostics new in `after` and the ones resolved since `before`.
+
+    Diagnostics that only moved to another line, as lines were added or
+    removed above them, are neither.
+    """
+    unchanged = collections.Counter(before) & collections.Counter(after)
+    added = _without(after, unchanged)
+    removed = _without(before, unchanged)
+    moved = collections.Counter(map(_kind, added)) & collections.Counter(
+        map(_kind, removed)
+    )
+    return _without(added, moved, _kind), _without(removed, moved, _kind)
+
+
+def run(
+    paths: typing.Sequence[str],
+    include: typing.Iterable[str] = discover.DEFAULT_INCLUDE,
+    exclude: typing.Iterable[str] = (),
+    jobs: int = 0,
+    result_cache=None,
+    watcher=None,
+    debounce: float = DEBOUNCE,
+    stream: typing.TextIO | None = None,
+    **options,
+) -> int:
+    """Check the templates in `paths`, then again whenever they change.
+
+    Runs until interrupted. `options` are passed to `check_file()`.
+    """
+    if stream is None:
+        stream = sys.stdout
+    include = tuple(include)
+    exclude = tuple(exclude)
+    templates = list(discover.find_templates(paths, include, exclude))
+    # Diagnostics by absolute path, and the name each template is shown by.
+    results = {}
+    names = {}
+    for filename, result in core.check_files(
+        templates, jobs=jobs, result_cache=result_cache, **options
+    ):
+        path = os.path.abspath(filename)
+        names[path] = filename
+        results[path] = result.diagnostics
+        for diagnostic in result.diagnostics:
+            print(diagnostic, file=stream)
+    stream.flush()
+    # Only names matching an include glob can be new templates, so editor
+    # swap files do not lead to walking the directories again.
+    could_be_template = discover._glob(include)
+    macros = options.get("macros")
+    if watcher is None:
+        watcher = open_watcher(paths)
+    try:
+        while True:
+            changed = watcher.wait(None)
+            while more := watcher.wait(debounce):
+                changed |= more
+            start = time.perf_counter()
+            if any(
+                path not in names
+                and could_be_template(os.path.basename(path), os.path.relpath(path))
+                for path in changed
+            ):
+                for filename in discover.find_templates(paths, include, exclude):
+                    names.setdefault(os.path.abspath(filename), filename)
+            changed = {path for path in changed if path in names}
+            if macros is not None:
+                macros.update([*macros.files, *changed])
+                changed.update(
+                    path for path in macros.dependents(changed) if path in names
+                )
+            new_count = resolved_count = 0
+            for path in sorted(changed, key=names.get):
+                before = results.pop(path, [])
+                after = []
+                if os.path.exists(path):
+                    after = core.check_file(names[path], **options).diagnostics
+                    results[path] = after
+                else:
+                    del names[path]
+                new, resolved = compare(before, after)
+                for diagnostic in new:
+                    print(f"+ {diagnostic}", file=stream)
+                for diagnostic in resolved:
+                    print(f"- {diagnostic}", file=stream)
+                new_count += len(new)
+                resolved_count += len(resolved)
+            stream.flush()
+            if changed:
+                print(
+                    f"Checked {len(changed)} files in"
+                    f" {(time.perf_counter() - start) * 1000:.0f} ms:"
+                    f" {new_count} new, {resolved_count} resolved,"
+                    f" {sum(map(len, results.values()))} in total.",
+                    file=sys.stderr,
+                )
+    except KeyboardInterrupt:
+        return 1 if any(results.values()) else 0
+    finally:
+        watcher.close()